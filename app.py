@@ -1,22 +1,45 @@
 import os
 import secrets
 import requests
-from flask import Flask, request, redirect, session, render_template, url_for
+from flask import Flask, request, redirect, session, render_template, url_for, jsonify
 from dotenv import load_dotenv
 from urllib.parse import urlencode
 import logging 
+import log_utils
+import metrics
 import shopify_client # Added
+import shopify_async_client
+import templating
+import rate_limiter
+import cart as cart_model
+import catalog
+import circuit_breaker
+import customers
+import orders
+import queries
+import webhooks
+from webhook_queue import WebhookQueue, WebhookWorker, WEBHOOK_WORKER_ENABLED
+from cache import TTLCache
+from token_store import create_token_store
+from cart_store import create_cart_store
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Configure logging (LOG_LEVEL, token redaction; see log_utils.py)
+log_utils.configure_logging()
 logger = logging.getLogger(__name__) # Added
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16) # Used for session management
+# Used for session management. Set FLASK_SECRET_KEY when running more than one worker
+# process, otherwise each worker signs cookies with a different random key.
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or secrets.token_hex(16)
+
+# Per-endpoint request and template render timings, exposed with the Shopify API metrics at /metrics.
+if metrics.METRICS_ENABLED:
+    metrics.init_app(app)
+# Fragment caching ({% call cache_fragment(...) %}) for the product pages.
+templating.init_app(app)
 
 SHOPIFY_API_KEY = os.getenv("SHOPIFY_API_KEY")
 SHOPIFY_API_SECRET = os.getenv("SHOPIFY_API_SECRET")
@@ -27,46 +50,81 @@ SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2025-04") # Default to a
 
 SHOPIFY_SCOPES = "read_customers,write_customers,read_orders,write_orders,write_discounts,read_discounts,read_products,write_draft_orders,read_draft_orders" # Updated scopes
 
-# In-memory store for access tokens (for simplicity, replace with a database in production)
-# Structure: { 'shop_domain.myshopify.com': 'access_token_value' }
-active_shops = {}
-
-# GraphQL query for customer search
-CUSTOMER_SEARCH_QUERY = """
-query searchCustomers($query: String!) {
-  customers(first: 10, query: $query) {
-    edges {
-      node {
-        id
-        firstName
-        lastName
-        email: defaultEmailAddress {
-          emailAddress
-        }
-        phone: defaultPhoneNumber {
-          phoneNumber
-        }
-        addresses(first: 5) {
-          address1
-          address2
-          city
-          zip
-          provinceCode
-          countryCodeV2
-          formatted
-          phone
-        }
-      }
-    }
-  }
-}
-"""
+# Persistent store for access tokens, shared by all worker processes.
+# Keyed by 'shop_domain.myshopify.com'; the session cookie only carries the shop domain.
+token_store = create_token_store()
+
+# Server-side cart and page state, keyed by a short random ID kept in the session cookie.
+cart_store = create_cart_store()
+
+# Short-lived cache of order details keyed by (shop, order GID, field-selection profile),
+# so customers polling /order-status don't each cost a getOrder query. Entries are
+# primed on checkout and dropped by the orders/fulfillments webhooks below. Expired
+# entries are still served for ORDER_CACHE_STALE_TTL while the shop's circuit is open.
+ORDER_CACHE_TTL = float(os.getenv("ORDER_CACHE_TTL", "60"))
+order_cache = TTLCache("order_details", ttl=ORDER_CACHE_TTL,
+                       max_entries=int(os.getenv("ORDER_CACHE_MAX_ENTRIES", "5000")),
+                       stale_ttl=float(os.getenv("ORDER_CACHE_STALE_TTL", "600")))
+
+# Customer typeahead. API fallback results (used while a shop's customer index is
+# cold or has no match) are cached briefly so repeated keystrokes don't re-query.
+CUSTOMER_SUGGEST_LIMIT = int(os.getenv("CUSTOMER_SUGGEST_LIMIT", "10"))
+CUSTOMER_SUGGEST_MIN_CHARS = int(os.getenv("CUSTOMER_SUGGEST_MIN_CHARS", "2"))
+customer_suggest_cache = TTLCache("customer_suggest", ttl=float(os.getenv("CUSTOMER_SUGGEST_CACHE_TTL", "30")),
+                                  max_entries=int(os.getenv("CUSTOMER_SUGGEST_CACHE_MAX_ENTRIES", "2000")))
+
+# Webhooks are verified and logged by the request path, then applied to this process's
+# caches by a background worker; every process applies every event (see webhook_queue.py).
+# Set WEBHOOK_WORKER_ENABLED=false to only log events in this process.
+webhook_queue = WebhookQueue()
+webhook_worker = WebhookWorker(webhook_queue)
+if WEBHOOK_WORKER_ENABLED:
+    webhook_worker.start()
+
+# Define a list of countries. In a real app, this could be more comprehensive
+# or loaded from a configuration file.
+# Using a subset based on the error message and common countries.
+COUNTRIES = [
+    ("US", "United States"),
+    ("CA", "Canada"),
+    ("GB", "United Kingdom"),
+    ("IN", "India"),
+    ("AU", "Australia"),
+    ("DE", "Germany"),
+    ("FR", "France"),
+    ("JP", "Japan"),
+    ("CN", "China"),
+    ("BR", "Brazil"),
+    # Add more countries as needed from the list provided in the error message
+    # For example:
+    ("AF", "Afghanistan"), ("AL", "Albania"), ("DZ", "Algeria"), 
+    ("AE", "United Arab Emirates"), ("ZW", "Zimbabwe")
+]
+
+def get_authenticated_shop():
+    """
+    Returns (shop_url, access_token) for the current session, or (shop_url, None)
+    if the shop has not completed OAuth (or its token was removed).
+    """
+    shop_url = session.get('shop_url')
+    access_token = token_store.get(shop_url) if shop_url else None
+    return shop_url, access_token
+
+def get_cart_session_id() -> str:
+    """
+    Returns the cart store ID for the current visitor, assigning one if needed.
+    """
+    sid = session.get('sid')
+    if not sid:
+        sid = secrets.token_urlsafe(16)
+        session['sid'] = sid
+    return sid
 
 @app.route('/')
 def index():
     logger.info("Accessing index route. Always redirecting to connect_store to simulate fresh flow.")
     # To ensure a fresh flow, we always redirect to the connect_store page from the root.
-    # Session variables like 'shop_url' and 'access_token' will be set during the OAuth process,
+    # The 'shop_url' session variable (and the stored access token) will be set during the OAuth process,
     # but this direct redirect bypasses checking them at the entry point.
     return redirect(url_for('connect_store'))
 
@@ -83,20 +141,20 @@ def install():
         logger.error("Shop parameter missing in install request.") # Added
         return "Error: Missing shop parameter.", 400
     
-    logger.info(f"Install request for shop: {shop}") # Added
+    logger.info("Install request for shop: %s", shop) # Added
     # Ensure shop has .myshopify.com, if not, append it
     if not shop.endswith(".myshopify.com"):
         shop = f"{shop}.myshopify.com"
-        logger.info(f"Appended .myshopify.com. Shop is now: {shop}") # Added
+        logger.info("Appended .myshopify.com. Shop is now: %s", shop) # Added
 
     # Generate a unique state token for CSRF protection
     state = secrets.token_hex(16)
     session['oauth_state'] = state
-    logger.info(f"Generated OAuth state: {state} for shop: {shop}") # Added
+    logger.info("Generated OAuth state for shop: %s", shop) # Added
     
     # Construct the Shopify authorization URL
     redirect_uri = url_for('oauth_callback', _external=True)
-    logger.info(f"Redirect URI for OAuth: {redirect_uri}") # Added
+    logger.info("Redirect URI for OAuth: %s", redirect_uri) # Added
     auth_url_params = {
         'client_id': SHOPIFY_CLIENT_ID,
         'scope': SHOPIFY_SCOPES,
@@ -105,26 +163,31 @@ def install():
         # 'grant_options[]': 'per-user' # Optional: for online access mode
     }
     auth_url = f"https://{shop}/admin/oauth/authorize?{urlencode(auth_url_params)}"
-    logger.info(f"Redirecting to Shopify auth URL: {auth_url}") # Added
+    logger.info("Redirecting to Shopify auth URL: %s", auth_url) # Added
     
     return redirect(auth_url)
 
+# One-time OAuth values that must not reach the logs.
+OAUTH_CALLBACK_SECRET_ARGS = ("code", "state", "hmac")
+
 @app.route('/oauth/callback')
 def oauth_callback():
-    logger.info(f"Accessing oauth_callback route with args: {request.args}") # Added
+    logger.info("Accessing oauth_callback route with args: %s", log_utils.payload({
+        key: log_utils.REDACTED if key in OAUTH_CALLBACK_SECRET_ARGS else value for key, value in request.args.items()
+    })) # Added
     # Validate state parameter for CSRF protection
     if request.args.get('state') != session.pop('oauth_state', None):
-        logger.warning(f"Invalid OAuth state. Expected: {session.get('oauth_state')}, Got: {request.args.get('state')}") # Added
+        logger.warning("Invalid OAuth state for shop: %s", request.args.get('shop')) # Added
         return "Error: Invalid state parameter.", 403
 
     shop_url = request.args.get('shop')
     code = request.args.get('code')
 
     if not shop_url or not code:
-        logger.error(f"Missing shop_url or code in OAuth callback. Shop: {shop_url}, Code: {code}") # Added
+        logger.error("Missing shop_url or code in OAuth callback. Shop: %s, Code present: %s", shop_url, bool(code)) # Added
         return "Error: Missing shop or code parameter.", 400
 
-    logger.info(f"OAuth callback for shop: {shop_url} with authorization code.") # Added
+    logger.info("OAuth callback for shop: %s with authorization code.", shop_url) # Added
     # Exchange authorization code for an access token
     token_url = f"https://{shop_url}/admin/oauth/access_token"
     payload = {
@@ -133,192 +196,262 @@ def oauth_callback():
         "code": code,
     }
     
-    logger.info(f"Requesting access token from: {token_url}") # Added
+    logger.info("Requesting access token from: %s", token_url) # Added
     try:
-        response = requests.post(token_url, json=payload)
+        response = requests.post(token_url, json=payload, timeout=shopify_client.get_timeout())
         response.raise_for_status() # Raise an exception for HTTP errors
         token_data = response.json()
         access_token = token_data.get('access_token')
 
         if access_token:
-            active_shops[shop_url] = access_token
+            token_store.set(shop_url, access_token, token_data.get('scope'))
             session['shop_url'] = shop_url
-            session['access_token'] = access_token # Store in session for current user
-            logger.info(f"Successfully obtained access token for {shop_url}. Token: {access_token}") # Masked token
-            # In a real app, you'd store this token securely, likely in a database,
-            # associated with the shop_url.
+            logger.info("Successfully obtained access token for %s.", shop_url) # Never log the token itself
             return redirect(url_for('product_search_page')) # Changed redirect to product_search_page
         else:
-            logger.error(f"Could not retrieve access token for {shop_url}. Response data: {token_data}") # Added
+            logger.error("Could not retrieve access token for %s. Response data: %s", shop_url, log_utils.payload(token_data)) # Added
             return "Error: Could not retrieve access token.", 500
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error during token exchange for {shop_url}: {e}", exc_info=True) # Added exc_info for traceback
+        logger.error("Error during token exchange for %s: %s", shop_url, e, exc_info=True) # Added exc_info for traceback
         return f"Error during token exchange: {e}", 500
 
 
-def search_customers_by_name(shop_url: str, access_token: str, search_query: str) -> list:
+def search_customers_by_name(shop_url: str, access_token: str, search_query: str, num_customers: int = 10) -> list:
     """Searches for customers by name using the Shopify Admin API."""
-    headers = {
-        "X-Shopify-Access-Token": access_token,
-        "Content-Type": "application/json"
-    }
-    
     # The search_query itself will be used, enclosed in double quotes
     # Example: if search_query is "Apoorv", the variable 'query' will be "\"Apoorv\""
-    # This assumes your CUSTOMER_SEARCH_QUERY expects a simple string for the 'query' variable.
-    payload = {
-        'query': CUSTOMER_SEARCH_QUERY,
-        'variables': {'query': f'"{search_query}"'} # Use search_query directly, enclosed in quotes
-    }
-    
-    # Debugging: Log types of payload components
-    logger.debug(f"Type of CUSTOMER_SEARCH_QUERY: {type(CUSTOMER_SEARCH_QUERY)}")
-    # logger.debug(f"Type of query_filter: {type(query_filter)}") # query_filter removed
-    logger.debug(f"Type of payload['variables']: {type(payload['variables'])}")
-    logger.debug(f"Type of payload['variables']['query']: {type(payload['variables']['query'])}")
-    logger.debug(f"Payload before sending: {payload}")
-
-    api_url = f"https://{shop_url}/admin/api/{SHOPIFY_API_VERSION}/graphql.json"
-    logger.info(f"Searching for customers with query: {search_query} on {shop_url}")
+    # This assumes your SEARCH_CUSTOMERS_QUERY expects a simple string for the 'query' variable.
+    variables = {'query': f'"{search_query}"', 'first': num_customers} # Use search_query directly, enclosed in quotes
+    logger.debug("Customer search variables: %s", log_utils.payload(variables))
+
+    logger.info("Searching for customers with query: %s on %s", search_query, shop_url)
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
-        logger.info(f"response from customer search: {response.json()}")
-        response.raise_for_status()
-        data = response.json().get('data', {})
-        customers_data = data.get('customers', {}).get('edges', [])
-        logger.info(f"Customer search response received. Number of edges: {len(customers_data)}")
+        # Goes through the shared client so the call uses the pooled session and
+        # is scheduled against the shop's query cost budget.
+        response_data = shopify_client.make_graphql_request(shop_url, access_token, queries.SEARCH_CUSTOMERS_QUERY, variables)
+        logger.debug("response from customer search: %s", log_utils.payload(response_data))
+        data = response_data.get('data') or {}
+        customers_data = (data.get('customers') or {}).get('edges', [])
+        logger.info("Customer search response received. Number of edges: %s", len(customers_data))
         return customers_data
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error searching customers: {http_err} - Response: {response.text}", exc_info=True)
-        return []
     except requests.exceptions.RequestException as req_err:
-        logger.error(f"Request error searching customers: {req_err}", exc_info=True)
+        logger.error("Request error searching customers: %s", req_err, exc_info=True)
         return []
     except ValueError as json_err: # Includes JSONDecodeError
-        logger.error(f"JSON decoding error searching customers: {json_err}", exc_info=True)
+        logger.error("JSON decoding error searching customers: %s", json_err, exc_info=True)
         return []
     except Exception as e:
-        # This will catch the TypeError if it's still happening before the request is made
-        logger.error(f"An unexpected error occurred during customer search preparation or execution: {e}", exc_info=True)
+        logger.error("An unexpected error occurred during customer search preparation or execution: %s", e, exc_info=True)
         return []
 
 @app.route('/customer-search', methods=['GET', 'POST'])
 def customer_search_page():
-    logger.info(f"Accessing customer_search_page. Method: {request.method}")
-    shop_url = session.get('shop_url')
-    access_token = session.get('access_token')
+    logger.info("Accessing customer_search_page. Method: %s", request.method)
+    shop_url, access_token = get_authenticated_shop()
 
     if not shop_url or not access_token:
         logger.warning("User not authenticated or session expired. Redirecting to connect.")
         return redirect(url_for('connect_store'))
 
-    customers = []
+    sid = get_cart_session_id()
+    customer_results = []
     customer_search_term = ""
+    customers.ensure_fresh(shop_url, access_token)
 
     if request.method == 'POST':
         customer_search_term = request.form.get('customer_search_query', '').strip()
-        logger.info(f"Customer search initiated for term: '{customer_search_term}' on shop: {shop_url}")
+        logger.info("Customer search initiated for term: '%s' on shop: %s", customer_search_term, shop_url)
         if customer_search_term:
             customers_data = search_customers_by_name(shop_url, access_token, customer_search_term)
             # Simplify customer data for template
             for edge in customers_data:
-                node = edge.get('node', {})
-                # Extract email and phone safely
-                email_node = node.get('email')
-                email_address = email_node.get('emailAddress') if email_node else 'N/A'
-                
-                phone_node = node.get('phone')
-                phone_number = phone_node.get('phoneNumber') if phone_node else 'N/A'
-
-                customers.append({
-                    'id': node.get('id'),
-                    'firstName': node.get('firstName'),
-                    'lastName': node.get('lastName'),
-                    'email': email_address,
-                    'phone': phone_number,
-                    'addresses': node.get('addresses', [])
-                })
+                customer_results.append(customers.simplify_customer(edge.get('node', {})))
         else:
             logger.info("Empty customer search term provided.")
 
-    return render_template('products.html', 
-                           shop_url=shop_url, 
-                           customers=customers, 
-                           customer_search_term=customer_search_term,
-                           # Make sure to pass other variables needed by products.html
-                           products=session.get('current_products', []), 
-                           search_term=session.get('last_product_search', ''),
-                           cart_items=session.get('cart_items_display', []),
-                           total_cart_value=session.get('total_cart_value_display', 0.0),
-                           countries=session.get('countries_for_template', []))
+    return templating.stream_page('products.html',
+                                  shop_url=shop_url, 
+                                  customers=customer_results, 
+                                  customer_search_term=customer_search_term,
+                                  # Make sure to pass other variables needed by products.html
+                                  products=cart_store.get_state(sid, 'current_products', []), 
+                                  search_term=cart_store.get_state(sid, 'last_product_search', ''),
+                                  cart_items=list(cart_store.get_cart(sid).values()),
+                                  total_cart_value=cart_store.get_totals(sid).subtotal,
+                                  countries=COUNTRIES)
+
 
+@app.route('/api/customers/suggest')
+def suggest_customers():
+    """
+    Typeahead suggestions for the checkout form. Answered from the local customer
+    index; the Admin API is only queried while the index is cold or when it has no match.
+    """
+    shop_url, access_token = get_authenticated_shop()
+    if not shop_url or not access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    term = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', CUSTOMER_SUGGEST_LIMIT, type=int), CUSTOMER_SUGGEST_LIMIT)
+    if len(term) < CUSTOMER_SUGGEST_MIN_CHARS:
+        return jsonify({"customers": [], "source": "none"})
+
+    customers.ensure_fresh(shop_url, access_token)
+    results = customers.suggest(shop_url, term, limit)
+    if results:
+        return jsonify({"customers": results, "source": "index"})
+
+    cache_key = (shop_url, term.lower(), limit)
+    results = customer_suggest_cache.get(cache_key)
+    if results is None:
+        index = customers.get_index(shop_url)
+        results = []
+        for edge in search_customers_by_name(shop_url, access_token, term, limit):
+            node = edge.get('node', {})
+            # Remember API hits so the next keystroke is served locally.
+            index.upsert(node, advance_high_water_mark=False)
+            results.append(customers.simplify_customer(node))
+        customer_suggest_cache.set(cache_key, results)
+    return jsonify({"customers": results, "source": "api"})
+
+def find_products(shop_url: str, access_token: str, search_term: str) -> list:
+    """
+    Searches products (local catalog index when warm, otherwise the Admin API) and
+    returns them simplified for templates and JSON responses.
+    """
+    catalog.ensure_fresh(shop_url, access_token)
+    products_data = catalog.search(shop_url, search_term)
+    source = "index"
+    if products_data is None:
+        products_data = shopify_client.search_products(shop_url, access_token, search_term, profile="list")
+        source = "api"
+    logger.debug("Products data received: %s", log_utils.payload(products_data))
+    if not products_data:
+        logger.info("No products found or error in search for term: '%s'", search_term)
+        return []
+    return [catalog.simplify_product(edge.get('node', {}), source) for edge in products_data.get('products') or [] if edge]
+
+def stored_search_results(sid: str, search_term: str) -> list:
+    """
+    The visitor's last product search results, if they are for `search_term`, so
+    cart changes can re-show them without searching again.
+    """
+    if search_term and cart_store.get_state(sid, 'last_product_search') == search_term:
+        return cart_store.get_state(sid, 'current_products', [])
+    return []
+
+def cart_payload(sid: str) -> dict:
+    """
+    Compact JSON view of the visitor's cart for the /api/cart endpoints.
+    """
+    totals = cart_store.get_totals(sid)
+    return {
+        "items": [
+            {"variant_id": item["variant_id"], "product_title": item.get("product_title"),
+             "variant_title": item.get("variant_title"), "price": item.get("price"), "quantity": item["quantity"]}
+            for item in cart_store.get_cart(sid).values()
+        ],
+        "item_count": totals.item_count,
+        "subtotal": str(totals.subtotal.quantize(cart_model.CENT)),
+    }
+
+@app.route('/api/cart', methods=['GET'])
+def get_cart_api():
+    shop_url, access_token = get_authenticated_shop()
+    if not shop_url or not access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    return jsonify(cart_payload(get_cart_session_id()))
+
+@app.route('/api/cart/items', methods=['POST'])
+def add_cart_item_api():
+    """
+    Adds a variant to the cart. Accepts JSON or form fields (variant_id, product_title,
+    variant_title, price, quantity) and returns the updated cart.
+    """
+    shop_url, access_token = get_authenticated_shop()
+    if not shop_url or not access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    data = request.get_json(silent=True) or request.form
+    variant_id = data.get('variant_id')
+    price = data.get('price', '0.00')
+    try:
+        quantity = int(data.get('quantity', 1))
+        cart_model.parse_price(price)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid price or quantity"}), 400
+    if not variant_id or quantity < 1:
+        return jsonify({"error": "variant_id and a positive quantity are required"}), 400
+
+    sid = get_cart_session_id()
+    cart_store.add_item(sid, {
+        'product_title': data.get('product_title', 'Unknown Product'),
+        'variant_title': data.get('variant_title', ''),
+        'price': str(price),
+        'quantity': quantity,
+        'variant_id': variant_id
+    })
+    logger.info("Added to cart: Variant ID %s, Qty: %s.", variant_id, quantity)
+    return jsonify(cart_payload(sid))
+
+@app.route('/api/cart/items', methods=['DELETE'])
+def remove_cart_item_api():
+    """
+    Removes a variant from the cart (?variant_id=..., or variant_id in a JSON body;
+    variant GIDs contain slashes, so they aren't part of the path) and returns the updated cart.
+    """
+    shop_url, access_token = get_authenticated_shop()
+    if not shop_url or not access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    variant_id = request.args.get('variant_id') or (request.get_json(silent=True) or {}).get('variant_id')
+    if not variant_id:
+        return jsonify({"error": "variant_id is required"}), 400
+    sid = get_cart_session_id()
+    if not cart_store.remove_item(sid, variant_id):
+        return jsonify({"error": "Item not in cart"}), 404
+    logger.info("Removed from cart: Variant ID %s.", variant_id)
+    return jsonify(cart_payload(sid))
+
+@app.route('/api/products/search')
+def search_products_api():
+    """
+    Product search for scripts and in-page updates. Results are also kept as the
+    visitor's last search, like a /products search.
+    """
+    shop_url, access_token = get_authenticated_shop()
+    if not shop_url or not access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    search_term = request.args.get('q', '').strip()
+    if not search_term:
+        return jsonify({"products": []})
+    sid = get_cart_session_id()
+    products = find_products(shop_url, access_token, search_term)
+    cart_store.set_state(sid, 'last_product_search', search_term)
+    cart_store.set_state(sid, 'current_products', products)
+    return jsonify({"products": [
+        {key: value for key, value in product.items() if key != 'descriptionHtml'} for product in products
+    ]})
 
 @app.route('/products', methods=['GET', 'POST'])
 def product_search_page():
-    logger.info(f"Accessing product_search_page. Method: {request.method}")
-    shop_url = session.get('shop_url')
-    access_token = session.get('access_token')
+    logger.info("Accessing product_search_page. Method: %s", request.method)
+    shop_url, access_token = get_authenticated_shop()
 
     if not shop_url or not access_token:
         logger.warning("User not authenticated or session expired. Redirecting to connect.")
         return redirect(url_for('connect_store'))
 
+    sid = get_cart_session_id()
     products = []
     search_term = ""
-    cart = session.get('cart', {}) # Initialize or get cart from session
-
-    # Define a list of countries. In a real app, this could be more comprehensive
-    # or loaded from a configuration file.
-    # Using a subset based on the error message and common countries.
-    countries = [
-        ("US", "United States"),
-        ("CA", "Canada"),
-        ("GB", "United Kingdom"),
-        ("IN", "India"),
-        ("AU", "Australia"),
-        ("DE", "Germany"),
-        ("FR", "France"),
-        ("JP", "Japan"),
-        ("CN", "China"),
-        ("BR", "Brazil"),
-        # Add more countries as needed from the list provided in the error message
-        # For example:
-        ("AF", "Afghanistan"), ("AL", "Albania"), ("DZ", "Algeria"), 
-        ("AE", "United Arab Emirates"), ("ZW", "Zimbabwe")
-    ]
 
     if request.method == 'POST':
         if 'search_query' in request.form:
             search_term = request.form.get('search_query', '').strip()
-            logger.info(f"Product search initiated for term: '{search_term}' on shop: {shop_url}")
+            logger.info("Product search initiated for term: '%s' on shop: %s", search_term, shop_url)
             if search_term:
-                products_data = shopify_client.search_products(shop_url, access_token, search_term)
-                # Simplify product data for template
-                logger.info(f"Products data received: {products_data}") 
-                if products_data: # Add this check
-                    for edge in products_data.get('products'):
-                        if edge: # Add this check to ensure edge is not None
-                            node = edge.get('node', {})
-                            variants = []
-                            if node.get('variants') and node['variants'].get('edges'):
-                                for var_edge in node['variants']['edges']:
-                                    var_node = var_edge.get('node', {})
-                                    variants.append({
-                                        'id': var_node.get('id'),
-                                        'title': var_node.get('title'),
-                                        'price': var_node.get('price'),
-                                        'image_url': var_node.get('image', {}).get('url') if var_node.get('image') else None
-                                    })
-                            products.append({
-                                'id': node.get('id'),
-                                'title': node.get('title'),
-                                'descriptionHtml': node.get('descriptionHtml'),
-                                'featuredImage_url': node.get('featuredImage', {}).get('url') if node.get('featuredImage') else None,
-                                'variants': variants
-                            })
-                else:
-                    logger.info(f"No products found or error in search for term: '{search_term}'")
+                products = find_products(shop_url, access_token, search_term)
+                cart_store.set_state(sid, 'last_product_search', search_term)
+                cart_store.set_state(sid, 'current_products', products)
             else:
                 logger.info("Empty search term provided.")
         
@@ -329,55 +462,50 @@ def product_search_page():
             price = request.form.get('price', '0.00') # For $0 orders, this will be 0
             quantity = int(request.form.get('quantity', 1))
 
+            try:
+                cart_model.parse_price(price)
+            except ValueError:
+                logger.warning("Could not parse price for variant %s. Price: %s", variant_id, price)
+                variant_id = None
+
             if variant_id:
-                item_key = variant_id
-                if item_key in cart:
-                    cart[item_key]['quantity'] += quantity
-                else:
-                    cart[item_key] = {
-                        'product_title': product_title,
-                        'variant_title': variant_title,
-                        'price': price, # Store price, even if it's 0
-                        'quantity': quantity,
-                        'variant_id': variant_id
-                    }
-                session['cart'] = cart
-                logger.info(f"Added to cart: Variant ID {variant_id}, Qty: {quantity}. Cart: {cart}")
-            # After adding to cart, we might want to re-display the page, potentially with the same search results
-            # For simplicity, we'll just re-render the template. If search_term was POSTed, it won't persist unless handled.
-            # For now, let's keep it simple and re-render.
+                cart_store.add_item(sid, {
+                    'product_title': product_title,
+                    'variant_title': variant_title,
+                    'price': price, # Store price, even if it's 0
+                    'quantity': quantity,
+                    'variant_id': variant_id
+                })
+                logger.info("Added to cart: Variant ID %s, Qty: %s.", variant_id, quantity)
             search_term = request.form.get('previous_search_term', '') # Try to retain search term
+            products = stored_search_results(sid, search_term)
 
         elif 'remove_from_cart' in request.form:
             variant_id_to_remove = request.form.get('variant_id')
-            if variant_id_to_remove in cart:
-                del cart[variant_id_to_remove]
-                session['cart'] = cart
-                logger.info(f"Removed from cart: Variant ID {variant_id_to_remove}. Cart: {cart}")
+            if variant_id_to_remove and cart_store.remove_item(sid, variant_id_to_remove):
+                logger.info("Removed from cart: Variant ID %s.", variant_id_to_remove)
             search_term = request.form.get('previous_search_term', '')
+            products = stored_search_results(sid, search_term)
 
     # Prepare cart items for display
-    cart_items_display = []
-    total_cart_value = 0.0 # This will be 0 for $0 orders
-    for item_id, item_details in cart.items():
-        cart_items_display.append(item_details)
-        # total_cart_value += float(item_details['price']) * item_details['quantity'] # For $0 orders, price is 0
+    cart_items_display = list(cart_store.get_cart(sid).values())
+    total_cart_value = cart_store.get_totals(sid).subtotal
 
-    return render_template('products.html', 
-                           shop_url=shop_url, 
-                           products=products, 
-                           search_term=search_term,
-                           cart_items=cart_items_display,
-                           total_cart_value=total_cart_value,
-                           countries=countries) # Pass countries to the template
+    return templating.stream_page('products.html',
+                                  shop_url=shop_url, 
+                                  products=products, 
+                                  search_term=search_term,
+                                  cart_items=cart_items_display,
+                                  total_cart_value=total_cart_value,
+                                  countries=COUNTRIES) # Pass countries to the template
 
 
 @app.route('/create-order', methods=['POST']) # Renamed route
 def create_order(): # Renamed function
     logger.info("Accessing create_order route.")
-    shop_url = session.get('shop_url')
-    access_token = session.get('access_token')
-    cart = session.get('cart', {})
+    shop_url, access_token = get_authenticated_shop()
+    sid = get_cart_session_id()
+    cart = cart_store.get_cart(sid)
 
     if not shop_url or not access_token:
         logger.warning("User not authenticated or session expired. Redirecting to connect.")
@@ -401,165 +529,96 @@ def create_order(): # Renamed function
     }
 
     # Get tags from form and process them
-    tags_string = request.form.get('tags')
-    tags_list = [tag.strip() for tag in tags_string.split(',') if tag.strip()] if tags_string else []
-
-    mandatory_fields = {
-        "email": email,
-        "firstName": shipping_address_input["firstName"],
-        "lastName": shipping_address_input["lastName"],
-        "address1": shipping_address_input["address1"],
-        "city": shipping_address_input["city"],
-        "countryCode": shipping_address_input["countryCode"],
-        "zip": shipping_address_input["zip"]
-    }
-    missing_fields = [key for key, value in mandatory_fields.items() if not value]
+    tags_list = orders.parse_tags(request.form.get('tags'))
+
+    missing_fields = orders.find_missing_fields(email, shipping_address_input)
     if missing_fields:
-        logger.error(f"Missing mandatory address fields: {', '.join(missing_fields)}")
+        logger.error("Missing mandatory address fields: %s", ', '.join(missing_fields))
         return f"Error: Missing mandatory address fields: {', '.join(missing_fields)}. Please go back and fill them.", 400
 
-    line_items_input = []
-    total_cart_value = 0.0
-    for item_id, item_details in cart.items():
-        line_items_input.append({
-            "variantId": item_details['variant_id'],
-            "quantity": item_details['quantity']
-        })
-        try:
-            item_price = float(item_details.get('price', 0.0))
-            total_cart_value += item_price * item_details['quantity']
-        except ValueError:
-            logger.warning(f"Could not convert price to float for item {item_id}. Price: {item_details.get('price')}")
-            # Decide how to handle this: skip item, assume 0, or raise error
-
-    logger.info(f"Total cart value calculated: {total_cart_value}")
-
-    # Calculate the discount value: total cart value - 1
-    # Ensure discount value is not negative if total_cart_value is less than 1
-    discount_value = round(max(0, (total_cart_value - 1/1.18)), 2)
-    logger.info(f"Calculated discount value: {discount_value}")
-
-    draft_order_input = {
-        "email": email,
-        "lineItems": line_items_input,
-        "shippingAddress": shipping_address_input,
-        "note": f"Order placed via Hypothesis app. Discounted by ${discount_value:.2f}.",
-        "customAttributes": [
-            {"key": "OrderSource", "value": "HypothesisApp"},
-            {"key": "PromotionDetails", "value": f"Fixed Amount Discount: ${discount_value:.2f}"}
-        ],
-        "appliedDiscount": {
-            "valueType": "FIXED_AMOUNT",
-            "value": discount_value,
-            "title": f"Hypothesis App Discount (${discount_value:.2f})"
-        },
-        "useCustomerDefaultAddress": False
-    }
+    line_items_input = [
+        {"variantId": item_details['variant_id'], "quantity": item_details['quantity']}
+        for item_details in cart.values()
+    ]
+    totals = cart_store.get_totals(sid)
+    logger.info("Cart total: %s (discount: %s)", totals.subtotal, totals.discount)
 
-    if tags_list:
-        draft_order_input["tags"] = tags_list
-
-    draft_order_create_mutation = """
-    mutation draftOrderCreate($input: DraftOrderInput!) {
-      draftOrderCreate(input: $input) {
-        draftOrder {
-          id
-          # Consider fetching invoiceUrl or order.id after completion for status page
-          invoiceUrl 
-        }
-        userErrors {
-          field
-          message
-        }
-      }
-    }
-    """
-    logger.info(f"Creating draft order for {shop_url} with input: {draft_order_input}")
-    
     try:
-        # Step 1: Create Draft Order
-        draft_order_response_data = shopify_client.make_graphql_request(
-            shop_url, access_token, draft_order_create_mutation, {"input": draft_order_input}
-        )
-        logger.info(f"Draft order creation response: {draft_order_response_data}")
-
-        draft_order_create_result = draft_order_response_data.get("data", {}).get("draftOrderCreate", {})
-        user_errors_draft = draft_order_create_result.get("userErrors")
-        if user_errors_draft:
-            error_messages = [f"{err.get('field', 'N/A')}: {err.get('message', 'Unknown error')}" for err in user_errors_draft]
-            logger.error(f"User errors on draft order creation: {error_messages}")
-            return f"Error creating draft order: {', '.join(error_messages)}", 400
-
-        draft_order_details = draft_order_create_result.get("draftOrder")
-        if not draft_order_details or not draft_order_details.get("id"):
-            logger.error(f"Failed to create draft order or missing draft order ID. Response: {draft_order_response_data}")
-            return "Failed to create draft order.", 500
-
-        draft_order_id = draft_order_details["id"]
-        logger.info(f"Draft order created successfully with ID: {draft_order_id}")
-
-        # Step 2: Complete Draft Order (marking as paid since it's 100% discounted)
-        draft_order_complete_payload = {
-            "id": draft_order_id,
-            "paymentPending": False # Since total should be $0, this marks it as paid
-        }
-        draft_order_complete_mutation = """
-        mutation draftOrderComplete($id: ID!, $paymentPending: Boolean) {
-          draftOrderComplete(id: $id, paymentPending: $paymentPending) {
-            draftOrder {
-              id # DraftOrder GID
-              order { # The actual Order object
-                id # Order GID
-                name
-                legacyResourceId
-              }
-            }
-            userErrors {
-              field
-              message
-            }
-          }
-        }
-        """
-        logger.info(f"Completing draft order for ID: {draft_order_id}")
-        order_response_data = shopify_client.make_graphql_request(
-            shop_url, access_token, draft_order_complete_mutation, draft_order_complete_payload
+        # Places the order with the configured checkout mode; the response already
+        # contains everything the status page shows.
+        order_details = orders.place_order(
+            shop_url, access_token, email, shipping_address_input, line_items_input, totals.subtotal, tags_list,
+            discount_value=totals.discount
         )
-        logger.info(f"Draft order complete response: {order_response_data}")
-
-        draft_order_complete_result = order_response_data.get("data", {}).get("draftOrderComplete", {})
-        user_errors_complete = draft_order_complete_result.get("userErrors")
-        if user_errors_complete:
-            error_messages = [f"{err.get('field', 'N/A')}: {err.get('message', 'Unknown error')}" for err in user_errors_complete]
-            logger.error(f"User errors on draft order completion: {error_messages}")
-            # Potentially delete the created draft order here if completion fails critically
-            return f"Error completing order from draft: {', '.join(error_messages)}", 400
-        
-        # Extract order details from the 'order' field nested within 'draftOrder'
-        completed_draft_order_node = draft_order_complete_result.get("draftOrder", {})
-        order_details = completed_draft_order_node.get("order")
-
-        if order_details and order_details.get('id'):
-            order_id_gid = order_details.get('id')
-            order_name = order_details.get('name')
-            logger.info(f"Order created successfully from draft: ID {order_id_gid}, Name: {order_name}")
-            session.pop('cart', None) # Clear the cart
-            return redirect(url_for('view_order_status', order_id_param=order_id_gid.split('/')[-1]))
-        else:
-            logger.error(f"Order completion response did not contain final order details or ID. Response: {order_response_data}")
-            # Potentially delete the created draft order here
-            return "Failed to create order: No final order details returned after draft completion.", 500
-
+    except orders.OrderCreationError as e:
+        return str(e), e.status_code
     except Exception as e:
-        logger.error(f"Exception during order creation via draft order: {e}", exc_info=True)
+        logger.error("Exception during order creation: %s", e, exc_info=True)
         return f"An error occurred during order creation: {e}", 500
 
+    cart_store.clear_cart(sid) # Clear the cart
+    order_cache.set((shop_url, order_details['id'], "full"), order_details)
+    # Hand the order data to the status page so it does not need a getOrder round trip.
+    cart_store.set_state(sid, 'completed_order', order_details)
+    return redirect(url_for('view_order_status', order_id_param=order_details['id'].split('/')[-1]))
+
+# Orders are fetched with nodes(ids: [...]) in batches whose predicted cost stays
+# under ORDER_BATCH_MAX_COST (Shopify rejects single queries above queries.MAX_QUERY_COST).
+ORDER_BATCH_MAX_COST = int(os.getenv("ORDER_BATCH_MAX_COST", "900"))
+ORDER_BATCH_MAX_IDS = int(os.getenv("ORDER_BATCH_MAX_IDS", "250"))
+
+def parse_order_ids(raw_ids: str) -> tuple:
+    """
+    Turns a comma/whitespace separated list of order IDs (numeric IDs or GIDs) into
+    de-duplicated Order GIDs, preserving input order. Returns (order_gids, rejected),
+    where `rejected` lists the tokens that are not order IDs. "#1001" is an order
+    name, not an ID, so "#"-prefixed tokens are rejected too.
+    """
+    order_gids = []
+    rejected = []
+    for token in raw_ids.replace(',', ' ').split():
+        if token.startswith('gid://shopify/Order/') and token.rsplit('/', 1)[-1].isdigit():
+            gid = token
+        elif token.isdigit():
+            gid = f"gid://shopify/Order/{token}"
+        else:
+            logger.warning("Ignoring invalid order ID in batch lookup: %s", token)
+            rejected.append(token)
+            continue
+        if gid not in order_gids:
+            order_gids.append(gid)
+    return order_gids, rejected
+
+@app.route('/order-status', methods=['GET', 'POST'])
+def view_orders_status():
+    logger.info("Accessing view_orders_status. Method: %s", request.method)
+    shop_url, access_token = get_authenticated_shop()
+
+    if not shop_url or not access_token:
+        logger.warning("User not authenticated or session expired. Redirecting to connect.")
+        return redirect(url_for('connect_store'))
+
+    raw_ids = request.form.get('order_ids', '') if request.method == 'POST' else request.args.get('ids', '')
+    order_gids, rejected = parse_order_ids(raw_ids)
+    error = None
+    if any(token.startswith('#') for token in rejected):
+        error = (f"Ignored {', '.join(rejected)}: enter numeric order IDs (from the order's admin URL), "
+                 "not order names like #1001.")
+    elif rejected:
+        error = f"Ignored invalid order IDs: {', '.join(rejected)}."
+    if len(order_gids) > ORDER_BATCH_MAX_IDS:
+        error = f"Please look up at most {ORDER_BATCH_MAX_IDS} orders at a time ({len(order_gids)} given)."
+        order_gids = []
+
+    orders_by_gid = get_orders_details(shop_url, access_token, order_gids, profile="list") if order_gids else {}
+    rows = [{'gid': gid, 'id': gid.split('/')[-1], 'order': orders_by_gid.get(gid)} for gid in order_gids]
+    return render_template('order_status_batch.html', rows=rows, raw_ids=raw_ids, error=error, shop_url=shop_url)
+
 # Renamed route and parameter for real orders
 @app.route('/order-status/<order_id_param>')
 def view_order_status(order_id_param):
-    logger.info(f"Accessing view_order_status for order_id_param: {order_id_param}")
-    shop_url = session.get('shop_url')
-    access_token = session.get('access_token')
+    logger.info("Accessing view_order_status for order_id_param: %s", order_id_param)
+    shop_url, access_token = get_authenticated_shop()
 
     if not shop_url or not access_token:
         logger.warning("User not authenticated or session expired. Redirecting to connect.")
@@ -568,128 +627,153 @@ def view_order_status(order_id_param):
     # Construct the full Order GID
     # Example GID: "gid://shopify/Order/1234567890"
     order_gid = f"gid://shopify/Order/{order_id_param}"
-    logger.info(f"Constructed Order GID: {order_gid}")
+    logger.info("Constructed Order GID: %s", order_gid)
 
-    order_data = get_order_details(shop_url, access_token, order_gid) # Call the function within app.py
+    # Right after checkout the order data is already known from the checkout response.
+    sid = get_cart_session_id()
+    order_data = cart_store.get_state(sid, 'completed_order')
+    if order_data and order_data.get('id') == order_gid:
+        logger.info("Rendering order %s from checkout response", order_gid)
+        cart_store.set_state(sid, 'completed_order', None)
+    else:
+        order_data = get_order_details(shop_url, access_token, order_gid) # Call the function within app.py
 
     return render_template('order_status.html', order_data=order_data, shop_url=shop_url)
 
-def get_order_details(shop_url: str, access_token: str, order_gid: str):
+def get_cached_order(shop_url: str, order_gid: str, profile: str = "full", allow_stale: bool = False):
     """
-    Fetches details for a specific real order using GraphQL.
-    This function is defined within app.py and uses shopify_client.make_graphql_request.
+    Returns a cached order with at least the fields of `profile` (a cached "full"
+    entry also serves "list" and "minimal" lookups), or None.
     """
-    logger.info(f"Fetching details for order GID: {order_gid} on shop: {shop_url} using app.py's get_order_details")
-    query = """
-    query getOrder($id: ID!) {
-      order(id: $id) {
-        id
-        name
-        legacyResourceId
-        email
-        createdAt
-        updatedAt
-        displayFinancialStatus
-        displayFulfillmentStatus
-        app { # Assuming app might have an 'id' or 'name' for display
-          id
-          name # Or 'name', depending on what's available
-        }
-        cancellation { # Assuming cancellation might have details
-            # reason
-            staffNote
-            # Add other relevant cancellation subfields if needed
-        }
-        cancelledAt 
-        cancelReason
-        confirmed
-        closed
-        # discountApplications(first: 5) { # Fetch first 5 discount applications
-        #     edges {
-        #         node {
-        #             allocationMethod
-        #             targetSelection
-        #             targetType
-        #             value {
-        #                 __typename
-        #                 ... on MoneyV2 {
-        #                     amount
-        #                     currencyCode
-        #                 }
-        #                 ... on PricingPercentageValue {
-        #                     percentage
-        #                 }
-        #             }
-        #             title # If available, or use 'description'
-        #         }
-        #     }
-        # }
-        discountCode
-        totalPriceSet {
-          presentmentMoney {
-            amount
-            currencyCode
-          }
-        }
-        lineItems(first: 10) {
-          edges {
-            node {
-              title
-              quantity
-              variantTitle
-              originalUnitPriceSet {
-                 presentmentMoney {
-                    amount
-                    currencyCode
-                }
-              }
-            }
-          }
-        }
-        shippingAddress {
-          firstName
-          lastName
-          address1
-          address2
-          city
-          zip
-          country
-          province
-          phone
-        }
-        note
-        tags
-        fulfillments(first: 5) { 
-          id
-          status
-          deliveredAt
-          displayStatus
-          trackingInfo { 
-            url
-            company
-            number
-          }
-        }
-      }
-    }
+    for candidate in queries.PROFILES[queries.PROFILES.index(profile):]:
+        cached = order_cache.get((shop_url, order_gid, candidate), allow_stale=allow_stale)
+        if cached is not None:
+            return cached
+    return None
+
+def invalidate_cached_order_profiles(shop_url: str, order_gid: str):
+    for profile in queries.PROFILES:
+        order_cache.invalidate((shop_url, order_gid, profile))
+
+def get_order_details(shop_url: str, access_token: str, order_gid: str, profile: str = "full"):
     """
-    variables = {"id": order_gid}
-    try:
-        # Ensure this calls the make_graphql_request from the shopify_client module
-        response_data = shopify_client.make_graphql_request(shop_url, access_token, query, variables)
-        if response_data.get("data") and response_data["data"].get("order"):
-            order_data = response_data["data"]["order"]
-            logger.info(f"Successfully fetched order details for {order_gid} via app.py's get_order_details. Data: {order_data}") # Added log for the full response
-            return order_data
-        elif response_data.get("errors"):
-            logger.error(f"GraphQL errors fetching order {order_gid} via app.py: {response_data['errors']}")
-            return None
-        else:
-            logger.warning(f"No order data found or unexpected response for {order_gid} via app.py. Response: {response_data}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching order {order_gid} via app.py: {e}", exc_info=True)
-        return None
+    Fetches details for a specific real order (shopify_client.get_order_details),
+    served from order_cache when possible (including expired entries while the
+    shop's circuit breaker is open).
+    """
+    cached = get_cached_order(shop_url, order_gid, profile)
+    if cached is not None:
+        logger.info("Order cache hit for %s on %s", order_gid, shop_url)
+        return cached
+    order_data = shopify_client.get_order_details(shop_url, access_token, order_gid, profile)
+    if order_data:
+        order_cache.set((shop_url, order_gid, profile), order_data)
+    elif circuit_breaker.is_degraded(shop_url):
+        stale = get_cached_order(shop_url, order_gid, profile, allow_stale=True)
+        if stale is not None:
+            logger.warning("Serving stale order %s while the Shopify API for %s is degraded", order_gid, shop_url)
+            return stale
+    return order_data
+
+
+def get_orders_details(shop_url: str, access_token: str, order_gids: list, profile: str = "list") -> dict:
+    """
+    Fetches many orders using nodes(ids:) queries with the given field-selection
+    profile, split into batches that stay under ORDER_BATCH_MAX_COST. Cached orders
+    are not re-fetched, and the remaining batches are issued concurrently. Returns a dict of order GID -> order data (missing or
+    failed orders are omitted).
+    """
+    orders_by_gid = {}
+    for gid in order_gids:
+        cached = get_cached_order(shop_url, gid, profile)
+        if cached is not None:
+            orders_by_gid[gid] = cached
+    order_gids = [gid for gid in order_gids if gid not in orders_by_gid]
+    if not order_gids:
+        return orders_by_gid
+    cost_per_order = max(1.0, rate_limiter.cost_tracker.predict(queries.operation_name_for("getOrder", profile)))
+    batch_size = max(1, min(ORDER_BATCH_MAX_IDS, int(ORDER_BATCH_MAX_COST // cost_per_order)))
+    batches = [order_gids[i:i + batch_size] for i in range(0, len(order_gids), batch_size)]
+    logger.info("Fetching %s orders on %s in %s batch(es) of up to %s", len(order_gids), shop_url, len(batches), batch_size)
+
+    results = shopify_async_client.run_concurrently(
+        *(shopify_async_client.make_graphql_request(shop_url, access_token, queries.GET_ORDERS_QUERIES[profile], {"ids": batch})
+          for batch in batches),
+        return_exceptions=True
+    )
+    for batch, response_data in zip(batches, results):
+        if isinstance(response_data, Exception):
+            logger.error("Error fetching order batch of %s on %s: %s", len(batch), shop_url, log_utils.payload(response_data))
+            continue
+        if response_data.get("errors"):
+            logger.error("GraphQL errors fetching order batch on %s: %s", shop_url, log_utils.payload(response_data['errors']))
+        for node in (response_data.get("data") or {}).get("nodes") or []:
+            if node and node.get("id"):
+                orders_by_gid[node["id"]] = node
+                order_cache.set((shop_url, node["id"], profile), node)
+    logger.info("Fetched %s orders on %s (%s requested from Shopify)", len(orders_by_gid), shop_url, len(order_gids))
+    return orders_by_gid
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus scrape endpoint (request, template and Shopify API metrics for this process).
+    """
+    if not metrics.METRICS_ENABLED:
+        return "Not Found", 404
+    if metrics.METRICS_TOKEN and not secrets.compare_digest(request.headers.get("Authorization", ""),
+                                                            f"Bearer {metrics.METRICS_TOKEN}"):
+        return "Unauthorized", 401
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@app.route('/webhooks/<path:topic>', methods=['POST'])
+def receive_webhook(topic):
+    shop_url = request.headers.get('X-Shopify-Shop-Domain')
+    header_topic = request.headers.get('X-Shopify-Topic', topic)
+    if not webhooks.verify_hmac(request.get_data(), request.headers.get('X-Shopify-Hmac-Sha256')):
+        logger.warning("Rejected webhook %s from %s: invalid HMAC", topic, shop_url)
+        return "Invalid HMAC", 401
+    if header_topic != topic or not webhooks.is_registered(topic):
+        logger.warning("Ignoring webhook for unhandled topic %s (URL topic: %s) from %s", header_topic, topic, shop_url)
+        return "", 200
+    # Acknowledge right away; background workers apply the payload to local caches.
+    body = request.get_data(as_text=True)
+    if webhook_queue.enqueue(topic, shop_url, body, request.headers.get('X-Shopify-Webhook-Id')):
+        logger.info("Queued webhook %s from %s", topic, shop_url)
+    else:
+        logger.info("Ignoring duplicate delivery of webhook %s from %s", topic, shop_url)
+    return "", 200
+
+@webhooks.register('orders/updated', 'orders/cancelled', 'orders/delete')
+def invalidate_cached_order(shop_url: str, payload: dict):
+    order_gid = payload.get('admin_graphql_api_id') or f"gid://shopify/Order/{payload.get('id')}"
+    invalidate_cached_order_profiles(shop_url, order_gid)
+
+@webhooks.register('fulfillments/create', 'fulfillments/update')
+def invalidate_cached_order_for_fulfillment(shop_url: str, payload: dict):
+    if payload.get('order_id') is not None:
+        invalidate_cached_order_profiles(shop_url, f"gid://shopify/Order/{payload['order_id']}")
+
+@webhooks.register('customers/create', 'customers/update')
+def apply_customer_update(shop_url: str, payload: dict):
+    customers.apply_customer_webhook(shop_url, payload)
+    customer_suggest_cache.invalidate_where(lambda key: key[0] == shop_url)
+
+@webhooks.register('customers/delete')
+def apply_customer_delete(shop_url: str, payload: dict):
+    customers.apply_customer_delete_webhook(shop_url, payload)
+    customer_suggest_cache.invalidate_where(lambda key: key[0] == shop_url)
+
+@webhooks.register('products/create', 'products/update')
+def apply_product_update(shop_url: str, payload: dict):
+    catalog.apply_product_webhook(shop_url, payload)
+    shopify_client.invalidate_product_search_cache(shop_url)
+
+@webhooks.register('products/delete')
+def apply_product_delete(shop_url: str, payload: dict):
+    catalog.apply_product_delete_webhook(shop_url, payload)
+    shopify_client.invalidate_product_search_cache(shop_url)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,296 @@
+"""
+Local stub of the Shopify GraphQL Admin API for offline benchmarks.
+
+Usage:
+    python benchmarks/fake_shopify.py [--port 8765] [--latency-ms 80] [--jitter-ms 20]
+
+Then point the app at it with SHOPIFY_API_BASE_URL=http://127.0.0.1:8765 (or use
+benchmarks/load_test.py, which starts one in-process).
+
+Answers the operations this app sends (searchProducts*, searchCustomers, getOrder*,
+getOrders*, draftOrderCreate, draftOrderComplete, orderCreate) with canned payloads of
+realistic size, adds a configurable response latency and reports query cost and
+throttleStatus in `extensions.cost` from a simulated leaky bucket, returning
+THROTTLED errors once the bucket is empty. GET /_stats returns the number of calls
+per operation; POST /_reset clears them.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_OPERATION_RE = re.compile(r'\b(?:query|mutation)\s+(\w+)')
+
+# Requested query cost per operation (prefix match on the operation name).
+OPERATION_COSTS = {
+    "searchProductsMinimal": 12,
+    "searchProductsList": 112,
+    "searchProducts": 112,
+    "searchCustomers": 62,
+    "getOrdersMinimal": 2,
+    "getOrdersList": 8,
+    "getOrders": 32,
+    "getOrderMinimal": 2,
+    "getOrderList": 8,
+    "getOrder": 32,
+    "draftOrderCreate": 10,
+    "draftOrderComplete": 10,
+    "orderCreate": 10,
+}
+
+FIRST_NAMES = ("Ada", "Alan", "Grace", "Linus", "Margaret", "Ken", "Barbara", "Dennis", "Frances", "John")
+LAST_NAMES = ("Lovelace", "Turing", "Hopper", "Torvalds", "Hamilton", "Thompson", "Liskov", "Ritchie", "Allen", "Backus")
+
+def _money(amount: str) -> dict:
+    return {"presentmentMoney": {"amount": amount, "currencyCode": "USD"}}
+
+class FakeShopify:
+    """
+    Response factory and shared state (call counts, cost bucket, created orders).
+    """
+
+    def __init__(self, latency_ms: float = 80, jitter_ms: float = 20, bucket_size: float = 20000,
+                 restore_rate: float = 1000, description_bytes: int = 2000):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bucket_size = bucket_size
+        self.restore_rate = restore_rate
+        self.description = ("<p>" + "Soft organic cotton, pre-washed for a relaxed fit. " * (description_bytes // 52 + 1))[:description_bytes] + "</p>"
+        self.calls = Counter()
+        self.throttled = 0
+        self._available = bucket_size
+        self._last_refill = time.monotonic()
+        self._next_id = 5000
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled = 0
+            self._available = self.bucket_size
+            self._last_refill = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "throttled": self.throttled}
+
+    def _charge(self, cost: float):
+        """
+        Deducts `cost` from the bucket. Returns (allowed, throttleStatus).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.bucket_size, self._available + (now - self._last_refill) * self.restore_rate)
+            self._last_refill = now
+            allowed = self._available >= cost
+            if allowed:
+                self._available -= cost
+            else:
+                self.throttled += 1
+            return allowed, {"maximumAvailable": self.bucket_size, "currentlyAvailable": int(self._available),
+                             "restoreRate": self.restore_rate}
+
+    def _new_id(self) -> int:
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def handle(self, body: dict) -> dict:
+        operation = (_OPERATION_RE.search(body.get("query", "")) or [None, None])[1] or "anonymous"
+        variables = body.get("variables") or {}
+        with self._lock:
+            self.calls[operation] += 1
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        cost = next((value for name, value in OPERATION_COSTS.items() if operation.startswith(name)), 10)
+        if operation.startswith("getOrders"):
+            cost *= max(1, len(variables.get("ids") or []))
+        allowed, throttle_status = self._charge(cost)
+        extensions = {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost if allowed else None,
+                               "throttleStatus": throttle_status}}
+        if not allowed:
+            return {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}], "extensions": extensions}
+        data = self._data(operation, variables)
+        if data is None:
+            return {"errors": [{"message": f"Operation {operation} is not supported by the fake server"}],
+                    "extensions": extensions}
+        return {"data": data, "extensions": extensions}
+
+    def _data(self, operation: str, variables: dict):
+        if operation.startswith("searchProducts"):
+            profile = "minimal" if operation.endswith("Minimal") else "list" if operation.endswith("List") else "full"
+            count = min(int(variables.get("numProducts", 10)), 250)
+            edges = [{"node": self.product(i, profile), "cursor": f"cursor-{i}"} for i in range(count)]
+            return {"products": {"edges": edges, "pageInfo": {
+                "hasNextPage": True, "hasPreviousPage": bool(variables.get("cursor")),
+                "startCursor": "cursor-0", "endCursor": f"cursor-{count - 1}"}}}
+        if operation == "searchCustomers":
+            count = min(int(variables.get("first", 10)), 10)
+            return {"customers": {"edges": [{"node": self.customer(i)} for i in range(count)]}}
+        if operation.startswith("getOrders"):
+            return {"nodes": [self.order(gid) for gid in variables.get("ids") or []]}
+        if operation.startswith("getOrder"):
+            return {"order": self.order(variables.get("id"))}
+        if operation == "draftOrderCreate":
+            draft_id = self._new_id()
+            return {"draftOrderCreate": {"draftOrder": {"id": f"gid://shopify/DraftOrder/{draft_id}",
+                                                        "invoiceUrl": f"https://example.com/invoices/{draft_id}"},
+                                         "userErrors": []}}
+        if operation == "draftOrderComplete":
+            order = self.order(f"gid://shopify/Order/{self._new_id()}")
+            return {"draftOrderComplete": {"draftOrder": {"id": variables.get("id"), "order": order}, "userErrors": []}}
+        if operation == "orderCreate":
+            return {"orderCreate": {"order": self.order(f"gid://shopify/Order/{self._new_id()}"), "userErrors": []}}
+        return None
+
+    def product(self, i: int, profile: str = "full") -> dict:
+        product = {"id": f"gid://shopify/Product/{1000 + i}", "title": f"Organic Cotton Tee {i}"}
+        if profile == "minimal":
+            return product
+        product["updatedAt"] = "2025-01-01T00:00:00Z"
+        product["featuredImage"] = {"url": f"https://cdn.shopify.com/s/files/1/0000/products/tee-{i}.jpg"}
+        product["variants"] = {"edges": [{"node": {
+            "id": f"gid://shopify/ProductVariant/{10000 + i * 10 + v}",
+            "title": size,
+            "price": f"{19 + v}.00",
+            "image": {"url": f"https://cdn.shopify.com/s/files/1/0000/products/tee-{i}-{size}.jpg"},
+        }} for v, size in enumerate(("XS", "S", "M", "L", "XL"))]}
+        if profile == "full":
+            product["descriptionHtml"] = self.description
+            product["onlineStoreUrl"] = f"https://example.myshopify.com/products/organic-cotton-tee-{i}"
+        return product
+
+    def customer(self, i: int) -> dict:
+        first, last = FIRST_NAMES[i % len(FIRST_NAMES)], LAST_NAMES[(i * 3) % len(LAST_NAMES)]
+        return {
+            "id": f"gid://shopify/Customer/{2000 + i}",
+            "firstName": first,
+            "lastName": last,
+            "email": {"emailAddress": f"{first.lower()}.{last.lower()}@example.com"},
+            "phone": {"phoneNumber": f"+1555010{i:04d}"},
+            "addresses": [{
+                "address1": f"{100 + a} Market Street", "address2": f"Suite {a + 1}", "city": "San Francisco",
+                "zip": "94103", "provinceCode": "CA", "countryCodeV2": "US",
+                "formatted": [f"{100 + a} Market Street", "San Francisco CA 94103", "United States"],
+                "phone": f"+1555010{i:04d}",
+            } for a in range(2)],
+        }
+
+    def order(self, gid: str) -> dict:
+        order_id = (gid or "gid://shopify/Order/0").rsplit("/", 1)[-1]
+        return {
+            "id": gid,
+            "name": f"#{order_id}",
+            "legacyResourceId": order_id,
+            "email": "ada.lovelace@example.com",
+            "createdAt": "2025-01-01T12:00:00Z",
+            "updatedAt": "2025-01-01T12:05:00Z",
+            "displayFinancialStatus": "PAID",
+            "displayFulfillmentStatus": "UNFULFILLED",
+            "app": {"id": "gid://shopify/App/1", "name": "Hypothesis"},
+            "cancellation": None,
+            "cancelledAt": None,
+            "cancelReason": None,
+            "confirmed": True,
+            "closed": False,
+            "discountCode": "HYPOTHESISAPP",
+            "totalPriceSet": _money("0.85"),
+            "lineItems": {"edges": [{"node": {
+                "title": f"Organic Cotton Tee {n}", "quantity": 1, "variantTitle": "M",
+                "originalUnitPriceSet": _money("21.00"),
+            }} for n in range(3)]},
+            "shippingAddress": {
+                "firstName": "Ada", "lastName": "Lovelace", "address1": "100 Market Street", "address2": "Suite 1",
+                "city": "San Francisco", "zip": "94103", "country": "United States", "province": "California",
+                "phone": "+15550100000",
+            },
+            "note": "Order placed via Hypothesis app.",
+            "tags": ["benchmark"],
+            "fulfillments": [],
+        }
+
+def _make_handler(fake: FakeShopify):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+        disable_nagle_algorithm = True
+        wbufsize = 64 * 1024 # Send headers and body in one write
+
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/_stats":
+                self._send_json(200, fake.stats())
+            else:
+                self._send_json(404, {"errors": "Not Found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path == "/_reset":
+                fake.reset()
+                self._send_json(200, {})
+            elif self.path.endswith("/graphql.json"):
+                if not self.headers.get("X-Shopify-Access-Token"):
+                    self._send_json(401, {"errors": "[API] Invalid API key or access token"})
+                    return
+                self._send_json(200, fake.handle(json.loads(body or b"{}")))
+            else:
+                self._send_json(404, {"errors": "Not Found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # The default of 5 drops connections under concurrent load
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **options):
+    """
+    Starts a fake Admin API in a background thread. Returns (server, fake); the
+    server's base URL is f"http://{host}:{server.server_port}".
+    """
+    fake = FakeShopify(**options)
+    server = _Server((host, port), _make_handler(fake))
+    threading.Thread(target=server.serve_forever, name="fake-shopify", daemon=True).start()
+    return server, fake
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=80, help="Simulated Shopify response time (default: 80)")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Random +/- latency jitter (default: 20)")
+    # Defaults follow Shopify Plus limits; use 2000 / 100 to benchmark a standard plan.
+    parser.add_argument("--bucket-size", type=float, default=20000, help="Query cost bucket size (default: 20000)")
+    parser.add_argument("--restore-rate", type=float, default=1000, help="Cost points restored per second (default: 1000)")
+    parser.add_argument("--description-bytes", type=int, default=2000, help="descriptionHtml size per product (default: 2000)")
+
+def options_from_args(args) -> dict:
+    return {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "bucket_size": args.bucket_size,
+            "restore_rate": args.restore_rate, "description_bytes": args.description_bytes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, _ = start_server(args.host, args.port, **options_from_args(args))
+    print(f"Fake Shopify Admin API listening on http://{args.host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compares the JSON decode paths used for Shopify responses.
+
+Usage:
+    python benchmarks/json_decode.py [--products 50] [--description-bytes 4000] [--repeat 200]
+
+Builds a synthetic searchProducts response (products with descriptionHtml and five
+variants each) and a synthetic bulk operation JSONL export, then times:
+  - requests' Response.json() (the previous make_graphql_request path)
+  - stdlib json.loads on the raw bytes
+  - orjson.loads on the raw bytes (if orjson is installed)
+  - shopify_client.read_body + fast_json.loads (the current path, incl. size guard)
+  - bulk JSONL: iter_lines() with the default 512 byte chunks + json.loads versus
+    64 KiB chunks + fast_json.loads
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json # noqa: E402
+import shopify_client # noqa: E402
+
+def build_product_page(num_products: int, description_bytes: int) -> bytes:
+    description = ("<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (description_bytes // 56 + 1))[:description_bytes] + "</p>"
+    edges = []
+    for i in range(num_products):
+        edges.append({"node": {
+            "id": f"gid://shopify/Product/{1000 + i}",
+            "title": f"Product {i}",
+            "descriptionHtml": description,
+            "onlineStoreUrl": f"https://example.myshopify.com/products/product-{i}",
+            "featuredImage": {"url": f"https://cdn.shopify.com/s/files/product-{i}.jpg"},
+            "variants": {"edges": [{"node": {
+                "id": f"gid://shopify/ProductVariant/{1000 * i + v}",
+                "title": f"Size {v}",
+                "price": f"{10 + v}.00",
+                "image": {"url": f"https://cdn.shopify.com/s/files/variant-{i}-{v}.jpg"},
+            }} for v in range(5)]},
+        }})
+    body = {
+        "data": {"products": {"edges": edges, "pageInfo": {"hasNextPage": True, "hasPreviousPage": False,
+                                                           "startCursor": "abc", "endCursor": "def"}}},
+        "extensions": {"cost": {"requestedQueryCost": 112, "actualQueryCost": 60,
+                                "throttleStatus": {"maximumAvailable": 2000.0, "currentlyAvailable": 1940, "restoreRate": 100.0}}},
+    }
+    return json.dumps(body).encode("utf-8")
+
+def build_bulk_export(num_products: int, description_bytes: int) -> bytes:
+    lines = []
+    for edge in json.loads(build_product_page(num_products, description_bytes))["data"]["products"]["edges"]:
+        node = edge["node"]
+        variants = node.pop("variants")["edges"]
+        lines.append(json.dumps(node))
+        for variant in variants:
+            lines.append(json.dumps(dict(variant["node"], __parentId=node["id"])))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def make_response(body: bytes, streamed: bool) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    if streamed:
+        response.raw = io.BytesIO(body)
+    else:
+        response._content = body
+    return response
+
+def timed(label: str, func, repeat: int, size: int):
+    func() # Warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - started) / repeat
+    print(f"{label:<52} {elapsed * 1000:8.3f} ms/op {size / elapsed / 1e6:9.1f} MB/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=50, help="Products per response page (default: 50)")
+    parser.add_argument("--description-bytes", type=int, default=4000, help="descriptionHtml size per product (default: 4000)")
+    parser.add_argument("--repeat", type=int, default=200, help="Iterations per measurement (default: 200)")
+    parser.add_argument("--bulk-products", type=int, default=2000, help="Products in the bulk JSONL export (default: 2000)")
+    args = parser.parse_args()
+
+    body = build_product_page(args.products, args.description_bytes)
+    print(f"searchProducts response: {len(body) / 1024:.1f} KiB, fast_json backend: {fast_json.BACKEND}")
+    timed("requests Response.json()", lambda: make_response(body, streamed=False).json(), args.repeat, len(body))
+    timed("json.loads(bytes)", lambda: json.loads(body), args.repeat, len(body))
+    try:
+        import orjson
+        timed("orjson.loads(bytes)", lambda: orjson.loads(body), args.repeat, len(body))
+    except ImportError:
+        print(f"{'orjson.loads(bytes)':<52} (orjson not installed)")
+    timed("read_body() + fast_json.loads (current path)",
+          lambda: fast_json.loads(shopify_client.read_body(make_response(body, streamed=True))), args.repeat, len(body))
+
+    export = build_bulk_export(args.bulk_products, args.description_bytes // 4)
+    print(f"\nBulk JSONL export: {len(export) / 1024 / 1024:.1f} MiB")
+    bulk_repeat = max(1, args.repeat // 20)
+    timed("iter_lines(512) + json.loads (previous path)",
+          lambda: [json.loads(line) for line in make_response(export, streamed=True).iter_lines() if line],
+          bulk_repeat, len(export))
+    timed("iter_lines(64 KiB) + fast_json.loads (current path)",
+          lambda: [fast_json.loads(line) for line in make_response(export, streamed=True).iter_lines(
+              chunk_size=shopify_client.RESPONSE_CHUNK_SIZE) if line],
+          bulk_repeat, len(export))
+
+if __name__ == '__main__':
+    main()
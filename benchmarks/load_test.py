@@ -0,0 +1,227 @@
+"""
+Offline load test of the Flask routes against a local fake Shopify Admin API.
+
+Usage:
+    python benchmarks/load_test.py [--users 10] [--iterations 20] [--latency-ms 80]
+                                   [--scenarios products,customer-search,create-order,order-status]
+                                   [--json results.json]
+
+Starts benchmarks/fake_shopify.py and the app (werkzeug, threaded) on local ports,
+then runs each scenario with --users concurrent clients doing --iterations actions
+each. Reports per scenario: throughput (actions/s), p50/p95/p99 latency, errors, the
+number of Shopify calls per user action (by operation) and the time spent waiting on
+the client-side query cost bucket. Pass --shopify-url to use
+an already running fake server instead.
+
+Scenarios (one action each):
+  products         POST /products with a search term (--distinct-terms different terms)
+  customer-search  POST /customer-search with a customer name
+  create-order     add one item to the cart, then POST /create-order
+  order-status     GET /order-status/<id> for orders created above (or synthetic IDs)
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_shopify # noqa: E402
+
+SHOP = "benchmark-shop.myshopify.com"
+SCENARIOS = ("products", "customer-search", "create-order", "order-status")
+SEARCH_WORDS = ("tee", "hoodie", "cap", "sock", "jacket", "bag", "mug", "scarf", "belt", "shorts")
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def configure_environment(shopify_url: str, data_dir: str):
+    """
+    Points the app at the fake API and isolates its local state. Must run before `import app`.
+    """
+    os.environ.update({
+        "SHOPIFY_API_BASE_URL": shopify_url,
+        "FLASK_SECRET_KEY": "benchmark",
+        "TOKEN_STORE_PATH": os.path.join(data_dir, "tokens.sqlite3"),
+        "CART_STORE_PATH": os.path.join(data_dir, "carts.sqlite3"),
+        "WEBHOOK_QUEUE_PATH": os.path.join(data_dir, "webhooks.sqlite3"),
+        "WEBHOOK_WORKER_ENABLED": "false",
+        # The fake API has no bulk operations; measure the per-request API paths.
+        "CATALOG_INDEX_ENABLED": "false",
+        "CUSTOMER_INDEX_ENABLED": "false",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+def start_app():
+    from werkzeug.serving import make_server
+    import app as app_module
+    app_module.token_store.set(SHOP, "benchmark-token")
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # No per-request access log
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-app", daemon=True).start()
+    return app_module, server, f"http://127.0.0.1:{server.server_port}"
+
+class User:
+    """
+    One simulated client with its own cookie jar (and therefore its own cart).
+    """
+
+    def __init__(self, app_module, base_url: str):
+        self.base_url = base_url
+        self.http = requests.Session()
+        flask_app = app_module.app
+        # A pre-signed session with its own cart ID, as if the user had completed OAuth.
+        cookie = flask_app.session_interface.get_signing_serializer(flask_app).dumps(
+            {"shop_url": SHOP, "sid": secrets.token_urlsafe(16)})
+        self.http.cookies.set(flask_app.config["SESSION_COOKIE_NAME"], cookie)
+
+    def post(self, path: str, data: dict) -> requests.Response:
+        return self.http.post(self.base_url + path, data=data, allow_redirects=False)
+
+    def get(self, path: str) -> requests.Response:
+        return self.http.get(self.base_url + path, allow_redirects=False)
+
+def run_action(scenario: str, user: User, iteration: int, args, order_ids: list) -> bool:
+    if scenario == "products":
+        term = f"{random.choice(SEARCH_WORDS)} {random.randrange(args.distinct_terms)}"
+        return user.post("/products", {"search_query": term}).status_code == 200
+    if scenario == "customer-search":
+        return user.post("/customer-search", {"customer_search_query": random.choice(fake_shopify.FIRST_NAMES)}).status_code == 200
+    if scenario == "create-order":
+        added = user.post("/products", {"add_to_cart": "1", "variant_id": f"gid://shopify/ProductVariant/{10000 + iteration}",
+                                        "product_title": "Organic Cotton Tee", "variant_title": "M",
+                                        "price": "21.00", "quantity": "1"})
+        response = user.post("/create-order", {
+            "email": "ada.lovelace@example.com", "firstName": "Ada", "lastName": "Lovelace",
+            "address1": "100 Market Street", "city": "San Francisco", "province": "CA",
+            "country": "US", "zip": "94103", "phone": "+15550100000",
+        })
+        location = response.headers.get("Location", "")
+        if added.status_code == 200 and response.status_code == 302 and "/order-status/" in location:
+            order_ids.append(location.rsplit("/", 1)[-1])
+            return True
+        return False
+    if scenario == "order-status":
+        order_id = random.choice(order_ids) if order_ids else str(5000 + random.randrange(1, 1000))
+        return user.get(f"/order-status/{order_id}").status_code == 200
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+def shopify_stats(args, fake) -> dict:
+    if fake is not None:
+        return fake.stats()
+    return requests.get(args.shopify_url + "/_stats").json()
+
+def run_scenario(scenario: str, app_module, base_url: str, args, fake, order_ids: list) -> dict:
+    users = [User(app_module, base_url) for _ in range(args.users)]
+    before = shopify_stats(args, fake)
+    waited_before = app_module.metrics.SHOPIFY_THROTTLE_WAIT_SECONDS.total(shop=SHOP)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def drive(user: User):
+        for iteration in range(args.iterations):
+            started = time.perf_counter()
+            try:
+                ok = run_action(scenario, user, iteration, args, order_ids)
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += 0 if ok else 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(drive, users))
+    wall = time.perf_counter() - started
+
+    after = shopify_stats(args, fake)
+    waited = app_module.metrics.SHOPIFY_THROTTLE_WAIT_SECONDS.total(shop=SHOP) - waited_before
+    calls = Counter(after["calls"])
+    calls.subtract(before["calls"])
+    calls = {operation: count for operation, count in calls.items() if count}
+    actions = len(latencies)
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "actions": actions,
+        "errors": errors[0],
+        "actions_per_second": actions / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "shopify_calls_per_action": sum(calls.values()) / actions if actions else 0.0,
+        "shopify_calls": calls,
+        "throttled": after["throttled"] - before["throttled"],
+        "throttle_wait_ms_per_action": waited * 1000 / actions if actions else 0.0,
+    }
+
+def print_report(results: list, args):
+    print(f"\n{args.users} users x {args.iterations} actions per scenario, "
+          f"Shopify latency {args.latency_ms:.0f}+/-{args.jitter_ms:.0f} ms\n")
+    print(f"{'scenario':<16} {'actions':>7} {'errors':>6} {'act/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'calls/act':>9} {'wait ms/act':>11}")
+    for result in results:
+        print(f"{result['scenario']:<16} {result['actions']:>7} {result['errors']:>6} {result['actions_per_second']:>8.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['shopify_calls_per_action']:>9.2f} "
+              f"{result['throttle_wait_ms_per_action']:>11.1f}")
+    print()
+    for result in results:
+        breakdown = ", ".join(f"{operation}={count}" for operation, count in sorted(result["shopify_calls"].items())) or "none"
+        throttled = f" (THROTTLED responses: {result['throttled']})" if result["throttled"] else ""
+        print(f"{result['scenario']:<16} Shopify calls: {breakdown}{throttled}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="Concurrent clients (default: 10)")
+    parser.add_argument("--iterations", type=int, default=20, help="Actions per client per scenario (default: 20)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run (default: all)")
+    parser.add_argument("--distinct-terms", type=int, default=50,
+                        help="Different product search terms per word; lower means more cache hits (default: 50)")
+    parser.add_argument("--shopify-url", help="Use a running fake server (benchmarks/fake_shopify.py) instead of starting one")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    fake_shopify.add_arguments(parser)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    fake = None
+    if args.shopify_url:
+        args.shopify_url = args.shopify_url.rstrip("/")
+    else:
+        fake_server, fake = fake_shopify.start_server(**fake_shopify.options_from_args(args))
+        args.shopify_url = f"http://127.0.0.1:{fake_server.server_port}"
+
+    with tempfile.TemporaryDirectory(prefix="shopify-benchmark-") as data_dir:
+        configure_environment(args.shopify_url, data_dir)
+        app_module, server, base_url = start_app()
+        order_ids = []
+        results = [run_scenario(scenario, app_module, base_url, args, fake, order_ids) for scenario in scenarios]
+        server.shutdown()
+
+    print_report(results, args)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""
+Bulk order import: creates one fully discounted order per input row.
+
+Usage:
+    python bulk_orders.py --shop my-shop.myshopify.com orders.csv --results results.jsonl
+
+Input is CSV or JSONL (by file extension) with one order per row/line and the fields
+email, firstName, lastName, address1, address2, city, province, country (country
+code), zip, phone, tags (comma-separated) and line_items. In CSV, line_items is
+"variantId:quantity;variantId:quantity"; in JSONL it may also be a list of
+{"variantId": ..., "quantity": ...}. Variant IDs may be numeric or GIDs. An optional
+"ref" column identifies the row (defaults to the row number).
+
+Rows are streamed, validated with the same mandatory-field rules as /create-order,
+and created with the configured checkout mode (see orders.py) with bounded concurrency
+(query cost is scheduled by the client's rate limiter). Progress is checkpointed
+to <results>.checkpoint; re-running the same command resumes where it left off.
+A row whose order may have been submitted when the previous run crashed is not
+retried automatically (to avoid duplicate orders) unless --retry-in-flight is
+given; it is reported with status "needs_review". Every order carries a
+BulkImportRef custom attribute so such rows can be checked in the Shopify admin.
+
+If Shopify is unavailable (circuit breaker open, connection failures, 5xx after
+retries, GraphQL errors on the price lookup) before an order could have been sent,
+the row is reported as "retryable", left unprocessed in the checkpoint and the run
+stops; re-run to resume once the shop recovers. In the draft checkout mode the draft
+order's ID is checkpointed as soon as it exists, so a row that fails between
+creating and completing its draft resumes by completing that draft.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cart as cart_model
+import circuit_breaker
+import orders
+import queries
+import shopify_client
+
+logger = logging.getLogger(__name__)
+
+VARIANT_PRICES_QUERY = queries.register("""
+query variantPrices($ids: [ID!]!) {
+  nodes(ids: $ids) {
+    ... on ProductVariant {
+      id
+      price
+    }
+  }
+}
+""")
+VARIANT_PRICE_BATCH_SIZE = 100
+
+def variant_gid(variant_id) -> str:
+    variant_id = str(variant_id).strip()
+    return variant_id if variant_id.startswith("gid://") else f"gid://shopify/ProductVariant/{variant_id}"
+
+def parse_line_items(raw) -> list:
+    """
+    Parses "variantId:qty;variantId:qty" or a list of dicts into DraftOrderLineItemInput dicts.
+    """
+    if isinstance(raw, list):
+        return [{"variantId": variant_gid(item["variantId"]), "quantity": int(item.get("quantity", 1))} for item in raw]
+    line_items = []
+    for part in (raw or "").split(';'):
+        if not part.strip():
+            continue
+        variant_id, _, quantity = part.partition(':')
+        line_items.append({"variantId": variant_gid(variant_id), "quantity": int(quantity or 1)})
+    return line_items
+
+def iter_rows(path: str):
+    """
+    Streams (ref, row) pairs from a CSV or JSONL file.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson')):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for number, row in enumerate(rows, start=1):
+            yield str(row.get("ref") or number), row
+
+class VariantPriceCache:
+    """
+    Looks up variant prices (needed to size the discount) in batched nodes(ids:)
+    queries, remembering them (parsed to Decimal) for the rest of the import.
+    """
+
+    def __init__(self, shop_url: str, access_token: str):
+        self.shop_url = shop_url
+        self.access_token = access_token
+        self._prices = {}
+        self._lock = threading.Lock()
+
+    def get_prices(self, variant_gids: list) -> dict:
+        """
+        Returns {gid: Decimal price or None}; None means Shopify has no such variant.
+        Raises RuntimeError if Shopify did not answer for every variant (e.g. THROTTLED),
+        so a lookup failure is never mistaken for unknown variants.
+        """
+        with self._lock:
+            missing = [gid for gid in dict.fromkeys(variant_gids) if gid not in self._prices]
+        for i in range(0, len(missing), VARIANT_PRICE_BATCH_SIZE):
+            batch = missing[i:i + VARIANT_PRICE_BATCH_SIZE]
+            response_data = shopify_client.make_graphql_request(self.shop_url, self.access_token, VARIANT_PRICES_QUERY, {"ids": batch})
+            nodes = (response_data.get("data") or {}).get("nodes")
+            if response_data.get("errors") or nodes is None or len(nodes) != len(batch):
+                raise RuntimeError(f"Variant price lookup failed on {self.shop_url}: {response_data.get('errors')}")
+            with self._lock:
+                for gid, node in zip(batch, nodes):
+                    self._prices[gid] = self._parse(gid, node.get("price")) if node else None
+        with self._lock:
+            return {gid: self._prices.get(gid) for gid in variant_gids}
+
+    @staticmethod
+    def _parse(gid: str, price):
+        try:
+            return cart_model.parse_price(price)
+        except ValueError:
+            logger.warning("Could not parse price for variant %s. Price: %s", gid, price)
+            return None
+
+class Checkpoint:
+    """
+    Append-only JSONL log of row states ("started", "drafted", "done", "failed",
+    "retryable"), fsynced on every write so progress survives a crash. Only "done"
+    and "failed" rows are skipped on the next run. "drafted" entries also carry the
+    draft order's ID (kept in `drafts`), which the next attempt completes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.states = {}
+        self.drafts = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.states[entry["ref"]] = entry["state"]
+                        if entry.get("draft_order_id"):
+                            self.drafts[entry["ref"]] = entry["draft_order_id"]
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, ref: str, state: str, draft_order_id: str = None):
+        entry = {"ref": ref, "state": state}
+        if draft_order_id:
+            entry["draft_order_id"] = draft_order_id
+        with self._lock:
+            self.states[ref] = state
+            if draft_order_id:
+                self.drafts[ref] = draft_order_id
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class ResultsWriter:
+    """
+    Appends one result per row (ref, status, order_id, order_name, error) as JSONL or CSV.
+    """
+
+    FIELDS = ["ref", "status", "order_id", "order_name", "error"]
+
+    def __init__(self, path: str):
+        self._csv = path.lower().endswith('.csv')
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.FIELDS) if self._csv else None
+        if self._csv and new_file:
+            self._writer.writeheader()
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def write(self, ref: str, status: str, order_id: str = None, order_name: str = None, error: str = None):
+        result = {"ref": ref, "status": status, "order_id": order_id, "order_name": order_name, "error": error}
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+            if self._csv:
+                self._writer.writerow(result)
+            else:
+                self._file.write(json.dumps(result) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def build_order_input(ref: str, row: dict, prices: VariantPriceCache):
+    """
+    Validates a row and builds the orders.place_order arguments for it.
+    Returns (arguments, error message).
+    """
+    email = row.get("email")
+    shipping_address_input = {
+        "firstName": row.get("firstName"),
+        "lastName": row.get("lastName"),
+        "address1": row.get("address1"),
+        "address2": row.get("address2"),
+        "city": row.get("city"),
+        "province": row.get("province"),
+        "countryCode": row.get("country") or row.get("countryCode"),
+        "zip": row.get("zip"),
+        "phone": row.get("phone")
+    }
+    missing_fields = orders.find_missing_fields(email, shipping_address_input)
+    if missing_fields:
+        return None, f"Missing mandatory address fields: {', '.join(missing_fields)}"
+    try:
+        line_items_input = parse_line_items(row.get("line_items"))
+    except (KeyError, ValueError) as e:
+        return None, f"Invalid line_items: {e}"
+    if not line_items_input:
+        return None, "No line items"
+
+    variant_prices = prices.get_prices([item["variantId"] for item in line_items_input])
+    unknown = [gid for gid, price in variant_prices.items() if price is None]
+    if unknown:
+        return None, f"Unknown variants: {', '.join(unknown)}"
+    totals, = cart_model.price_carts([
+        [(variant_prices[item["variantId"]], item["quantity"]) for item in line_items_input]
+    ])
+    tags = row.get("tags")
+    return {
+        "email": email,
+        "shipping_address_input": shipping_address_input,
+        "line_items_input": line_items_input,
+        "total_cart_value": totals.subtotal,
+        "discount_value": totals.discount,
+        "tags_list": tags if isinstance(tags, list) else orders.parse_tags(tags),
+        "extra_attributes": [{"key": "BulkImportRef", "value": ref}],
+    }, None
+
+def is_unsent_error(exc: Exception) -> bool:
+    """
+    True if a mutation provably never reached Shopify (breaker open or connect
+    timeout), so the row can be retried without risking a duplicate order.
+    """
+    return isinstance(exc, (circuit_breaker.CircuitOpenError, requests.exceptions.ConnectTimeout))
+
+def process_row(shop_url: str, access_token: str, ref: str, row: dict, prices: VariantPriceCache,
+                checkpoint: Checkpoint, results: ResultsWriter, stop: threading.Event = None):
+    if stop is not None and stop.is_set():
+        return # Left for the next run
+    try:
+        order_args, error = build_order_input(ref, row, prices)
+    except Exception as e:
+        # Price lookups failed (Shopify unavailable) or an unexpected bug; the row itself
+        # may be fine, so it is not checkpointed and the next run picks it up again.
+        logger.warning("Row %s could not be prepared, will retry on the next run: %s", ref, e,
+                       exc_info=not isinstance(e, requests.exceptions.RequestException))
+        results.write(ref, "retryable", error=f"Could not prepare order: {e}")
+        if stop is not None:
+            stop.set()
+        return
+    if error:
+        logger.warning("Row %s rejected: %s", ref, error)
+        checkpoint.record(ref, "failed")
+        results.write(ref, "invalid", error=error)
+        return
+
+    # A draft left by an earlier attempt is completed rather than created again.
+    draft_order_id = checkpoint.drafts.get(ref)
+    checkpoint.record(ref, "drafted" if draft_order_id else "started", draft_order_id)
+    try:
+        order_details = orders.place_order(
+            shop_url, access_token, **order_args, draft_order_id=draft_order_id,
+            on_draft_created=lambda created_id: checkpoint.record(ref, "drafted", created_id)
+        )
+    except orders.OrderCreationError as e:
+        checkpoint.record(ref, "failed")
+        draft_order_id = checkpoint.drafts.get(ref)
+        if draft_order_id:
+            # The draft may already have been completed by the attempt that was interrupted.
+            results.write(ref, "needs_review", error=f"{e} (draft order {draft_order_id})")
+        else:
+            results.write(ref, "failed", error=str(e))
+        return
+    except Exception as e:
+        draft_order_id = checkpoint.drafts.get(ref)
+        if is_unsent_error(e):
+            logger.warning("Row %s not submitted, will retry on the next run: %s", ref, e)
+            checkpoint.record(ref, "retryable")
+            results.write(ref, "retryable", error=str(e))
+            if stop is not None:
+                stop.set()
+            return
+        # The draft (or its completion) may or may not have gone through, so flag the
+        # row for review instead of retrying it on the next run.
+        logger.error("Row %s failed with an unexpected error: %s", ref, e, exc_info=True)
+        checkpoint.record(ref, "failed")
+        results.write(ref, "needs_review", error=f"{e} (draft order {draft_order_id})" if draft_order_id else str(e))
+        return
+    checkpoint.record(ref, "done")
+    results.write(ref, "created", order_id=order_details["id"], order_name=order_details.get("name"))
+
+def run_import(shop_url: str, access_token: str, input_path: str, results_path: str,
+               checkpoint_path: str = None, concurrency: int = 4, retry_in_flight: bool = False) -> dict:
+    """
+    Runs (or resumes) an import. Returns counts of row results by status. Stops
+    submitting rows after the first "retryable" one (Shopify unavailable).
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{results_path}.checkpoint")
+    results = ResultsWriter(results_path)
+    prices = VariantPriceCache(shop_url, access_token)
+    skipped = 0
+    stop = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-order") as executor:
+            pending = set()
+            for ref, row in iter_rows(input_path):
+                if stop.is_set():
+                    break
+                state = checkpoint.states.get(ref)
+                if state in ("done", "failed"):
+                    skipped += 1
+                    continue
+                if state == "started" and not retry_in_flight:
+                    results.write(ref, "needs_review", error="Interrupted while being submitted in a previous run; check for an order with this BulkImportRef.")
+                    checkpoint.record(ref, "failed")
+                    continue
+                # Keep only a bounded number of rows in memory.
+                if len(pending) >= concurrency * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(executor.submit(process_row, shop_url, access_token, ref, row, prices, checkpoint, results, stop))
+            wait(pending)
+    finally:
+        checkpoint.close()
+        results.close()
+    if stop.is_set():
+        logger.warning("Bulk import stopped early because Shopify is unavailable; re-run the same command to resume.")
+    logger.info("Bulk import finished. Skipped (already processed): %s. Results: %s", skipped, results.counts)
+    return results.counts
+
+def main():
+    from dotenv import load_dotenv
+    from token_store import create_token_store
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Create fully discounted orders from a CSV/JSONL file.")
+    parser.add_argument("input", help="CSV or JSONL file with one order per row")
+    parser.add_argument("--shop", required=True, help="Shop domain, e.g. my-shop.myshopify.com")
+    parser.add_argument("--results", required=True, help="Results file (.jsonl or .csv)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <results>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Orders submitted in parallel (default: 4)")
+    parser.add_argument("--retry-in-flight", action="store_true", help="Retry rows that were mid-submission when a previous run stopped")
+    args = parser.parse_args()
+
+    access_token = os.getenv("SHOPIFY_ACCESS_TOKEN") or create_token_store().get(args.shop)
+    if not access_token:
+        parser.error(f"No access token for {args.shop}. Install the app on the shop first or set SHOPIFY_ACCESS_TOKEN.")
+    run_import(args.shop, access_token, args.input, args.results, args.checkpoint, args.concurrency, args.retry_in_flight)
+
+if __name__ == '__main__':
+    main()
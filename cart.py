@@ -0,0 +1,142 @@
+import logging
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Cart money arithmetic. Prices arrive as strings ("19.99") from Shopify and the cart
+# forms; they are parsed to Decimal once (parse_price is memoized) and totals are kept
+# as Decimal, so sums don't drift the way repeated float additions do. Convert to float
+# only at the GraphQL boundary (see orders.py).
+CENT = Decimal("0.01")
+# Orders placed through this app are discounted down to this amount (1/1.18).
+TARGET_ORDER_VALUE = Decimal(1) / Decimal("1.18")
+
+CartTotals = namedtuple("CartTotals", ["subtotal", "item_count", "discount"])
+
+@lru_cache(maxsize=4096)
+def _parse_price(value: str) -> Decimal:
+    price = Decimal(value.strip())
+    if not price.is_finite() or price < 0:
+        raise ValueError(f"Invalid price: {value!r}")
+    return price
+
+def parse_price(value) -> Decimal:
+    """
+    Parses a price string (or number) into a Decimal. Raises ValueError if it is not
+    a finite, non-negative amount.
+    """
+    if isinstance(value, Decimal):
+        return value
+    try:
+        return _parse_price(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid price: {value!r}") from None
+
+def discount_for(subtotal: Decimal) -> Decimal:
+    """
+    Fixed discount that brings an order down to TARGET_ORDER_VALUE (never negative),
+    rounded to cents.
+    """
+    return max(Decimal("0.00"), (subtotal - TARGET_ORDER_VALUE).quantize(CENT, rounding=ROUND_HALF_UP))
+
+def line_total(price, quantity: int) -> Decimal:
+    return parse_price(price) * int(quantity)
+
+def existing_line_total(item: dict) -> Decimal:
+    """
+    What a stored line contributes to its cart's running subtotal: lines with an
+    unparseable price (stored before prices were validated) count as zero, as in
+    Cart.from_items.
+    """
+    try:
+        return line_total(item.get("price") or "0", item["quantity"])
+    except ValueError:
+        return Decimal("0")
+
+class Cart:
+    """
+    Cart items keyed by variant ID with a running subtotal and item count.
+
+    add() and remove() adjust the totals by the one line that changed, so reading
+    them is O(1); the discount is computed once per change, on first use.
+    """
+
+    def __init__(self):
+        self.items = {} # variant_id -> item dict (variant_id, product_title, variant_title, price, quantity)
+        self.subtotal = Decimal("0")
+        self.item_count = 0
+        self._discount = None
+
+    @classmethod
+    def from_items(cls, items: dict) -> "Cart":
+        """
+        Builds a cart from stored items, skipping (and logging) unparseable prices.
+        """
+        cart = cls()
+        for variant_id, item in items.items():
+            try:
+                cart.add({"variant_id": variant_id, **item})
+            except ValueError:
+                logger.warning("Could not parse price for item %s. Price: %s", variant_id, item.get('price'))
+        return cart
+
+    def add(self, item: dict):
+        """
+        Adds an item, or more of a variant already in the cart. The line takes the
+        new price, so the subtotal is adjusted by the whole line's change.
+        """
+        price = parse_price(item.get("price", "0"))
+        quantity = int(item["quantity"])
+        existing = self.items.get(item["variant_id"])
+        if existing:
+            self.subtotal -= existing_line_total(existing)
+            existing["price"] = item.get("price", "0")
+            existing["quantity"] += quantity
+            self.subtotal += price * existing["quantity"]
+        else:
+            self.items[item["variant_id"]] = dict(item, quantity=quantity)
+            self.subtotal += price * quantity
+        self.item_count += quantity
+        self._discount = None
+
+    def remove(self, variant_id: str) -> bool:
+        item = self.items.pop(variant_id, None)
+        if item is None:
+            return False
+        self.subtotal -= existing_line_total(item)
+        self.item_count -= item["quantity"]
+        self._discount = None
+        return True
+
+    def clear(self):
+        self.items.clear()
+        self.subtotal = Decimal("0")
+        self.item_count = 0
+        self._discount = None
+
+    @property
+    def discount(self) -> Decimal:
+        if self._discount is None:
+            self._discount = discount_for(self.subtotal)
+        return self._discount
+
+    def totals(self) -> CartTotals:
+        return CartTotals(self.subtotal, self.item_count, self.discount)
+
+def price_carts(carts) -> list:
+    """
+    Prices many carts at once, e.g. every row of a bulk import. Each cart is an
+    iterable of (price, quantity) pairs; identical price strings are parsed once.
+    Returns a CartTotals per cart, in order.
+    """
+    results = []
+    for lines in carts:
+        subtotal = Decimal("0")
+        item_count = 0
+        for price, quantity in lines:
+            subtotal += parse_price(price) * int(quantity)
+            item_count += int(quantity)
+        results.append(CartTotals(subtotal, item_count, discount_for(subtotal)))
+    return results
@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+import cart as cart_model
+
+logger = logging.getLogger(__name__)
+
+# Server-side storage for per-visitor carts and page state (last search results etc.).
+# The session cookie only carries a short session ID, so its size and signing cost
+# no longer grow with the cart. Use the SQLite backend when running several workers.
+CART_STORE_BACKEND = os.getenv('CART_STORE_BACKEND', 'sqlite')
+CART_STORE_PATH = os.getenv('CART_STORE_PATH', 'shopify_carts.sqlite3')
+CART_STORE_MAX_SESSIONS = int(os.getenv('CART_STORE_MAX_SESSIONS', '10000'))
+CART_SESSION_TTL = float(os.getenv('CART_SESSION_TTL', str(7 * 24 * 3600)))
+
+class CartStore:
+    """
+    Interface for cart/session state storage keyed by session ID.
+
+    Cart items are dicts with variant_id, product_title, variant_title, price and
+    quantity, stored per variant so adding or removing one item is O(1). Each cart's
+    subtotal and item count are kept up to date on every change (see cart.py), so
+    get_totals() doesn't re-price the cart. Prices must be valid (cart.parse_price).
+    """
+
+    def get_cart(self, sid: str) -> dict:
+        raise NotImplementedError
+
+    def get_totals(self, sid: str) -> cart_model.CartTotals:
+        raise NotImplementedError
+
+    def add_item(self, sid: str, item: dict):
+        raise NotImplementedError
+
+    def remove_item(self, sid: str, variant_id: str) -> bool:
+        raise NotImplementedError
+
+    def clear_cart(self, sid: str):
+        raise NotImplementedError
+
+    def get_state(self, sid: str, key: str, default=None):
+        raise NotImplementedError
+
+    def set_state(self, sid: str, key: str, value):
+        raise NotImplementedError
+
+class InMemoryCartStore(CartStore):
+    """
+    Process-local store with LRU eviction of whole sessions beyond max_sessions.
+    """
+
+    def __init__(self, max_sessions: int = CART_STORE_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict() # sid -> {"cart": cart.Cart, "state": {}}
+        self._lock = threading.Lock()
+
+    def _session(self, sid: str) -> dict:
+        data = self._sessions.get(sid)
+        if data is None:
+            data = self._sessions[sid] = {"cart": cart_model.Cart(), "state": {}}
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(sid)
+        return data
+
+    def get_cart(self, sid: str) -> dict:
+        with self._lock:
+            return {variant_id: dict(item) for variant_id, item in self._session(sid)["cart"].items.items()}
+
+    def get_totals(self, sid: str) -> cart_model.CartTotals:
+        with self._lock:
+            return self._session(sid)["cart"].totals()
+
+    def add_item(self, sid: str, item: dict):
+        with self._lock:
+            self._session(sid)["cart"].add(item)
+
+    def remove_item(self, sid: str, variant_id: str) -> bool:
+        with self._lock:
+            return self._session(sid)["cart"].remove(variant_id)
+
+    def clear_cart(self, sid: str):
+        with self._lock:
+            self._session(sid)["cart"].clear()
+
+    def get_state(self, sid: str, key: str, default=None):
+        with self._lock:
+            return self._session(sid)["state"].get(key, default)
+
+    def set_state(self, sid: str, key: str, value):
+        with self._lock:
+            self._session(sid)["state"][key] = value
+
+class SQLiteCartStore(CartStore):
+    """
+    SQLite-backed store shared by all worker processes. Sessions idle for longer
+    than session_ttl are pruned periodically.
+    """
+
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, path: str, session_ttl: float = CART_SESSION_TTL):
+        self.path = path
+        self.session_ttl = session_ttl
+        self._local = threading.local()
+        self._last_pruned = 0.0
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cart_items (
+                    sid TEXT NOT NULL,
+                    variant_id TEXT NOT NULL,
+                    product_title TEXT,
+                    variant_title TEXT,
+                    price TEXT,
+                    quantity INTEGER NOT NULL,
+                    PRIMARY KEY (sid, variant_id)
+                );
+                CREATE TABLE IF NOT EXISTS session_state (
+                    sid TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (sid, key)
+                );
+                CREATE TABLE IF NOT EXISTS cart_totals (
+                    sid TEXT PRIMARY KEY,
+                    subtotal TEXT NOT NULL,
+                    item_count INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cart_sessions (
+                    sid TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                );
+            """)
+        logger.info("Using SQLite cart store at %s", path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn: sqlite3.Connection, sid: str):
+        now = time.time()
+        conn.execute(
+            "INSERT INTO cart_sessions (sid, last_seen) VALUES (?, ?) "
+            "ON CONFLICT(sid) DO UPDATE SET last_seen = excluded.last_seen", (sid, now)
+        )
+        if now - self._last_pruned > self.PRUNE_INTERVAL:
+            self._last_pruned = now
+            cutoff = now - self.session_ttl
+            conn.execute("DELETE FROM cart_items WHERE sid IN (SELECT sid FROM cart_sessions WHERE last_seen < ?)", (cutoff,))
+            conn.execute("DELETE FROM session_state WHERE sid IN (SELECT sid FROM cart_sessions WHERE last_seen < ?)", (cutoff,))
+            conn.execute("DELETE FROM cart_totals WHERE sid IN (SELECT sid FROM cart_sessions WHERE last_seen < ?)", (cutoff,))
+            conn.execute("DELETE FROM cart_sessions WHERE last_seen < ?", (cutoff,))
+
+    def get_cart(self, sid: str) -> dict:
+        rows = self._connect().execute(
+            "SELECT variant_id, product_title, variant_title, price, quantity FROM cart_items "
+            "WHERE sid = ? ORDER BY rowid", (sid,)
+        ).fetchall()
+        return {
+            row[0]: {"variant_id": row[0], "product_title": row[1], "variant_title": row[2], "price": row[3], "quantity": row[4]}
+            for row in rows
+        }
+
+    def get_totals(self, sid: str) -> cart_model.CartTotals:
+        conn = self._connect()
+        row = conn.execute("SELECT subtotal, item_count FROM cart_totals WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            # Carts stored before running totals existed (or empty carts).
+            totals = cart_model.Cart.from_items(self.get_cart(sid)).totals()
+            if totals.item_count:
+                with conn:
+                    self._store_totals(conn, sid, totals.subtotal, totals.item_count)
+            return totals
+        subtotal = Decimal(row[0])
+        return cart_model.CartTotals(subtotal, row[1], cart_model.discount_for(subtotal))
+
+    def _store_totals(self, conn: sqlite3.Connection, sid: str, subtotal: Decimal, item_count: int):
+        conn.execute(
+            "INSERT INTO cart_totals (sid, subtotal, item_count) VALUES (?, ?, ?) "
+            "ON CONFLICT(sid) DO UPDATE SET subtotal = excluded.subtotal, item_count = excluded.item_count",
+            (sid, str(subtotal), item_count)
+        )
+
+    def _adjust_totals(self, conn: sqlite3.Connection, sid: str, amount: Decimal, quantity: int):
+        # Runs after the cart_items write in the same transaction, so the write lock
+        # is already held and concurrent updates to this cart are serialized.
+        # `amount` is the change in the cart's subtotal (new line total - old line total).
+        row = conn.execute("SELECT subtotal, item_count FROM cart_totals WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            totals = cart_model.Cart.from_items(self.get_cart(sid)).totals()
+            self._store_totals(conn, sid, totals.subtotal, totals.item_count)
+        else:
+            self._store_totals(conn, sid, Decimal(row[0]) + amount, row[1] + quantity)
+
+    def add_item(self, sid: str, item: dict):
+        price = cart_model.parse_price(item.get("price", "0"))
+        quantity = int(item["quantity"])
+        with self._connect() as conn:
+            # Take the write lock before reading the existing line, so its old total
+            # can't change before the totals row is adjusted.
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute(
+                "SELECT price, quantity FROM cart_items WHERE sid = ? AND variant_id = ?", (sid, item["variant_id"])
+            ).fetchone()
+            # A re-added variant takes the new price, like cart.Cart.add.
+            conn.execute(
+                "INSERT INTO cart_items (sid, variant_id, product_title, variant_title, price, quantity) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(sid, variant_id) DO UPDATE SET quantity = quantity + excluded.quantity, price = excluded.price",
+                (sid, item["variant_id"], item.get("product_title"), item.get("variant_title"), item.get("price"), quantity)
+            )
+            if existing is None:
+                amount = price * quantity
+            else:
+                old_total = cart_model.existing_line_total({"price": existing[0], "quantity": existing[1]})
+                amount = price * (existing[1] + quantity) - old_total
+            self._adjust_totals(conn, sid, amount, quantity)
+            self._touch(conn, sid)
+
+    def remove_item(self, sid: str, variant_id: str) -> bool:
+        with self._connect() as conn:
+            # SELECT then DELETE under the write lock (DELETE ... RETURNING needs SQLite 3.35+).
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute(
+                "SELECT price, quantity FROM cart_items WHERE sid = ? AND variant_id = ?", (sid, variant_id)
+            ).fetchone()
+            if removed is not None:
+                conn.execute("DELETE FROM cart_items WHERE sid = ? AND variant_id = ?", (sid, variant_id))
+                self._adjust_totals(conn, sid, -cart_model.existing_line_total({"price": removed[0], "quantity": removed[1]}), -removed[1])
+            self._touch(conn, sid)
+        return removed is not None
+
+    def clear_cart(self, sid: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cart_items WHERE sid = ?", (sid,))
+            conn.execute("DELETE FROM cart_totals WHERE sid = ?", (sid,))
+
+    def get_state(self, sid: str, key: str, default=None):
+        row = self._connect().execute(
+            "SELECT value FROM session_state WHERE sid = ? AND key = ?", (sid, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, sid: str, key: str, value):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO session_state (sid, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(sid, key) DO UPDATE SET value = excluded.value",
+                (sid, key, json.dumps(value))
+            )
+            self._touch(conn, sid)
+
+def create_cart_store(backend: str = CART_STORE_BACKEND, path: str = CART_STORE_PATH) -> CartStore:
+    """
+    Builds the configured cart store backend ("sqlite" or "memory").
+    """
+    if backend == 'memory':
+        return InMemoryCartStore()
+    if backend == 'sqlite':
+        return SQLiteCartStore(path)
+    raise ValueError(f"Unknown CART_STORE_BACKEND: {backend}")
@@ -0,0 +1,475 @@
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import requests
+
+import fast_json
+import queries
+import shopify_client
+from local_index import IndexRegistry, LocalIndex
+
+logger = logging.getLogger(__name__)
+
+# Local, per-shop mirror of the product catalog used to answer /products searches
+# in-process. The initial load uses a Shopify bulk operation (JSONL export), later
+# changes are picked up by polling products updated since the last sync, or pushed
+# in via apply_product_webhook(). Until a shop's index is loaded, callers fall back
+# to shopify_client.search_products.
+#
+# Shopify runs one bulk query operation per shop at a time, and every worker process
+# loads its own index. Before starting an export, a load checks the shop's current
+# bulk operation: if it is this export and still running, the load waits for it; if
+# it finished less than CATALOG_BULK_REUSE_MAX_AGE seconds ago, its result is reused.
+# A load from an export that started before the load is followed by an incremental
+# sync, which picks up products updated since the export (see local_index.py for
+# deletes and webhook changes during the load).
+CATALOG_INDEX_ENABLED = os.getenv('CATALOG_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CATALOG_SYNC_INTERVAL = float(os.getenv('CATALOG_SYNC_INTERVAL', '300'))
+CATALOG_BULK_POLL_INTERVAL = float(os.getenv('CATALOG_BULK_POLL_INTERVAL', '2'))
+CATALOG_BULK_TIMEOUT = float(os.getenv('CATALOG_BULK_TIMEOUT', '900'))
+CATALOG_BULK_REUSE_MAX_AGE = float(os.getenv('CATALOG_BULK_REUSE_MAX_AGE', '600'))
+MAX_PREFIX_LENGTH = 20
+
+PRODUCT_FIELDS = """
+id
+title
+descriptionHtml
+onlineStoreUrl
+updatedAt
+featuredImage {
+  url
+}
+"""
+
+VARIANT_FIELDS = """
+id
+title
+sku
+price
+image {
+  url
+}
+"""
+
+BULK_PRODUCTS_QUERY = f"""
+{{
+  products {{
+    edges {{
+      node {{
+        {PRODUCT_FIELDS}
+        variants {{
+          edges {{
+            node {{
+              {VARIANT_FIELDS}
+            }}
+          }}
+        }}
+      }}
+    }}
+  }}
+}}
+"""
+
+BULK_OPERATION_RUN_MUTATION = queries.register("""
+mutation bulkOperationRunQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation {
+      id
+      status
+      createdAt
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+""")
+
+BULK_OPERATION_STATUS_QUERY = queries.register("""
+query getBulkOperation($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation {
+      id
+      status
+      errorCode
+      objectCount
+      url
+      createdAt
+    }
+  }
+}
+""")
+
+CURRENT_BULK_OPERATION_QUERY = queries.register("""
+query currentBulkOperation {
+  currentBulkOperation {
+    id
+    status
+    errorCode
+    objectCount
+    url
+    query
+    createdAt
+    completedAt
+  }
+}
+""")
+
+UPDATED_PRODUCTS_QUERY = queries.register(f"""
+query productsUpdatedSince($searchQuery: String!, $cursor: String) {{
+  products(first: 50, query: $searchQuery, after: $cursor, sortKey: UPDATED_AT) {{
+    edges {{
+      node {{
+        {PRODUCT_FIELDS}
+        variants(first: 100) {{
+          edges {{
+            node {{
+              {VARIANT_FIELDS}
+            }}
+          }}
+        }}
+      }}
+    }}
+    pageInfo {{
+      hasNextPage
+      endCursor
+    }}
+  }}
+}}
+""")
+
+def simplify_product(node: dict, source: str = None) -> dict:
+    """
+    Flattens a product node (search or index shape) for templates and JSON responses.
+    `source` ("index" or "api") records which shape it came from: index nodes have every
+    field and variant, API search results only the "list" profile's.
+    """
+    variants = []
+    for var_edge in (node.get('variants') or {}).get('edges') or []:
+        var_node = var_edge.get('node', {})
+        variants.append({
+            'id': var_node.get('id'),
+            'title': var_node.get('title'),
+            'price': var_node.get('price'),
+            'image_url': var_node.get('image', {}).get('url') if var_node.get('image') else None
+        })
+    return {
+        'id': node.get('id'),
+        'title': node.get('title'),
+        'updatedAt': node.get('updatedAt'),
+        'descriptionHtml': node.get('descriptionHtml'),
+        'featuredImage_url': node.get('featuredImage', {}).get('url') if node.get('featuredImage') else None,
+        'variants': variants,
+        'source': source
+    }
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> list:
+    """
+    Case-folds and splits text into alphanumeric (Unicode word character) search tokens.
+    """
+    return _TOKEN_RE.findall(text.casefold()) if text else []
+
+def _searchable_tokens(node: dict) -> set:
+    tokens = set(tokenize(node.get("title")))
+    for edge in (node.get("variants") or {}).get("edges", []):
+        variant = edge.get("node") or {}
+        if variant.get("title") and variant["title"] != "Default Title":
+            tokens.update(tokenize(variant["title"]))
+        if variant.get("sku"):
+            tokens.update(tokenize(variant["sku"]))
+            tokens.add(variant["sku"].casefold())
+    return tokens
+
+def _prefixes(token: str):
+    for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+        yield token[:length]
+
+class CatalogIndex(LocalIndex):
+    """
+    In-memory product store plus an inverted prefix index over product titles,
+    variant titles and SKUs.
+    """
+
+    DATA_ATTRIBUTES = ("_products", "_postings", "_product_prefixes")
+
+    def __init__(self, shop_url: str):
+        super().__init__(shop_url)
+        self._products = {} # product GID -> product node (search_products shape)
+        self._postings = {} # prefix -> set of product GIDs
+        self._product_prefixes = {} # product GID -> set of prefixes, for removal
+
+    def __len__(self):
+        return len(self._products)
+
+    def upsert(self, node: dict, advance_high_water_mark: bool = True):
+        product_id = node.get("id")
+        if not product_id:
+            return
+        prefixes = {prefix for token in _searchable_tokens(node) for prefix in _prefixes(token)}
+        with self._lock:
+            self._unindex(product_id)
+            self._products[product_id] = node
+            self._product_prefixes[product_id] = prefixes
+            for prefix in prefixes:
+                self._postings.setdefault(prefix, set()).add(product_id)
+            if advance_high_water_mark:
+                self.advance_high_water_mark(node)
+
+    def remove(self, product_id: str):
+        with self._lock:
+            self._unindex(product_id)
+            self._products.pop(product_id, None)
+
+    def search(self, search_query: str, limit: int = 10):
+        """
+        Returns up to `limit` product nodes matching every token of the query as a prefix,
+        or None if the query has no tokens (e.g. only punctuation).
+        """
+        tokens = tokenize(search_query)
+        if not tokens:
+            return None
+        with self._lock:
+            matches = None
+            for token in tokens:
+                ids = self._postings.get(token[:MAX_PREFIX_LENGTH], set())
+                matches = set(ids) if matches is None else matches & ids
+                if not matches:
+                    return []
+            nodes = [self._products[product_id] for product_id in matches]
+        nodes.sort(key=lambda node: (node.get("title") or "").lower())
+        return nodes[:limit]
+
+    def _unindex(self, product_id: str):
+        for prefix in self._product_prefixes.pop(product_id, ()):
+            ids = self._postings.get(prefix)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._postings[prefix]
+
+_indexes = IndexRegistry("catalog", CatalogIndex, CATALOG_SYNC_INTERVAL)
+
+def get_index(shop_url: str) -> CatalogIndex:
+    """
+    Returns the catalog index for a shop, creating an empty (cold) one on first use.
+    """
+    return _indexes.get(shop_url)
+
+def search(shop_url: str, search_query: str, num_products: int = 10):
+    """
+    Searches the local index. Returns a result shaped like shopify_client.search_products,
+    or None if the shop's index is not loaded yet or the query has no searchable tokens
+    (callers should fall back to the API).
+    """
+    if not CATALOG_INDEX_ENABLED:
+        return None
+    index = get_index(shop_url)
+    if not index.loaded:
+        return None
+    nodes = index.search(search_query, limit=num_products)
+    if nodes is None:
+        return None
+    logger.info("Catalog index search for '%s' on %s matched %s products", search_query, shop_url, len(nodes))
+    return {
+        "products": [{"node": node} for node in nodes],
+        "pageInfo": {"hasNextPage": False, "hasPreviousPage": False, "startCursor": None, "endCursor": None},
+    }
+
+def ensure_fresh(shop_url: str, access_token: str):
+    """
+    Starts a background bulk load if the shop's index is cold, or an incremental sync
+    if it is older than CATALOG_SYNC_INTERVAL. Never blocks the caller.
+    """
+    if CATALOG_INDEX_ENABLED:
+        _indexes.ensure_fresh(shop_url, access_token, load_catalog, sync_updated_since)
+
+def load_catalog(shop_url: str, access_token: str):
+    """
+    Loads the full catalog for a shop through a bulk operation and swaps it into the index.
+    """
+    logger.info("Starting catalog bulk load for %s", shop_url)
+    started_at = datetime.now(timezone.utc)
+    operation = run_bulk_query(shop_url, access_token, BULK_PRODUCTS_QUERY)
+    created_at = _parse_timestamp(operation.get("createdAt")) or started_at
+    index = get_index(shop_url)
+    index.replace_all(iter_bulk_products(operation["url"]) if operation.get("url") else [])
+    if index.high_water_mark is None:
+        index.high_water_mark = created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    index.loaded = True
+    index.last_synced_at = time.monotonic()
+    logger.info("Catalog bulk load for %s finished: %s products indexed", shop_url, len(index))
+    if created_at < started_at:
+        # A reused (or joined) export misses changes made between its start and this load.
+        sync_updated_since(shop_url, access_token)
+
+def _parse_timestamp(value: str):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+def _same_query(a: str, b: str) -> bool:
+    return " ".join((a or "").split()) == " ".join((b or "").split())
+
+def find_reusable_bulk_operation(shop_url: str, access_token: str, bulk_query: str):
+    """
+    Returns the shop's current bulk query operation if it is running `bulk_query` or
+    completed it within CATALOG_BULK_REUSE_MAX_AGE (e.g. started by another worker
+    process), else None. Raises RuntimeError if a different bulk query is running,
+    since Shopify allows only one at a time.
+    """
+    response_data = shopify_client.make_graphql_request(shop_url, access_token, CURRENT_BULK_OPERATION_QUERY)
+    operation = (response_data.get("data") or {}).get("currentBulkOperation")
+    if not operation:
+        return None
+    status = operation.get("status")
+    same_query = _same_query(operation.get("query"), bulk_query)
+    if status in ("CREATED", "RUNNING"):
+        if not same_query:
+            raise RuntimeError(f"Another bulk query operation ({operation.get('id')}) is running on {shop_url}")
+        logger.info("Waiting for the bulk operation %s already running on %s", operation.get('id'), shop_url)
+        return operation
+    if status == "COMPLETED" and same_query and operation.get("completedAt"):
+        completed_at = _parse_timestamp(operation["completedAt"])
+        if (datetime.now(timezone.utc) - completed_at).total_seconds() < CATALOG_BULK_REUSE_MAX_AGE:
+            logger.info("Reusing bulk operation %s completed at %s on %s", operation.get('id'), operation['completedAt'], shop_url)
+            return operation
+    return None
+
+def start_bulk_query(shop_url: str, access_token: str, bulk_query: str) -> dict:
+    response_data = shopify_client.make_graphql_request(
+        shop_url, access_token, BULK_OPERATION_RUN_MUTATION, {"query": bulk_query}
+    )
+    result = (response_data.get("data") or {}).get("bulkOperationRunQuery") or {}
+    if result.get("userErrors"):
+        # Another worker may have started the same export since we checked.
+        operation = find_reusable_bulk_operation(shop_url, access_token, bulk_query)
+        if operation:
+            return operation
+        raise RuntimeError(f"bulkOperationRunQuery failed for {shop_url}: {result['userErrors']}")
+    operation = result.get("bulkOperation") or {}
+    if not operation.get("id"):
+        raise RuntimeError(f"bulkOperationRunQuery returned no operation for {shop_url}: {response_data}")
+    return operation
+
+def run_bulk_query(shop_url: str, access_token: str, bulk_query: str) -> dict:
+    """
+    Runs a bulk query operation (or joins/reuses the shop's current one, see
+    find_reusable_bulk_operation) and waits for it to finish. Returns the completed
+    operation; its url is the JSONL result (None if the operation matched no objects)
+    and createdAt is when its snapshot started.
+    """
+    operation = find_reusable_bulk_operation(shop_url, access_token, bulk_query)
+    if operation is None:
+        operation = start_bulk_query(shop_url, access_token, bulk_query)
+
+    deadline = time.monotonic() + CATALOG_BULK_TIMEOUT
+    while operation.get("status") != "COMPLETED" and time.monotonic() < deadline:
+        time.sleep(CATALOG_BULK_POLL_INTERVAL)
+        status_data = shopify_client.make_graphql_request(
+            shop_url, access_token, BULK_OPERATION_STATUS_QUERY, {"id": operation["id"]}
+        )
+        operation = (status_data.get("data") or {}).get("node") or {}
+        status = operation.get("status")
+        logger.debug("Bulk operation %s on %s: %s (%s objects)", operation.get('id'), shop_url, status, operation.get('objectCount'))
+        if status in ("FAILED", "CANCELED", "EXPIRED"):
+            raise RuntimeError(f"Bulk operation on {shop_url} ended with {status} ({operation.get('errorCode')})")
+    if operation.get("status") == "COMPLETED":
+        return operation
+    raise TimeoutError(f"Bulk operation on {shop_url} did not finish within {CATALOG_BULK_TIMEOUT}s")
+
+def iter_bulk_products(url: str):
+    """
+    Streams a bulk operation JSONL file line by line and yields assembled product nodes.
+
+    Bulk output flattens nested connections: each variant is its own line carrying the
+    parent product's id in __parentId, and always follows its parent.
+    """
+    current = None
+    with requests.get(url, stream=True, timeout=shopify_client.get_timeout()) as response:
+        response.raise_for_status()
+        # Large chunks: the default iter_lines() chunk size of 512 bytes dominates the
+        # cost of reading multi-megabyte exports.
+        for line in response.iter_lines(chunk_size=shopify_client.RESPONSE_CHUNK_SIZE):
+            if not line:
+                continue
+            record = fast_json.loads(line)
+            parent_id = record.pop("__parentId", None)
+            if parent_id is None:
+                if current is not None:
+                    yield current
+                record["variants"] = {"edges": []}
+                current = record
+            elif current is not None and parent_id == current["id"]:
+                current["variants"]["edges"].append({"node": record})
+    if current is not None:
+        yield current
+
+def sync_updated_since(shop_url: str, access_token: str):
+    """
+    Applies products updated since the index's high-water mark.
+    """
+    index = get_index(shop_url)
+    since = index.high_water_mark
+    search_query = f"updated_at:>'{since}'" if since else ""
+    logger.info("Syncing catalog changes for %s since %s", shop_url, since)
+    cursor = None
+    updated = 0
+    while True:
+        variables = {"searchQuery": search_query}
+        if cursor:
+            variables["cursor"] = cursor
+        response_data = shopify_client.make_graphql_request(shop_url, access_token, UPDATED_PRODUCTS_QUERY, variables)
+        products_data = (response_data.get("data") or {}).get("products")
+        if not products_data:
+            logger.warning("Unexpected response while syncing catalog for %s: %s", shop_url, response_data.get('errors'))
+            break
+        for edge in products_data["edges"]:
+            index.upsert(edge["node"])
+            updated += 1
+        if not products_data["pageInfo"]["hasNextPage"]:
+            break
+        cursor = products_data["pageInfo"]["endCursor"]
+    index.last_synced_at = time.monotonic()
+    if updated:
+        shopify_client.invalidate_product_search_cache(shop_url)
+    logger.info("Catalog sync for %s applied %s product updates", shop_url, updated)
+
+def apply_product_webhook(shop_url: str, payload: dict):
+    """
+    Applies a products/create or products/update webhook payload (REST shape) to the index.
+    """
+    product_id = payload.get("admin_graphql_api_id")
+    if not product_id:
+        return
+    images = {image.get("id"): image.get("src") for image in payload.get("images") or []}
+    featured = payload.get("image") or {}
+    variants = []
+    for variant in payload.get("variants") or []:
+        image_url = images.get(variant.get("image_id"))
+        variants.append({"node": {
+            "id": variant.get("admin_graphql_api_id"),
+            "title": variant.get("title"),
+            "sku": variant.get("sku"),
+            "price": variant.get("price"),
+            "image": {"url": image_url} if image_url else None,
+        }})
+    get_index(shop_url).upsert_from_webhook({
+        "id": product_id,
+        "title": payload.get("title"),
+        "descriptionHtml": payload.get("body_html"),
+        "onlineStoreUrl": None,
+        "updatedAt": payload.get("updated_at"),
+        "featuredImage": {"url": featured["src"]} if featured.get("src") else None,
+        "variants": {"edges": variants},
+    })
+
+def apply_product_delete_webhook(shop_url: str, payload: dict):
+    """
+    Applies a products/delete webhook payload to the index.
+    """
+    if payload.get("id") is not None:
+        get_index(shop_url).remove_from_webhook(f"gid://shopify/Product/{payload['id']}")
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Per-shop circuit breaker for Shopify Admin API calls.
+#
+# After SHOPIFY_BREAKER_FAILURE_THRESHOLD consecutive transient failures (timeouts,
+# connection errors, 5xx) a shop's breaker opens and calls fail immediately with
+# CircuitOpenError instead of tying up a worker for the full timeout. After
+# SHOPIFY_BREAKER_RESET_TIMEOUT seconds one trial call is let through ("half open");
+# success closes the breaker, failure opens it again.
+SHOPIFY_BREAKER_FAILURE_THRESHOLD = int(os.getenv('SHOPIFY_BREAKER_FAILURE_THRESHOLD', '5'))
+SHOPIFY_BREAKER_RESET_TIMEOUT = float(os.getenv('SHOPIFY_BREAKER_RESET_TIMEOUT', '30'))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of calling Shopify while a shop's breaker is open.
+    """
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one shop.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = SHOPIFY_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = SHOPIFY_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the call must not be made now.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                logger.info("Circuit for %s is half open; sending a trial request", self.name)
+                return
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"Shopify API for {self.name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                logger.warning("Circuit for %s opened after %s consecutive failure(s)", self.name, self.failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def is_degraded(self) -> bool:
+        """
+        True while the breaker is open or half open.
+        """
+        with self._lock:
+            return self.state != CLOSED
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(shop_url: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker for a shop, creating it on first use.
+    """
+    breaker = _breakers.get(shop_url)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(shop_url, CircuitBreaker(shop_url))
+    return breaker
+
+def is_degraded(shop_url: str) -> bool:
+    breaker = _breakers.get(shop_url)
+    return breaker is not None and breaker.is_degraded()
@@ -0,0 +1,250 @@
+import heapq
+import logging
+import os
+import re
+import time
+
+import shopify_client
+from catalog import tokenize, MAX_PREFIX_LENGTH
+from local_index import IndexRegistry, LocalIndex
+
+logger = logging.getLogger(__name__)
+
+# Local, per-shop index of customer names, emails and phone numbers used to answer
+# typeahead suggestions (/api/customers/suggest) in-process. The index is warmed by
+# paging through all customers with shopify_client.iter_customers, kept current by
+# polling customers updated since the last sync and by customers/* webhooks. Until a
+# shop's index is loaded, callers fall back to the Admin API customer search.
+CUSTOMER_INDEX_ENABLED = os.getenv('CUSTOMER_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CUSTOMER_SYNC_INTERVAL = float(os.getenv('CUSTOMER_SYNC_INTERVAL', '300'))
+CUSTOMER_SYNC_PAGE_SIZE = int(os.getenv('CUSTOMER_SYNC_PAGE_SIZE', '250'))
+
+_DIGITS_RE = re.compile(r"\D+")
+
+def simplify_customer(node: dict) -> dict:
+    """
+    Flattens a customer node (CUSTOMER_SEARCH_QUERY / CUSTOMERS_PAGE_QUERY shape) for
+    templates and JSON responses.
+    """
+    email_node = node.get('email')
+    phone_node = node.get('phone')
+    return {
+        'id': node.get('id'),
+        'firstName': node.get('firstName'),
+        'lastName': node.get('lastName'),
+        'email': email_node.get('emailAddress') if email_node else 'N/A',
+        'phone': phone_node.get('phoneNumber') if phone_node else 'N/A',
+        'addresses': node.get('addresses') or []
+    }
+
+def _trigrams(text: str):
+    for i in range(len(text) - 2):
+        yield text[i:i + 3]
+
+def _index_keys(customer: dict):
+    """
+    Returns (prefix keys, trigram keys, haystack) for a simplified customer.
+    Prefixes cover every name/email/phone token; trigrams cover the full email and
+    phone digits so "gmail" or the last digits of a number also match.
+    """
+    email = customer['email'].casefold() if customer['email'] != 'N/A' else ''
+    phone = _DIGITS_RE.sub('', customer['phone']) if customer['phone'] != 'N/A' else ''
+    tokens = set(tokenize(customer.get('firstName')) + tokenize(customer.get('lastName')) + tokenize(email))
+    if email:
+        tokens.add(email)
+    if phone:
+        tokens.add(phone)
+    prefixes = {token[:length] for token in tokens for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)}
+    trigrams = set(_trigrams(email)) | set(_trigrams(phone))
+    haystack = " ".join([(customer.get('firstName') or '').casefold(), (customer.get('lastName') or '').casefold(), email, phone])
+    return prefixes, trigrams, haystack
+
+class CustomerIndex(LocalIndex):
+    """
+    In-memory customer store with an inverted prefix index over name, email and
+    phone tokens plus a trigram index for substring matches on emails and phones.
+    """
+
+    DATA_ATTRIBUTES = ("_customers", "_haystacks", "_sort_keys", "_postings", "_customer_keys")
+
+    def __init__(self, shop_url: str):
+        super().__init__(shop_url)
+        self._customers = {} # customer GID -> simplified customer
+        self._haystacks = {} # customer GID -> case-folded searchable text
+        self._sort_keys = {} # customer GID -> (first name, last name, GID) for ranking
+        self._postings = {} # prefix or trigram -> set of customer GIDs
+        self._customer_keys = {} # customer GID -> set of keys, for removal
+
+    def __len__(self):
+        return len(self._customers)
+
+    def upsert(self, node: dict, advance_high_water_mark: bool = True):
+        customer_id = node.get("id")
+        if not customer_id:
+            return
+        customer = simplify_customer(node)
+        prefixes, trigrams, haystack = _index_keys(customer)
+        # Trigram keys are stored with a marker so they never collide with 3-character prefixes.
+        keys = prefixes | {f"\0{trigram}" for trigram in trigrams}
+        with self._lock:
+            self._unindex(customer_id)
+            self._customers[customer_id] = customer
+            self._haystacks[customer_id] = haystack
+            self._sort_keys[customer_id] = ((customer.get('firstName') or '').lower(), (customer.get('lastName') or '').lower(), customer_id)
+            self._customer_keys[customer_id] = keys
+            for key in keys:
+                self._postings.setdefault(key, set()).add(customer_id)
+            if advance_high_water_mark:
+                self.advance_high_water_mark(node)
+
+    def remove(self, customer_id: str):
+        with self._lock:
+            self._unindex(customer_id)
+            self._customers.pop(customer_id, None)
+            self._haystacks.pop(customer_id, None)
+            self._sort_keys.pop(customer_id, None)
+
+    def search(self, search_query: str, limit: int = 10) -> list:
+        """
+        Returns up to `limit` simplified customers matching every query term as a token
+        prefix. If that finds fewer than `limit`, terms of 3+ characters may also match
+        as a substring of the email or phone number.
+        """
+        terms = search_query.casefold().split()
+        if not terms:
+            return []
+        with self._lock:
+            matches = self._intersect(terms, self._prefix_ids)
+            if len(matches) < limit:
+                matches = self._intersect(terms, self._matching_ids)
+            ranked = heapq.nsmallest(limit, matches, key=self._sort_keys.__getitem__)
+            return [self._customers[customer_id] for customer_id in ranked]
+
+    def _intersect(self, terms: list, lookup) -> set:
+        matches = None
+        # Start from the rarest term so the intersections stay small.
+        for ids in sorted((lookup(term) for term in terms), key=len):
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return set()
+        return matches
+
+    def _prefix_ids(self, term: str) -> set:
+        ids = self._postings.get(term[:MAX_PREFIX_LENGTH], set())
+        digits = _DIGITS_RE.sub('', term)
+        if digits and digits != term:
+            ids = ids | self._postings.get(digits[:MAX_PREFIX_LENGTH], set())
+        return ids
+
+    def _matching_ids(self, term: str) -> set:
+        ids = set(self._prefix_ids(term))
+        digits = _DIGITS_RE.sub('', term)
+        for needle in {term, digits}:
+            if len(needle) < 3:
+                continue
+            candidates = None
+            for trigram in _trigrams(needle):
+                posting = self._postings.get(f"\0{trigram}", set())
+                candidates = set(posting) if candidates is None else candidates & posting
+                if not candidates:
+                    break
+            ids |= {customer_id for customer_id in candidates or () if needle in self._haystacks[customer_id]}
+        return ids
+
+    def _unindex(self, customer_id: str):
+        for key in self._customer_keys.pop(customer_id, ()):
+            ids = self._postings.get(key)
+            if ids is not None:
+                ids.discard(customer_id)
+                if not ids:
+                    del self._postings[key]
+
+_indexes = IndexRegistry("customer", CustomerIndex, CUSTOMER_SYNC_INTERVAL)
+
+def get_index(shop_url: str) -> CustomerIndex:
+    """
+    Returns the customer index for a shop, creating an empty (cold) one on first use.
+    """
+    return _indexes.get(shop_url)
+
+def suggest(shop_url: str, search_query: str, limit: int = 10):
+    """
+    Searches the local index. Returns a list of simplified customers, or None if the
+    shop's index is not loaded yet (callers should fall back to the API).
+    """
+    if not CUSTOMER_INDEX_ENABLED:
+        return None
+    index = get_index(shop_url)
+    if not index.loaded:
+        return None
+    return index.search(search_query, limit=limit)
+
+def ensure_fresh(shop_url: str, access_token: str):
+    """
+    Starts a background full load if the shop's index is cold, or an incremental sync
+    if it is older than CUSTOMER_SYNC_INTERVAL. Never blocks the caller.
+    """
+    if CUSTOMER_INDEX_ENABLED:
+        _indexes.ensure_fresh(shop_url, access_token, load_customers, sync_updated_since)
+
+def load_customers(shop_url: str, access_token: str):
+    """
+    Pages through every customer of a shop and swaps them into the index.
+    """
+    logger.info("Starting customer index load for %s", shop_url)
+    index = get_index(shop_url)
+    index.replace_all(shopify_client.iter_customers(shop_url, access_token, page_size=CUSTOMER_SYNC_PAGE_SIZE))
+    index.loaded = True
+    index.last_synced_at = time.monotonic()
+    logger.info("Customer index load for %s finished: %s customers indexed", shop_url, len(index))
+
+def sync_updated_since(shop_url: str, access_token: str):
+    """
+    Applies customers updated since the index's high-water mark.
+    """
+    index = get_index(shop_url)
+    since = index.high_water_mark
+    search_query = f"updated_at:>'{since}'" if since else None
+    logger.info("Syncing customer changes for %s since %s", shop_url, since)
+    updated = 0
+    for node in shopify_client.iter_customers(shop_url, access_token, search_query, page_size=CUSTOMER_SYNC_PAGE_SIZE):
+        index.upsert(node)
+        updated += 1
+    index.last_synced_at = time.monotonic()
+    logger.info("Customer sync for %s applied %s customer updates", shop_url, updated)
+
+def apply_customer_webhook(shop_url: str, payload: dict):
+    """
+    Applies a customers/create or customers/update webhook payload (REST shape) to the index.
+    """
+    customer_id = payload.get("admin_graphql_api_id")
+    if not customer_id:
+        return
+    addresses = []
+    for address in payload.get("addresses") or []:
+        addresses.append({
+            "address1": address.get("address1"),
+            "address2": address.get("address2"),
+            "city": address.get("city"),
+            "zip": address.get("zip"),
+            "provinceCode": address.get("province_code"),
+            "countryCodeV2": address.get("country_code"),
+            "formatted": [part for part in (address.get("address1"), address.get("address2"), address.get("city"),
+                                            address.get("zip"), address.get("country")) if part],
+            "phone": address.get("phone"),
+        })
+    get_index(shop_url).upsert_from_webhook({
+        "id": customer_id,
+        "firstName": payload.get("first_name"),
+        "lastName": payload.get("last_name"),
+        "email": {"emailAddress": payload["email"]} if payload.get("email") else None,
+        "phone": {"phoneNumber": payload["phone"]} if payload.get("phone") else None,
+        "addresses": addresses[:5],
+    })
+
+def apply_customer_delete_webhook(shop_url: str, payload: dict):
+    """
+    Applies a customers/delete webhook payload to the index.
+    """
+    if payload.get("id") is not None:
+        get_index(shop_url).remove_from_webhook(f"gid://shopify/Customer/{payload['id']}")
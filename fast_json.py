@@ -0,0 +1,38 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# JSON encode/decode used on the Shopify request path. orjson is used when it is
+# installed (pip install orjson) and SHOPIFY_JSON_BACKEND is "auto" or "orjson";
+# otherwise the stdlib json module. Both backends accept bytes and str input, and
+# dumps() always returns compact UTF-8 bytes ready to be sent as a request body.
+SHOPIFY_JSON_BACKEND = os.getenv('SHOPIFY_JSON_BACKEND', 'auto')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if SHOPIFY_JSON_BACKEND == 'orjson' and orjson is None:
+    logger.warning("SHOPIFY_JSON_BACKEND=orjson but orjson is not installed; using the stdlib json module")
+
+if orjson is not None and SHOPIFY_JSON_BACKEND in ('auto', 'orjson'):
+    BACKEND = 'orjson'
+    JSONDecodeError = orjson.JSONDecodeError # Subclass of json.JSONDecodeError / ValueError
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    BACKEND = 'json'
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
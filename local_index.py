@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Shared lifecycle for the per-shop, in-process search indexes (catalog.py for
+# products, customers.py for customers). Each index is loaded in full in the
+# background on first use, kept current by incremental syncs since a high-water mark
+# (the largest updatedAt seen) and by webhooks, and swapped atomically on reload.
+# Webhook changes that arrive while a load is running are recorded and replayed onto
+# the new index after the swap. Deletes are also remembered for INDEX_TOMBSTONE_TTL
+# seconds, so a load from an older export (see CATALOG_BULK_REUSE_MAX_AGE) cannot
+# bring back records deleted since; deleted IDs are never reused by Shopify.
+#
+# A failed load or sync is not retried on the next request: the shop's index waits
+# INDEX_RETRY_BACKOFF_BASE seconds, doubling per consecutive failure up to
+# INDEX_RETRY_BACKOFF_MAX, so a failing shop doesn't start a new load per request.
+INDEX_RETRY_BACKOFF_BASE = float(os.getenv('INDEX_RETRY_BACKOFF_BASE', '30'))
+INDEX_RETRY_BACKOFF_MAX = float(os.getenv('INDEX_RETRY_BACKOFF_MAX', '1800'))
+INDEX_TOMBSTONE_TTL = float(os.getenv('INDEX_TOMBSTONE_TTL', '3600'))
+
+class LocalIndex:
+    """
+    Base class for a shop's in-memory index. Subclasses keep their records in the
+    attributes named by DATA_ATTRIBUTES (swapped as a whole by replace_all) and
+    implement upsert() and remove(), calling advance_high_water_mark() from upsert().
+    """
+
+    DATA_ATTRIBUTES = ()
+
+    def __init__(self, shop_url: str):
+        self.shop_url = shop_url
+        self.loaded = False
+        self.loading = False
+        self.last_synced_at = None # Monotonic time of the last successful load/sync
+        self.high_water_mark = None # Max updatedAt seen (ISO 8601)
+        self.failures = 0 # Consecutive failed loads/syncs
+        self.retry_at = 0.0 # Monotonic time before which no new load/sync starts
+        self._pending_changes = None # (record ID, node or None for a delete) received during a load
+        self._tombstones = {} # record ID -> monotonic time of its delete webhook
+        self._lock = threading.RLock()
+
+    def upsert(self, node: dict, advance_high_water_mark: bool = True):
+        raise NotImplementedError
+
+    def remove(self, record_id: str):
+        raise NotImplementedError
+
+    def advance_high_water_mark(self, node: dict):
+        """
+        Moves the high-water mark to the node's updatedAt if it is newer. Call with the lock held.
+        """
+        updated_at = node.get("updatedAt")
+        if updated_at and (self.high_water_mark is None or updated_at > self.high_water_mark):
+            self.high_water_mark = updated_at
+
+    def upsert_from_webhook(self, node: dict):
+        with self._lock:
+            # Webhook timestamps carry a shop-local offset, so they can't be compared with
+            # the high-water mark (UTC, from the Admin API) and must not move it.
+            self.upsert(node, advance_high_water_mark=False)
+            if self._pending_changes is not None:
+                self._pending_changes.append((node.get("id"), node))
+
+    def remove_from_webhook(self, record_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self.remove(record_id)
+            if self._pending_changes is not None:
+                self._pending_changes.append((record_id, None))
+            self._tombstones[record_id] = now
+            for expired in [key for key, removed_at in self._tombstones.items() if now - removed_at > INDEX_TOMBSTONE_TTL]:
+                del self._tombstones[expired]
+
+    def start_recording(self):
+        """
+        Starts recording webhook changes for replace_all() to replay after a load.
+        """
+        with self._lock:
+            self._pending_changes = []
+
+    def stop_recording(self):
+        with self._lock:
+            self._pending_changes = None
+
+    def replace_all(self, nodes):
+        """
+        Swaps in a freshly loaded index. `nodes` may be any iterable (e.g. a stream);
+        searches keep using the old data until the new index is complete. Webhook
+        changes recorded since start_recording() are replayed onto the new data.
+        """
+        fresh = type(self)(self.shop_url)
+        for node in nodes:
+            fresh.upsert(node)
+        with self._lock:
+            for record_id in self._tombstones:
+                fresh.remove(record_id)
+            for record_id, node in self._pending_changes or ():
+                if node is None:
+                    fresh.remove(record_id)
+                else:
+                    fresh.upsert(node, advance_high_water_mark=False)
+            self._pending_changes = None
+            for name in self.DATA_ATTRIBUTES:
+                setattr(self, name, getattr(fresh, name))
+            self.high_water_mark = fresh.high_water_mark
+
+class IndexRegistry:
+    """
+    The indexes of one kind, by shop, and their background loading.
+    """
+
+    def __init__(self, name: str, index_class, sync_interval: float):
+        self.name = name
+        self.index_class = index_class
+        self.sync_interval = sync_interval
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, shop_url: str) -> LocalIndex:
+        """
+        Returns the index for a shop, creating an empty (cold) one on first use.
+        """
+        index = self._indexes.get(shop_url)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(shop_url, self.index_class(shop_url))
+        return index
+
+    def ensure_fresh(self, shop_url: str, access_token: str, load, sync):
+        """
+        Starts `load(shop_url, access_token)` in a background thread if the shop's index
+        is cold, or `sync(...)` if it is older than the sync interval. Never blocks the caller.
+        """
+        index = self.get(shop_url)
+        with index._lock:
+            if index.loading or time.monotonic() < index.retry_at:
+                return
+            if index.loaded and index.last_synced_at and time.monotonic() - index.last_synced_at < self.sync_interval:
+                return
+            index.loading = True
+        target = sync if index.loaded else load
+        if target is load:
+            index.start_recording()
+        thread = threading.Thread(target=self._run_in_background, args=(target, index, shop_url, access_token),
+                                  name=f"{self.name}-sync-{shop_url}", daemon=True)
+        thread.start()
+
+    def _run_in_background(self, target, index: LocalIndex, shop_url: str, access_token: str):
+        try:
+            target(shop_url, access_token)
+        except Exception as e:
+            index.stop_recording()
+            index.failures += 1
+            delay = min(INDEX_RETRY_BACKOFF_MAX, INDEX_RETRY_BACKOFF_BASE * 2 ** (index.failures - 1))
+            index.retry_at = time.monotonic() + delay
+            logger.error("%s sync for %s failed (attempt %s), retrying in %.0fs: %s",
+                         self.name.capitalize(), shop_url, index.failures, delay, e, exc_info=True)
+        else:
+            index.failures = 0
+            index.retry_at = 0.0
+        finally:
+            index.loading = False
@@ -0,0 +1,109 @@
+import logging
+import os
+import random
+import re
+
+import fast_json
+
+# Helpers for logging request/response payloads cheaply and safely.
+#
+# Log calls use %-style arguments so nothing is formatted unless the record is
+# actually emitted. Payloads are wrapped in payload(), which defers serialisation
+# until then too, masks secrets and personal data, truncates the result to
+# LOG_PAYLOAD_MAX_CHARS and, with LOG_PAYLOAD_SAMPLE_RATE < 1, only includes a
+# fraction of payloads at all. RedactingFilter masks access tokens in any record
+# that still carries one.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '1.0'))
+
+REDACTED = "[REDACTED]"
+
+# Keys whose values are secrets or personal data (compared lower-cased). Generic names
+# such as "code" or "state" are left out: GraphQL errors carry extensions.code
+# (THROTTLED, ACCESS_DENIED ...), which is what the error logs are for. Mask
+# request-specific secrets (e.g. the OAuth callback's code/state/hmac) at the call site.
+SENSITIVE_KEYS = frozenset({
+    "access_token", "x-shopify-access-token", "client_secret",
+    "email", "emailaddress", "phone", "phonenumber", "firstname", "lastname", "first_name", "last_name",
+    "address1", "address2", "zip", "formatted", "note", "staffnote",
+})
+
+# Shopify access tokens and app secrets (shpat_, shpca_, shppa_, shpua_, shpss_ ...).
+_TOKEN_RE = re.compile(r"\bshp[a-z]{2}_[0-9a-fA-F]{16,}\b")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+def redact(value):
+    """
+    Returns a copy of a JSON-like structure with sensitive values masked.
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if isinstance(key, str) and key.lower() in SENSITIVE_KEYS and value[key] not in (None, "", [], {})
+            else redact(value[key])
+            for key in value
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+def redact_text(text: str) -> str:
+    """
+    Masks access tokens and email addresses in free text.
+    """
+    return _EMAIL_RE.sub(REDACTED, _TOKEN_RE.sub(REDACTED, text))
+
+def truncate(text: str, max_chars: int = None) -> str:
+    max_chars = max_chars or LOG_PAYLOAD_MAX_CHARS
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+
+class payload:
+    """
+    Lazy log argument for a request/response structure:
+
+        logger.debug("orderCreate response: %s", log_utils.payload(response_data))
+
+    Serialisation, redaction and truncation only happen if the record is emitted.
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int = None):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self):
+        if LOG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+            return "<payload not sampled>"
+        try:
+            text = fast_json.dumps(redact(self.value)).decode("utf-8")
+        except (TypeError, ValueError):
+            text = redact_text(repr(self.value))
+        return truncate(text, self.max_chars)
+
+    __repr__ = __str__
+
+class RedactingFilter(logging.Filter):
+    """
+    Masks Shopify access tokens in formatted log messages (defence in depth for
+    messages that interpolate headers or token responses).
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Store the formatted message so handlers don't format the record a second time.
+        record.msg, record.args = _TOKEN_RE.sub(REDACTED, record.getMessage()), None
+        return True
+
+def configure_logging():
+    """
+    Sets up root logging (level from LOG_LEVEL) with token redaction on every handler.
+    """
+    logging.basicConfig(level=LOG_LEVEL,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RedactingFilter) for f in handler.filters):
+            handler.addFilter(RedactingFilter())
@@ -0,0 +1,233 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics exposed in the Prometheus text format at /metrics.
+#
+# Covers Shopify GraphQL calls (round-trip latency, query cost, throttling and
+# errors per operation and shop), Flask request time per endpoint and template
+# render time, so slow shops and slow pages can be told apart. Values are per
+# worker process; scrape every worker (or run a single process) for totals.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>" (shop domains are labels).
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COST_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self, **labels) -> float:
+        """
+        Sum over all label sets matching the given labels (e.g. every operation of one shop).
+        """
+        wanted = [(index, str(labels[name])) for index, name in enumerate(self.labelnames) if name in labels]
+        with self._lock:
+            return sum(value for key, value in self._values.items() if all(key[i] == v for i, v in wanted))
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    """
+    Bucketed observations (e.g. latencies) per label set, with sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., +Inf count], sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+# Shopify Admin API
+SHOPIFY_REQUEST_SECONDS = Histogram(
+    "shopify_graphql_request_duration_seconds",
+    "Time spent in make_graphql_request, including client-side throttling and retries.",
+    ("operation", "shop", "outcome"))
+SHOPIFY_ROUNDTRIP_SECONDS = Histogram(
+    "shopify_graphql_roundtrip_duration_seconds",
+    "HTTP round trip to Shopify per attempt (send, read and decode the response).",
+    ("operation", "shop"))
+SHOPIFY_QUERY_COST = Histogram(
+    "shopify_graphql_query_cost",
+    "Actual query cost reported by Shopify.",
+    ("operation", "shop"), buckets=COST_BUCKETS)
+SHOPIFY_THROTTLED = Counter(
+    "shopify_graphql_throttled_total",
+    "Attempts throttled by Shopify (HTTP 429 or THROTTLED errors).",
+    ("operation", "shop"))
+SHOPIFY_THROTTLE_WAIT_SECONDS = Counter(
+    "shopify_graphql_throttle_wait_seconds_total",
+    "Time spent waiting for the client-side cost bucket or backing off after throttling.",
+    ("operation", "shop"))
+SHOPIFY_RETRIES = Counter(
+    "shopify_graphql_retries_total",
+    "Attempts retried after a transient error (connection error, timeout or 5xx).",
+    ("operation", "shop"))
+SHOPIFY_ERRORS = Counter(
+    "shopify_graphql_errors_total",
+    "Failed or partially failed GraphQL calls by error type (graphql, http, request, circuit_open, unexpected).",
+    ("operation", "shop", "type"))
+
+# Flask
+HTTP_REQUEST_SECONDS = Histogram(
+    "flask_request_duration_seconds",
+    "Time to handle a request, by endpoint, method and status code.",
+    ("endpoint", "method", "status"))
+TEMPLATE_RENDER_SECONDS = Histogram(
+    "flask_template_render_duration_seconds",
+    "Time to render a Jinja template.",
+    ("template",))
+
+def render() -> str:
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def _start_timer():
+    from flask import g
+    g._metrics_started = time.perf_counter()
+
+def _observe_request(response):
+    from flask import g, request
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        labels = {"endpoint": request.endpoint or "unmatched", "method": request.method, "status": response.status_code}
+        if response.is_streamed:
+            # The body (e.g. templating.stream_page) is generated after this hook; time
+            # the request until the server has sent all of it and closes the response.
+            response.call_on_close(lambda: HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels))
+        else:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+    return response
+
+def _observe_failed_request(exc):
+    # after_request handlers don't run for unhandled exceptions; record them as 500s.
+    from flask import g, request
+    started = g.pop('_metrics_started', None)
+    if started is not None and exc is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or "unmatched",
+                                     method=request.method, status=500)
+
+def _template_started(sender, template, context, **extra):
+    from flask import g
+    g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+def _template_rendered(sender, template, context, **extra):
+    from flask import g
+    starts = g.get('_metrics_templates')
+    if starts:
+        TEMPLATE_RENDER_SECONDS.observe(time.perf_counter() - starts.pop(), template=template.name or "<string>")
+
+def init_app(app):
+    """
+    Registers request timing hooks and template render timing on a Flask app.
+    """
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.teardown_request(_observe_failed_request)
+    from flask import before_render_template, template_rendered
+    try:
+        before_render_template.connect(_template_started, app)
+        template_rendered.connect(_template_rendered, app)
+    except RuntimeError:
+        # Flask < 2.3 without blinker installed has no signal support.
+        logger.warning("blinker is not installed; template render times will not be recorded")
@@ -0,0 +1,329 @@
+"""
+Incremental order export to a local SQLite file for reporting.
+
+Usage:
+    python order_export.py --shop my-shop.myshopify.com sync [--full]
+    python order_export.py --shop my-shop.myshopify.com report [--since 2025-01-01] [--until 2025-02-01]
+                                                                [--source HypothesisApp]
+
+`sync` pages orders(query: "updated_at:>=<high-water mark>") sorted by update time
+(shopify_client.iter_orders) and upserts one compact row per order, plus one row per
+tag, committing the high-water mark with every batch so an interrupted sync resumes
+where it stopped. `report` runs the aggregation helpers below (totals by tag, discount
+sums by source and day, fulfillment latency) against the local file, without calling
+Shopify.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import shopify_client
+
+logger = logging.getLogger(__name__)
+
+ORDER_EXPORT_PATH = os.getenv('ORDER_EXPORT_PATH', 'shopify_orders.sqlite3')
+ORDER_EXPORT_PAGE_SIZE = int(os.getenv('ORDER_EXPORT_PAGE_SIZE', '100'))
+# Orders written per transaction (and high-water mark checkpoint).
+ORDER_EXPORT_BATCH_SIZE = int(os.getenv('ORDER_EXPORT_BATCH_SIZE', '250'))
+
+# Custom attribute set on every order placed by this app (see orders.py).
+ORDER_SOURCE_ATTRIBUTE = "OrderSource"
+
+def parse_timestamp(value: str):
+    """
+    Converts an ISO 8601 timestamp (or YYYY-MM-DD date, taken as UTC) to epoch seconds.
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def _money(money_set: dict):
+    money = (money_set or {}).get("shopMoney") or {}
+    amount = money.get("amount")
+    return (float(amount) if amount is not None else 0.0), money.get("currencyCode")
+
+def order_row(shop_url: str, node: dict) -> tuple:
+    """
+    Flattens an ordersPage node into an `orders` table row.
+    """
+    total, currency = _money(node.get("totalPriceSet"))
+    discounts, _ = _money(node.get("totalDiscountsSet"))
+    attributes = {attribute.get("key"): attribute.get("value") for attribute in node.get("customAttributes") or []}
+    fulfillments = node.get("fulfillments") or []
+    fulfilled_at = [parse_timestamp(f["createdAt"]) for f in fulfillments if f.get("createdAt")]
+    delivered_at = [parse_timestamp(f["deliveredAt"]) for f in fulfillments if f.get("deliveredAt")]
+    return (
+        shop_url,
+        node["id"].rsplit("/", 1)[-1],
+        node.get("name"),
+        parse_timestamp(node.get("createdAt")),
+        parse_timestamp(node.get("updatedAt")),
+        parse_timestamp(node.get("cancelledAt")),
+        node.get("displayFinancialStatus"),
+        node.get("displayFulfillmentStatus"),
+        total,
+        discounts,
+        currency,
+        attributes.get(ORDER_SOURCE_ATTRIBUTE),
+        min(fulfilled_at) if fulfilled_at else None,
+        min(delivered_at) if delivered_at else None,
+    )
+
+class OrderExport:
+    """
+    SQLite file with one narrow row per order (epoch-second timestamps, amounts in
+    shop currency) and an (order, tag) table, indexed for the report queries.
+    """
+
+    def __init__(self, path: str = ORDER_EXPORT_PATH):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS orders (
+                shop_url TEXT NOT NULL,
+                order_id TEXT NOT NULL,
+                name TEXT,
+                created_at INTEGER,
+                updated_at INTEGER,
+                cancelled_at INTEGER,
+                financial_status TEXT,
+                fulfillment_status TEXT,
+                total REAL NOT NULL DEFAULT 0,
+                discounts REAL NOT NULL DEFAULT 0,
+                currency TEXT,
+                source TEXT,
+                first_fulfilled_at INTEGER,
+                first_delivered_at INTEGER,
+                PRIMARY KEY (shop_url, order_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (shop_url, created_at);
+            CREATE TABLE IF NOT EXISTS order_tags (
+                shop_url TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                order_id TEXT NOT NULL,
+                PRIMARY KEY (shop_url, tag, order_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_order_tags_order ON order_tags (shop_url, order_id);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                shop_url TEXT PRIMARY KEY,
+                high_water_mark TEXT,
+                synced_at REAL
+            );
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def high_water_mark(self, shop_url: str):
+        """
+        Returns the updatedAt of the newest synced order for a shop, or None.
+        """
+        row = self._connect().execute("SELECT high_water_mark FROM sync_state WHERE shop_url = ?", (shop_url,)).fetchone()
+        return row[0] if row else None
+
+    def write_batch(self, shop_url: str, nodes: list, high_water_mark: str):
+        """
+        Upserts a batch of order nodes and advances the high-water mark in one transaction.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             [order_row(shop_url, node) for node in nodes])
+            order_ids = [(shop_url, node["id"].rsplit("/", 1)[-1]) for node in nodes]
+            conn.executemany("DELETE FROM order_tags WHERE shop_url = ? AND order_id = ?", order_ids)
+            conn.executemany("INSERT OR IGNORE INTO order_tags VALUES (?, ?, ?)", [
+                (shop_url, tag, order_id)
+                for (_, order_id), node in zip(order_ids, nodes)
+                for tag in node.get("tags") or []
+            ])
+            conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (shop_url, high_water_mark, time.time()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sync(self, shop_url: str, access_token: str, full: bool = False, page_size: int = ORDER_EXPORT_PAGE_SIZE,
+             batch_size: int = ORDER_EXPORT_BATCH_SIZE) -> int:
+        """
+        Fetches orders updated since the stored high-water mark (everything with
+        full=True) and upserts them. Returns the number of orders written.
+        """
+        since = None if full else self.high_water_mark(shop_url)
+        # ">=" so orders sharing the mark's timestamp are not missed; re-writing the
+        # boundary orders is harmless because rows are upserted.
+        search_query = f"updated_at:>='{since}'" if since else None
+        logger.info("Syncing orders for %s %s", shop_url, f"updated since {since}" if since else "(full export)")
+        written = 0
+        batch = []
+        high_water_mark = since
+        for node in shopify_client.iter_orders(shop_url, access_token, search_query, page_size=page_size):
+            batch.append(node)
+            high_water_mark = max(high_water_mark or "", node.get("updatedAt") or "") or None
+            if len(batch) >= batch_size:
+                self.write_batch(shop_url, batch, high_water_mark)
+                written += len(batch)
+                batch = []
+        if batch:
+            self.write_batch(shop_url, batch, high_water_mark)
+            written += len(batch)
+        logger.info("Synced %s order(s) for %s; high-water mark %s", written, shop_url, high_water_mark)
+        return written
+
+    def _filters(self, shop_url: str, since: str, until: str, source: str, include_cancelled: bool, alias: str = "o"):
+        clauses = [f"{alias}.shop_url = ?"]
+        params = [shop_url]
+        if since:
+            clauses.append(f"{alias}.created_at >= ?")
+            params.append(parse_timestamp(since))
+        if until:
+            clauses.append(f"{alias}.created_at < ?")
+            params.append(parse_timestamp(until))
+        if source:
+            clauses.append(f"{alias}.source = ?")
+            params.append(source)
+        if not include_cancelled:
+            clauses.append(f"{alias}.cancelled_at IS NULL")
+        return " AND ".join(clauses), params
+
+    def _rows(self, sql: str, params: list) -> list:
+        cursor = self._connect().execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def totals_by_tag(self, shop_url: str, since: str = None, until: str = None, source: str = None,
+                      include_cancelled: bool = False) -> list:
+        """
+        Order count, sales and discounts per tag (and currency), largest first.
+        """
+        where, params = self._filters(shop_url, since, until, source, include_cancelled)
+        return self._rows(f"""
+            SELECT t.tag, o.currency, COUNT(*) AS orders, ROUND(SUM(o.total), 2) AS total,
+                   ROUND(SUM(o.discounts), 2) AS discounts
+            FROM order_tags t JOIN orders o ON o.shop_url = t.shop_url AND o.order_id = t.order_id
+            WHERE {where}
+            GROUP BY t.tag, o.currency
+            ORDER BY total DESC, t.tag
+        """, params)
+
+    def discount_totals(self, shop_url: str, since: str = None, until: str = None, source: str = None,
+                        include_cancelled: bool = False, by: str = "source") -> list:
+        """
+        Order count, sales and discounts grouped by order source ("source") or UTC day ("day").
+        """
+        if by not in ("source", "day"):
+            raise ValueError(f"Unknown grouping: {by}")
+        group = "COALESCE(o.source, '(none)')" if by == "source" else "DATE(o.created_at, 'unixepoch')"
+        where, params = self._filters(shop_url, since, until, source, include_cancelled)
+        return self._rows(f"""
+            SELECT {group} AS {by}, o.currency, COUNT(*) AS orders, ROUND(SUM(o.total), 2) AS total,
+                   ROUND(SUM(o.discounts), 2) AS discounts
+            FROM orders o
+            WHERE {where}
+            GROUP BY 1, o.currency
+            ORDER BY 1
+        """, params)
+
+    def fulfillment_latency(self, shop_url: str, since: str = None, until: str = None, source: str = None) -> dict:
+        """
+        Hours from order creation to first fulfillment: count, mean, p50, p95 and max,
+        plus the number of orders still unfulfilled.
+        """
+        where, params = self._filters(shop_url, since, until, source, include_cancelled=False)
+        conn = self._connect()
+        hours = [row[0] for row in conn.execute(f"""
+            SELECT (o.first_fulfilled_at - o.created_at) / 3600.0 AS hours
+            FROM orders o
+            WHERE {where} AND o.first_fulfilled_at IS NOT NULL
+            ORDER BY hours
+        """, params)]
+        unfulfilled = conn.execute(f"SELECT COUNT(*) FROM orders o WHERE {where} AND o.first_fulfilled_at IS NULL",
+                                   params).fetchone()[0]
+        if not hours:
+            return {"fulfilled": 0, "unfulfilled": unfulfilled, "mean_hours": None, "p50_hours": None,
+                    "p95_hours": None, "max_hours": None}
+
+        def percentile(pct):
+            return round(hours[min(len(hours) - 1, int(pct / 100.0 * len(hours)))], 2)
+
+        return {
+            "fulfilled": len(hours),
+            "unfulfilled": unfulfilled,
+            "mean_hours": round(sum(hours) / len(hours), 2),
+            "p50_hours": percentile(50),
+            "p95_hours": percentile(95),
+            "max_hours": round(hours[-1], 2),
+        }
+
+def _print_table(title: str, rows: list):
+    print(f"\n{title}")
+    if not rows:
+        print("  (no orders)")
+        return
+    columns = list(rows[0])
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  " + "  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  " + "  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def main():
+    from dotenv import load_dotenv
+    import log_utils
+    from token_store import create_token_store
+
+    load_dotenv()
+    log_utils.configure_logging()
+    parser = argparse.ArgumentParser(description="Incremental order export to SQLite and local order reports.")
+    parser.add_argument("--shop", required=True, help="Shop domain, e.g. my-shop.myshopify.com")
+    parser.add_argument("--db", default=ORDER_EXPORT_PATH, help=f"Export file (default: {ORDER_EXPORT_PATH})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Fetch orders updated since the last sync")
+    sync_parser.add_argument("--full", action="store_true", help="Re-export all orders, ignoring the high-water mark")
+    report_parser = subparsers.add_parser("report", help="Print order reports from the export file")
+    report_parser.add_argument("--since", help="Only orders created at or after this date/time (UTC)")
+    report_parser.add_argument("--until", help="Only orders created before this date/time (UTC)")
+    report_parser.add_argument("--source", help="Only orders with this OrderSource attribute, e.g. HypothesisApp")
+    report_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    export = OrderExport(args.db)
+    if args.command == "sync":
+        access_token = os.getenv("SHOPIFY_ACCESS_TOKEN") or create_token_store().get(args.shop)
+        if not access_token:
+            parser.error(f"No access token for {args.shop}. Install the app on the shop first or set SHOPIFY_ACCESS_TOKEN.")
+        export.sync(args.shop, access_token, full=args.full)
+        return
+
+    filters = {"since": args.since, "until": args.until, "source": args.source}
+    report = {
+        "high_water_mark": export.high_water_mark(args.shop),
+        "totals_by_tag": export.totals_by_tag(args.shop, **filters),
+        "discounts_by_source": export.discount_totals(args.shop, by="source", **filters),
+        "discounts_by_day": export.discount_totals(args.shop, by="day", **filters),
+        "fulfillment_latency": export.fulfillment_latency(args.shop, **filters),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Orders for {args.shop} (synced up to {report['high_water_mark']})")
+    _print_table("Totals by tag", report["totals_by_tag"])
+    _print_table("Discounts by order source", report["discounts_by_source"])
+    _print_table("Discounts by day", report["discounts_by_day"])
+    _print_table("Fulfillment latency", [report["fulfillment_latency"]])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import logging
+import os
+
+import cart as cart_model
+import log_utils
+import queries
+import shopify_client
+
+logger = logging.getLogger(__name__)
+
+# Order building and checkout shared by the /create-order route and the bulk order
+# import pipeline (bulk_orders.py).
+#
+# SHOPIFY_CHECKOUT_MODE selects how an order is placed:
+#   "draft"        - draftOrderCreate followed by draftOrderComplete (default)
+#   "order_create" - a single orderCreate mutation, marked as paid
+# Both mutations (see queries.py) return the full OrderDetails selection, so the status page can be
+# rendered from the checkout response without another getOrder round trip.
+SHOPIFY_CHECKOUT_MODE = os.getenv('SHOPIFY_CHECKOUT_MODE', 'draft')
+ORDER_DISCOUNT_CODE = os.getenv('ORDER_DISCOUNT_CODE', 'HYPOTHESISAPP')
+
+class OrderCreationError(Exception):
+    """
+    Raised when an order cannot be created. `status_code` is the HTTP status the
+    web route should answer with (400 for user errors, 500 for unexpected responses).
+    """
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+def parse_tags(tags_string: str) -> list:
+    """
+    Splits a comma-separated tags string into a list of non-empty tags.
+    """
+    return [tag.strip() for tag in tags_string.split(',') if tag.strip()] if tags_string else []
+
+def find_missing_fields(email: str, shipping_address_input: dict) -> list:
+    """
+    Returns the names of mandatory email/address fields that are empty.
+    """
+    mandatory_fields = {
+        "email": email,
+        "firstName": shipping_address_input.get("firstName"),
+        "lastName": shipping_address_input.get("lastName"),
+        "address1": shipping_address_input.get("address1"),
+        "city": shipping_address_input.get("city"),
+        "countryCode": shipping_address_input.get("countryCode"),
+        "zip": shipping_address_input.get("zip")
+    }
+    return [key for key, value in mandatory_fields.items() if not value]
+
+def calculate_discount_value(total_cart_value) -> float:
+    """
+    Discount that brings the order down to 1/1.18 (never negative), as sent to Shopify.
+    """
+    return float(cart_model.discount_for(cart_model.parse_price(total_cart_value)))
+
+def build_draft_order_input(email: str, shipping_address_input: dict, line_items_input: list,
+                            discount_value: float, tags_list: list = None) -> dict:
+    """
+    Builds the DraftOrderInput for a fully discounted order placed via this app.
+    """
+    draft_order_input = {
+        "email": email,
+        "lineItems": line_items_input,
+        "shippingAddress": shipping_address_input,
+        "note": f"Order placed via Hypothesis app. Discounted by ${discount_value:.2f}.",
+        "customAttributes": [
+            {"key": "OrderSource", "value": "HypothesisApp"},
+            {"key": "PromotionDetails", "value": f"Fixed Amount Discount: ${discount_value:.2f}"}
+        ],
+        "appliedDiscount": {
+            "valueType": "FIXED_AMOUNT",
+            "value": discount_value,
+            "title": f"Hypothesis App Discount (${discount_value:.2f})"
+        },
+        "useCustomerDefaultAddress": False
+    }
+    if tags_list:
+        draft_order_input["tags"] = tags_list
+    return draft_order_input
+
+def build_order_create_input(email: str, shipping_address_input: dict, line_items_input: list,
+                             total_cart_value: float, discount_value: float, tags_list: list = None) -> dict:
+    """
+    Builds the OrderCreateOrderInput equivalent of build_draft_order_input. orderCreate
+    takes discounts as codes, so the fixed discount is expressed as a percentage of the
+    cart total (the shop currency is not known here).
+    """
+    order_input = {
+        "email": email,
+        "lineItems": line_items_input,
+        "shippingAddress": shipping_address_input,
+        "note": f"Order placed via Hypothesis app. Discounted by ${discount_value:.2f}.",
+        "customAttributes": [
+            {"key": "OrderSource", "value": "HypothesisApp"},
+            {"key": "PromotionDetails", "value": f"Fixed Amount Discount: ${discount_value:.2f}"}
+        ],
+        "financialStatus": "PAID"
+    }
+    if discount_value > 0 and total_cart_value > 0:
+        order_input["discountCode"] = {
+            "itemPercentageDiscountCode": {
+                "code": ORDER_DISCOUNT_CODE,
+                "percentage": round(discount_value / total_cart_value * 100, 4)
+            }
+        }
+    if tags_list:
+        order_input["tags"] = tags_list
+    return order_input
+
+def _format_user_errors(user_errors: list) -> str:
+    return ', '.join(f"{err.get('field', 'N/A')}: {err.get('message', 'Unknown error')}" for err in user_errors)
+
+def create_order_from_draft(shop_url: str, access_token: str, draft_order_input: dict,
+                            draft_order_id: str = None, on_draft_created=None) -> dict:
+    """
+    Creates a draft order and completes it as paid. Returns the resulting order
+    (OrderDetails fields) or raises OrderCreationError.
+
+    on_draft_created(draft_order_id) is called between the two steps, so callers can
+    record the draft; passing that draft_order_id back in skips step 1 and completes
+    the existing draft instead of creating another one.
+    """
+    if draft_order_id is None:
+        draft_order_id = create_draft_order(shop_url, access_token, draft_order_input)
+        if on_draft_created is not None:
+            on_draft_created(draft_order_id)
+    else:
+        logger.info("Resuming draft order %s for %s", draft_order_id, shop_url)
+    return complete_draft_order(shop_url, access_token, draft_order_id)
+
+def create_draft_order(shop_url: str, access_token: str, draft_order_input: dict) -> str:
+    """
+    Creates a draft order and returns its ID, or raises OrderCreationError.
+    """
+    logger.info("Creating draft order for %s", shop_url)
+    logger.debug("Draft order input: %s", log_utils.payload(draft_order_input))
+    draft_order_response_data = shopify_client.make_graphql_request(
+        shop_url, access_token, queries.DRAFT_ORDER_CREATE_MUTATION, {"input": draft_order_input}
+    )
+    logger.debug("Draft order creation response: %s", log_utils.payload(draft_order_response_data))
+
+    draft_order_create_result = (draft_order_response_data.get("data") or {}).get("draftOrderCreate") or {}
+    user_errors_draft = draft_order_create_result.get("userErrors")
+    if user_errors_draft:
+        logger.error("User errors on draft order creation: %s", _format_user_errors(user_errors_draft))
+        raise OrderCreationError(f"Error creating draft order: {_format_user_errors(user_errors_draft)}", 400)
+
+    draft_order_details = draft_order_create_result.get("draftOrder")
+    if not draft_order_details or not draft_order_details.get("id"):
+        logger.error("Failed to create draft order or missing draft order ID. Response: %s", log_utils.payload(draft_order_response_data))
+        raise OrderCreationError("Failed to create draft order.", 500)
+
+    draft_order_id = draft_order_details["id"]
+    logger.info("Draft order created successfully with ID: %s", draft_order_id)
+    return draft_order_id
+
+def complete_draft_order(shop_url: str, access_token: str, draft_order_id: str) -> dict:
+    """
+    Completes a draft order as paid (it is 100% discounted) and returns the resulting
+    order (OrderDetails fields), or raises OrderCreationError.
+    """
+    draft_order_complete_payload = {
+        "id": draft_order_id,
+        "paymentPending": False # Since total should be $0, this marks it as paid
+    }
+    logger.info("Completing draft order for ID: %s", draft_order_id)
+    order_response_data = shopify_client.make_graphql_request(
+        shop_url, access_token, queries.DRAFT_ORDER_COMPLETE_MUTATION, draft_order_complete_payload
+    )
+    logger.debug("Draft order complete response: %s", log_utils.payload(order_response_data))
+
+    draft_order_complete_result = (order_response_data.get("data") or {}).get("draftOrderComplete") or {}
+    user_errors_complete = draft_order_complete_result.get("userErrors")
+    if user_errors_complete:
+        logger.error("User errors on draft order completion: %s", _format_user_errors(user_errors_complete))
+        # Potentially delete the created draft order here if completion fails critically
+        raise OrderCreationError(f"Error completing order from draft: {_format_user_errors(user_errors_complete)}", 400)
+
+    # Extract order details from the 'order' field nested within 'draftOrder'
+    order_details = (draft_order_complete_result.get("draftOrder") or {}).get("order")
+    if not order_details or not order_details.get('id'):
+        logger.error("Order completion response did not contain final order details or ID. Response: %s", log_utils.payload(order_response_data))
+        # Potentially delete the created draft order here
+        raise OrderCreationError("Failed to create order: No final order details returned after draft completion.", 500)
+
+    logger.info("Order created successfully from draft: ID %s, Name: %s", order_details['id'], order_details.get('name'))
+    return order_details
+
+def create_order_direct(shop_url: str, access_token: str, order_input: dict) -> dict:
+    """
+    Creates a paid order with a single orderCreate mutation. Returns the order
+    (OrderDetails fields) or raises OrderCreationError.
+    """
+    logger.info("Creating order via orderCreate for %s", shop_url)
+    logger.debug("orderCreate input: %s", log_utils.payload(order_input))
+    response_data = shopify_client.make_graphql_request(
+        shop_url, access_token, queries.ORDER_CREATE_MUTATION,
+        {"order": order_input, "options": {"sendReceipt": False, "sendFulfillmentReceipt": False}}
+    )
+    logger.debug("orderCreate response: %s", log_utils.payload(response_data))
+
+    result = (response_data.get("data") or {}).get("orderCreate") or {}
+    if result.get("userErrors"):
+        logger.error("User errors on orderCreate: %s", _format_user_errors(result['userErrors']))
+        raise OrderCreationError(f"Error creating order: {_format_user_errors(result['userErrors'])}", 400)
+    order_details = result.get("order")
+    if not order_details or not order_details.get("id"):
+        logger.error("orderCreate response did not contain order details or ID. Response: %s", log_utils.payload(response_data))
+        raise OrderCreationError("Failed to create order: No order details returned.", 500)
+    logger.info("Order created successfully via orderCreate: ID %s, Name: %s", order_details['id'], order_details.get('name'))
+    return order_details
+
+def place_order(shop_url: str, access_token: str, email: str, shipping_address_input: dict,
+                line_items_input: list, total_cart_value, tags_list: list = None,
+                extra_attributes: list = None, mode: str = None, discount_value=None,
+                draft_order_id: str = None, on_draft_created=None) -> dict:
+    """
+    Places a fully discounted order using the configured checkout mode and returns
+    the created order's OrderDetails. Raises OrderCreationError on failure.
+
+    total_cart_value (and discount_value, if already known from CartTotals) may be
+    Decimal; they are converted to float here, where they enter the GraphQL input.
+    draft_order_id and on_draft_created apply to the draft checkout mode (see
+    create_order_from_draft).
+    """
+    mode = mode or SHOPIFY_CHECKOUT_MODE
+    if discount_value is None:
+        discount_value = calculate_discount_value(total_cart_value)
+    discount_value = float(discount_value)
+    total_cart_value = float(total_cart_value)
+    logger.info("Calculated discount value: %s (checkout mode: %s)", discount_value, mode)
+    if mode == 'order_create':
+        order_input = build_order_create_input(email, shipping_address_input, line_items_input,
+                                               total_cart_value, discount_value, tags_list)
+        order_input["customAttributes"].extend(extra_attributes or [])
+        return create_order_direct(shop_url, access_token, order_input)
+    if mode != 'draft':
+        raise ValueError(f"Unknown SHOPIFY_CHECKOUT_MODE: {mode}")
+    draft_order_input = build_draft_order_input(email, shipping_address_input, line_items_input,
+                                                discount_value, tags_list)
+    draft_order_input["customAttributes"].extend(extra_attributes or [])
+    return create_order_from_draft(shop_url, access_token, draft_order_input, draft_order_id, on_draft_created)
@@ -0,0 +1,553 @@
+import json
+import logging
+import re
+from functools import lru_cache
+
+import fast_json
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Central registry of the GraphQL documents this app sends. Each document is
+# validated and minified once at import, and the static part of its request body
+# ({"query": "..."}) is JSON-encoded up front, so a call only has to encode its
+# variables. Registered documents also declare an estimated requested cost that
+# seeds the rate limiter's predictions until Shopify reports the real one.
+
+class QueryError(ValueError):
+    """
+    Raised when a GraphQL document is malformed or conflicts with a registered one.
+    """
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ignored>[\s,\ufeff]+|\#[^\n\r]*)
+  | (?P<block_string>"""(?:\\"""|[^"]|"(?!""))*""")
+  | (?P<string>"(?:\\.|[^"\\\n\r])*")
+  | (?P<spread>\.\.\.)
+  | (?P<punct>[!$&():=@\[\]{|}])
+  | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+''', re.VERBOSE)
+
+_WORD_KINDS = ("name", "number")
+_BRACKETS = {"}": "{", ")": "(", "]": "["}
+
+def tokenize(document: str) -> list:
+    """
+    Splits a GraphQL document into (kind, text) tokens, dropping whitespace, commas
+    and comments.
+    """
+    tokens = []
+    position = 0
+    while position < len(document):
+        match = _TOKEN_RE.match(document, position)
+        if match is None:
+            raise QueryError(f"Unexpected character {document[position]!r} at offset {position}")
+        if match.lastgroup != "ignored":
+            tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+def minify(document: str) -> str:
+    """
+    Returns the document with comments and insignificant whitespace/commas removed.
+    """
+    parts = []
+    previous_kind = None
+    for kind, text in tokenize(document):
+        if previous_kind in _WORD_KINDS and kind in _WORD_KINDS:
+            parts.append(" ")
+        parts.append(text)
+        previous_kind = kind
+    return "".join(parts)
+
+def _definitions(tokens: list):
+    """
+    Yields (keyword, name) for each top-level definition and checks bracket balance.
+    """
+    stack = []
+    expect_definition = True
+    for i, (kind, text) in enumerate(tokens):
+        if not stack and expect_definition:
+            if text == "{":
+                yield "query", None
+            elif kind == "name" and text in ("query", "mutation", "subscription", "fragment"):
+                following = tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+                name = following[1] if following[0] == "name" and following[1] != "on" else None
+                yield text, name
+            else:
+                raise QueryError(f"Expected a definition, found {text!r}")
+            expect_definition = False
+        if kind == "punct" and text in "{([":
+            stack.append(text)
+        elif kind == "punct" and text in "})]":
+            if not stack or stack.pop() != _BRACKETS[text]:
+                raise QueryError(f"Unbalanced {text!r}")
+            if not stack and text == "}":
+                expect_definition = True
+    if stack:
+        raise QueryError(f"Unclosed {stack[-1]!r}")
+
+def validate(document: str):
+    """
+    Checks that a document holds exactly one named operation, that brackets balance,
+    that every fragment spread is defined (and every fragment used), and that every
+    variable used is declared. Returns (operation type, operation name).
+    """
+    tokens = tokenize(document)
+    operations = []
+    fragments = set()
+    for keyword, name in _definitions(tokens):
+        if keyword == "fragment":
+            if not name:
+                raise QueryError("Fragment without a name")
+            if name in fragments:
+                raise QueryError(f"Fragment {name} is defined twice")
+            fragments.add(name)
+        else:
+            operations.append((keyword, name))
+    if len(operations) != 1 or not operations[0][1]:
+        raise QueryError("A registered document must contain exactly one named operation")
+
+    spreads = set()
+    declared = set()
+    used = set()
+    in_header = False
+    depth = 0
+    for i, (kind, text) in enumerate(tokens[:-1]):
+        following_kind, following_text = tokens[i + 1]
+        if kind == "spread" and following_kind == "name" and following_text != "on":
+            spreads.add(following_text)
+        elif text == "$" and following_kind == "name":
+            (declared if in_header else used).add(following_text)
+        elif text in ("query", "mutation", "subscription") and depth == 0 and kind == "name":
+            in_header = True
+        elif text == "{":
+            in_header = False
+            depth += 1
+        elif text == "}":
+            depth -= 1
+    if spreads - fragments:
+        raise QueryError(f"Undefined fragments: {', '.join(sorted(spreads - fragments))}")
+    if fragments - spreads:
+        raise QueryError(f"Unused fragments: {', '.join(sorted(fragments - spreads))}")
+    if used - declared:
+        raise QueryError(f"Undeclared variables: {', '.join(sorted(used - declared))}")
+    return operations[0]
+
+class Query:
+    """
+    A minified GraphQL document with its operation name, estimated cost and
+    pre-encoded request body prefix.
+    """
+
+    def __init__(self, document: str, name: str = None, operation_type: str = "query", cost: float = None):
+        self.document = document
+        self.name = name
+        self.operation_type = operation_type
+        self.cost = cost
+        self._payload_prefix = b'{"query":' + json.dumps(document).encode("utf-8")
+
+    def payload(self, variables: dict = None) -> bytes:
+        """
+        Returns the JSON request body for this document and the given variables.
+        """
+        if not variables:
+            return self._payload_prefix + b"}"
+        return self._payload_prefix + b',"variables":' + fast_json.dumps(variables) + b"}"
+
+    def __repr__(self):
+        return f"<Query {self.name} ({len(self.document)} bytes)>"
+
+_registry = {}
+
+def register(document: str, cost: float = None) -> Query:
+    """
+    Validates, minifies and registers a document under its operation name.
+    `cost` is the estimated requested query cost used until a real one is observed.
+    """
+    operation_type, name = validate(document)
+    query = Query(minify(document), name, operation_type, cost)
+    existing = _registry.get(name)
+    if existing is not None and existing.document != query.document:
+        raise QueryError(f"Operation {name} is already registered with a different document")
+    _registry[name] = query
+    if cost is not None:
+        rate_limiter.cost_tracker.estimate(name, cost)
+    return query
+
+def get(name: str) -> Query:
+    return _registry[name]
+
+def registered() -> dict:
+    """
+    Returns operation name -> Query for every registered document.
+    """
+    return dict(_registry)
+
+@lru_cache(maxsize=256)
+def _compile_adhoc(document: str) -> Query:
+    logger.debug("Compiling unregistered GraphQL document: <%s...>", document[:50])
+    try:
+        minified = minify(document)
+    except QueryError:
+        minified = document
+    return Query(minified, rate_limiter.get_operation_name(document))
+
+def as_query(query) -> Query:
+    """
+    Returns `query` if it is already a Query, otherwise a (cached) Query built from
+    the document string.
+    """
+    return query if isinstance(query, Query) else _compile_adhoc(query)
+
+# Field selection used everywhere an order is displayed (status page, batch lookup,
+# checkout responses).
+ORDER_DETAILS_FRAGMENT = """
+fragment OrderDetails on Order {
+    id
+    name
+    legacyResourceId
+    email
+    createdAt
+    updatedAt
+    displayFinancialStatus
+    displayFulfillmentStatus
+    app {
+      id
+      name
+    }
+    cancellation {
+        staffNote
+    }
+    cancelledAt
+    cancelReason
+    confirmed
+    closed
+    discountCode
+    totalPriceSet {
+      presentmentMoney {
+        amount
+        currencyCode
+      }
+    }
+    lineItems(first: 10) {
+      edges {
+        node {
+          title
+          quantity
+          variantTitle
+          originalUnitPriceSet {
+             presentmentMoney {
+                amount
+                currencyCode
+            }
+          }
+        }
+      }
+    }
+    shippingAddress {
+      firstName
+      lastName
+      address1
+      address2
+      city
+      zip
+      country
+      province
+      phone
+    }
+    note
+    tags
+    fulfillments(first: 5) {
+      id
+      status
+      deliveredAt
+      displayStatus
+      trackingInfo {
+        url
+        company
+        number
+      }
+    }
+}
+"""
+
+# Field-selection profiles. Callers pick the smallest one that covers what they render:
+#   "minimal" - ids, titles/names and statuses (badges, pickers)
+#   "list"    - what list views show (product cards, the batch order status table)
+#   "full"    - everything the detail pages show
+# Each profile is its own registered operation (e.g. searchProductsList), so the rate
+# limiter learns a separate cost for each.
+PROFILES = ("minimal", "list", "full")
+
+def operation_name_for(operation: str, profile: str) -> str:
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown field-selection profile: {profile}")
+    return operation if profile == "full" else f"{operation}{profile.capitalize()}"
+
+PRODUCT_PROFILE_FIELDS = {
+    "minimal": """
+        id
+        title
+    """,
+    "list": """
+        id
+        title
+        updatedAt
+        featuredImage {
+          url
+        }
+        variants(first: 5) {
+          edges {
+            node {
+              id
+              title
+              price
+              image {
+                url
+              }
+            }
+          }
+        }
+    """,
+    "full": """
+        id
+        title
+        updatedAt
+        descriptionHtml
+        onlineStoreUrl
+        featuredImage {
+          url
+        }
+        variants(first: 5) {
+          edges {
+            node {
+              id
+              title
+              price
+              image {
+                url
+              }
+            }
+          }
+        }
+    """,
+}
+
+def _search_products_document(profile: str) -> str:
+    return f"""
+query {operation_name_for("searchProducts", profile)}($searchQuery: String!, $numProducts: Int!, $cursor: String) {{
+  products(first: $numProducts, query: $searchQuery, after: $cursor) {{
+    edges {{
+      node {{
+        {PRODUCT_PROFILE_FIELDS[profile]}
+      }}
+    }}
+    pageInfo {{
+      hasNextPage
+      hasPreviousPage
+      startCursor
+      endCursor
+    }}
+  }}
+}}
+"""
+
+SEARCH_PRODUCTS_QUERIES = {
+    "minimal": register(_search_products_document("minimal"), cost=12),
+    "list": register(_search_products_document("list"), cost=112),
+    "full": register(_search_products_document("full"), cost=112),
+}
+SEARCH_PRODUCTS_QUERY = SEARCH_PRODUCTS_QUERIES["full"]
+
+SEARCH_CUSTOMERS_QUERY = register("""
+query searchCustomers($query: String!, $first: Int!) {
+  customers(first: $first, query: $query) {
+    edges {
+      node {
+        id
+        firstName
+        lastName
+        email: defaultEmailAddress {
+          emailAddress
+        }
+        phone: defaultPhoneNumber {
+          phoneNumber
+        }
+        addresses(first: 5) {
+          address1
+          address2
+          city
+          zip
+          provinceCode
+          countryCodeV2
+          formatted
+          phone
+        }
+      }
+    }
+  }
+}
+""", cost=62)
+
+# Order selections for the "minimal" and "list" profiles; "full" is ORDER_DETAILS_FRAGMENT.
+ORDER_PROFILE_FIELDS = {
+    "minimal": """
+    id
+    name
+    displayFinancialStatus
+    displayFulfillmentStatus
+    cancelledAt
+    """,
+    "list": """
+    id
+    name
+    email
+    createdAt
+    displayFinancialStatus
+    displayFulfillmentStatus
+    cancelledAt
+    totalPriceSet {
+      presentmentMoney {
+        amount
+        currencyCode
+      }
+    }
+    fulfillments(first: 5) {
+      trackingInfo {
+        url
+        company
+        number
+      }
+    }
+    """,
+}
+
+def _order_document(operation: str, variables: str, root_field: str, profile: str) -> str:
+    if profile == "full":
+        selection, fragment = "...OrderDetails", ORDER_DETAILS_FRAGMENT
+    else:
+        selection, fragment = f"... on Order {{{ORDER_PROFILE_FIELDS[profile]}}}", ""
+    return f"""
+query {operation_name_for(operation, profile)}({variables}) {{
+  {root_field} {{
+    {selection}
+  }}
+}}
+""" + fragment
+
+GET_ORDER_QUERIES = {
+    "minimal": register(_order_document("getOrder", "$id: ID!", "order(id: $id)", "minimal"), cost=2),
+    "list": register(_order_document("getOrder", "$id: ID!", "order(id: $id)", "list"), cost=8),
+    "full": register(_order_document("getOrder", "$id: ID!", "order(id: $id)", "full"), cost=32),
+}
+GET_ORDER_QUERY = GET_ORDER_QUERIES["full"]
+
+# nodes(ids:) variants. Callers size batches from the matching getOrder profile's cost
+# per order, up to just under MAX_QUERY_COST, so a batch is estimated at that limit
+# until Shopify reports the real cost.
+MAX_QUERY_COST = 1000 # Shopify rejects single queries that request more
+GET_ORDERS_QUERIES = {
+    profile: register(_order_document("getOrders", "$ids: [ID!]!", "nodes(ids: $ids)", profile), cost=MAX_QUERY_COST)
+    for profile in PROFILES
+}
+GET_ORDERS_QUERY = GET_ORDERS_QUERIES["full"]
+
+GET_DRAFT_ORDER_QUERY = register("""
+query getDraftOrder($id: ID!) {
+  draftOrder(id: $id) {
+    id
+    name
+    status
+    totalPriceSet {
+      presentmentMoney {
+        amount
+        currencyCode
+      }
+    }
+    lineItems(first: 10) {
+      edges {
+        node {
+          title
+          quantity
+          variantTitle
+          originalUnitPriceSet {
+             presentmentMoney {
+                amount
+                currencyCode
+            }
+          }
+        }
+      }
+    }
+    shippingAddress {
+      firstName
+      lastName
+      address1
+      address2
+      city
+      zip
+      country
+      province
+      phone
+    }
+    email
+    order {
+      id
+      name
+      legacyResourceId
+      displayFinancialStatus
+      displayFulfillmentStatus
+    }
+    invoiceUrl
+    completedAt
+  }
+}
+""", cost=24)
+
+DRAFT_ORDER_CREATE_MUTATION = register("""
+mutation draftOrderCreate($input: DraftOrderInput!) {
+  draftOrderCreate(input: $input) {
+    draftOrder {
+      id
+      invoiceUrl
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+""", cost=10)
+
+DRAFT_ORDER_COMPLETE_MUTATION = register("""
+mutation draftOrderComplete($id: ID!, $paymentPending: Boolean) {
+  draftOrderComplete(id: $id, paymentPending: $paymentPending) {
+    draftOrder {
+      id
+      order {
+        ...OrderDetails
+      }
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+""" + ORDER_DETAILS_FRAGMENT, cost=10)
+
+ORDER_CREATE_MUTATION = register("""
+mutation orderCreate($order: OrderCreateOrderInput!, $options: OrderCreateOptionsInput) {
+  orderCreate(order: $order, options: $options) {
+    order {
+      ...OrderDetails
+    }
+    userErrors {
+      field
+      message
+    }
+  }
+}
+""" + ORDER_DETAILS_FRAGMENT, cost=10)
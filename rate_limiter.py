@@ -0,0 +1,168 @@
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Shopify's GraphQL Admin API throttles by calculated query cost using a leaky bucket
+# per shop (https://shopify.dev/docs/api/usage/rate-limits). These defaults match the
+# standard plan and are replaced by the real values from the first throttleStatus we see.
+DEFAULT_MAXIMUM_AVAILABLE = float(os.getenv('SHOPIFY_BUCKET_SIZE', '1000'))
+DEFAULT_RESTORE_RATE = float(os.getenv('SHOPIFY_RESTORE_RATE', '50'))
+SHOPIFY_THROTTLE_MAX_RETRIES = int(os.getenv('SHOPIFY_THROTTLE_MAX_RETRIES', '5'))
+SHOPIFY_THROTTLE_BACKOFF_BASE = float(os.getenv('SHOPIFY_THROTTLE_BACKOFF_BASE', '0.5'))
+SHOPIFY_THROTTLE_BACKOFF_MAX = float(os.getenv('SHOPIFY_THROTTLE_BACKOFF_MAX', '20'))
+
+# Requested cost assumed for an operation with no registered estimate (see queries.py)
+# and no observed cost yet.
+DEFAULT_QUERY_COST = 50
+
+_OPERATION_NAME_RE = re.compile(r'\b(?:query|mutation)\s+(\w+)')
+
+def get_operation_name(query: str) -> str:
+    """
+    Returns the operation name of a GraphQL document, or None if it is anonymous.
+    """
+    match = _OPERATION_NAME_RE.search(query)
+    return match.group(1) if match else None
+
+class LeakyBucket:
+    """
+    Client-side model of one shop's query cost bucket.
+
+    Calls reserve their predicted cost before being sent; when the bucket would go
+    negative the caller sleeps until enough points have been restored, so bursts are
+    queued locally instead of being throttled by Shopify.
+    """
+
+    def __init__(self, maximum_available: float = DEFAULT_MAXIMUM_AVAILABLE, restore_rate: float = DEFAULT_RESTORE_RATE):
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.currently_available = maximum_available
+        self.in_flight_cost = 0.0
+        self.last_updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.last_updated
+        if elapsed > 0:
+            self.currently_available = min(self.maximum_available, self.currently_available + elapsed * self.restore_rate)
+            self.last_updated = now
+
+    def acquire(self, cost: float) -> float:
+        """
+        Reserves `cost` points, sleeping if the bucket is short. Returns the time waited.
+        """
+        cost = min(cost, self.maximum_available)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.currently_available -= cost
+            self.in_flight_cost += cost
+            wait = -self.currently_available / self.restore_rate if self.currently_available < 0 else 0.0
+        if wait > 0:
+            logger.info("Query cost budget exhausted, delaying request by %.2fs (cost: %s)", wait, cost)
+            time.sleep(wait)
+        return wait
+
+    def release(self, cost: float, throttle_status: dict = None):
+        """
+        Finishes a reservation and syncs the bucket with Shopify's throttleStatus, if given.
+        """
+        cost = min(cost, self.maximum_available)
+        with self._lock:
+            self.in_flight_cost = max(0.0, self.in_flight_cost - cost)
+            if throttle_status:
+                self.maximum_available = float(throttle_status.get("maximumAvailable", self.maximum_available))
+                self.restore_rate = float(throttle_status.get("restoreRate", self.restore_rate)) or self.restore_rate
+                available = float(throttle_status.get("currentlyAvailable", self.currently_available))
+                # Other requests may still be in flight; keep their reservations deducted.
+                self.currently_available = available - self.in_flight_cost
+                self.last_updated = time.monotonic()
+
+    def time_until_available(self, cost: float) -> float:
+        """
+        Returns how long until `cost` points would be available without queueing.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = min(cost, self.maximum_available) - self.currently_available
+        return max(0.0, missing / self.restore_rate)
+
+class CostTracker:
+    """
+    Remembers the requested/actual cost reported for each operation name so that
+    future calls can reserve a realistic amount up front.
+    """
+
+    def __init__(self, known_costs: dict = None):
+        self._requested = dict(known_costs or {})
+        self._observed = set()
+        self._actual = {}
+        self._lock = threading.Lock()
+
+    def predict(self, operation_name: str) -> float:
+        with self._lock:
+            return float(self._requested.get(operation_name, DEFAULT_QUERY_COST))
+
+    def estimate(self, operation_name: str, cost: float):
+        """
+        Sets the predicted cost for an operation that has not been observed yet.
+        """
+        with self._lock:
+            if operation_name not in self._observed:
+                self._requested[operation_name] = float(cost)
+
+    def record(self, operation_name: str, requested_cost: float = None, actual_cost: float = None):
+        if not operation_name:
+            return
+        with self._lock:
+            if requested_cost is not None:
+                self._requested[operation_name] = float(requested_cost)
+                self._observed.add(operation_name)
+            if actual_cost is not None:
+                self._actual[operation_name] = float(actual_cost)
+
+    def actual(self, operation_name: str) -> float:
+        with self._lock:
+            return self._actual.get(operation_name)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+cost_tracker = CostTracker()
+
+def get_bucket(shop_url: str) -> LeakyBucket:
+    """
+    Returns the cost bucket for a shop, creating it on first use.
+    """
+    bucket = _buckets.get(shop_url)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(shop_url, LeakyBucket())
+    return bucket
+
+def is_throttled(response_json: dict) -> bool:
+    """
+    Returns True if a GraphQL response body reports a THROTTLED error.
+    """
+    for error in response_json.get("errors") or []:
+        if isinstance(error, dict) and (error.get("extensions") or {}).get("code") == "THROTTLED":
+            return True
+    return False
+
+def get_cost_info(response_json: dict) -> dict:
+    """
+    Returns the extensions.cost block of a GraphQL response, or an empty dict.
+    """
+    return (response_json.get("extensions") or {}).get("cost") or {}
+
+def backoff_delay(attempt: int, bucket: LeakyBucket = None, cost: float = 0) -> float:
+    """
+    Delay before retrying a throttled call: exponential in the attempt number, but
+    never shorter than the time the bucket needs to restore the call's cost.
+    """
+    delay = min(SHOPIFY_THROTTLE_BACKOFF_MAX, SHOPIFY_THROTTLE_BACKOFF_BASE * (2 ** attempt))
+    if bucket is not None:
+        delay = max(delay, min(SHOPIFY_THROTTLE_BACKOFF_MAX, bucket.time_until_available(cost)))
+    return delay
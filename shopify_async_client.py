@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Union
+
+import queries
+import shopify_client
+
+logger = logging.getLogger(__name__)
+
+# asyncio interface to shopify_client, implemented as a thread-offload wrapper: each
+# call runs the blocking sync client on a dedicated executor, so it shares the pooled
+# keep-alive sessions, retries, circuit breaker and rate limiter with the synchronous
+# code path. This is not non-blocking I/O: at most SHOPIFY_ASYNC_MAX_IN_FLIGHT calls
+# run at once (one thread each), and further coroutines wait for a free thread.
+SHOPIFY_ASYNC_MAX_IN_FLIGHT = int(os.getenv('SHOPIFY_ASYNC_MAX_IN_FLIGHT', str(shopify_client.SHOPIFY_POOL_SIZE)))
+
+_executor = ThreadPoolExecutor(max_workers=SHOPIFY_ASYNC_MAX_IN_FLIGHT, thread_name_prefix="shopify-async")
+
+async def _run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def make_graphql_request(shop_url: str, access_token: str, query: Union[str, queries.Query], variables: dict = None):
+    """
+    Async variant of shopify_client.make_graphql_request.
+    """
+    return await _run_blocking(shopify_client.make_graphql_request, shop_url, access_token, query, variables)
+
+async def search_products(shop_url: str, access_token: str, search_query: str, num_products: int = 10, cursor: str = None,
+                          profile: str = "full"):
+    """
+    Async variant of shopify_client.search_products.
+    """
+    return await _run_blocking(shopify_client.search_products, shop_url, access_token, search_query, num_products, cursor, profile)
+
+async def get_draft_order_details(shop_url: str, access_token: str, draft_order_gid: str):
+    """
+    Async variant of shopify_client.get_draft_order_details.
+    """
+    return await _run_blocking(shopify_client.get_draft_order_details, shop_url, access_token, draft_order_gid)
+
+async def get_order_details(shop_url: str, access_token: str, order_gid: str, profile: str = "full"):
+    """
+    Async variant of shopify_client.get_order_details.
+    """
+    return await _run_blocking(shopify_client.get_order_details, shop_url, access_token, order_gid, profile)
+
+async def gather(*coroutines, return_exceptions: bool = False):
+    """
+    Runs the given client coroutines concurrently and returns their results in order.
+    """
+    return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code (e.g. a Flask route).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    coroutine.close()
+    raise RuntimeError("run_sync() cannot be called from a running event loop; await the coroutine instead.")
+
+def run_concurrently(*coroutines, return_exceptions: bool = False) -> list:
+    """
+    Sync wrapper: runs several client coroutines at once and returns their results.
+
+    Example (inside a Flask route):
+        products, order = shopify_async_client.run_concurrently(
+            shopify_async_client.search_products(shop_url, token, "shirt"),
+            shopify_async_client.get_order_details(shop_url, token, order_gid),
+        )
+    """
+    logger.debug("Running %s Shopify requests concurrently", len(coroutines))
+    return run_sync(gather(*coroutines, return_exceptions=return_exceptions))
@@ -1,91 +1,292 @@
 import requests
 import os
+import random
 import logging # Added
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+import circuit_breaker
+import fast_json
+import log_utils
+import metrics
+import queries
+import rate_limiter
+from cache import TTLCache
 
 logger = logging.getLogger(__name__) # Added
 
-def make_graphql_request(shop_url: str, access_token: str, query: str, variables: dict = None):
+# Connection pool settings for the per-shop HTTP sessions.
+# Each shop gets its own requests.Session so TCP/TLS connections to
+# {shop}.myshopify.com are kept alive and reused across calls.
+SHOPIFY_POOL_SIZE = int(os.getenv('SHOPIFY_POOL_SIZE', '10'))
+SHOPIFY_CONNECT_TIMEOUT = float(os.getenv('SHOPIFY_CONNECT_TIMEOUT', '5'))
+SHOPIFY_READ_TIMEOUT = float(os.getenv('SHOPIFY_READ_TIMEOUT', '30'))
+
+# Responses larger than this are rejected instead of being buffered and decoded
+# (protects workers from runaway queries, e.g. a missing `first:` limit).
+SHOPIFY_MAX_RESPONSE_BYTES = int(os.getenv('SHOPIFY_MAX_RESPONSE_BYTES', str(20 * 1024 * 1024)))
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Transient failures (connection errors, timeouts, 5xx) are retried with jittered
+# exponential backoff; mutations only when the request was never sent. Repeated
+# failures open the shop's circuit breaker (see circuit_breaker.py).
+SHOPIFY_RETRY_MAX_RETRIES = int(os.getenv('SHOPIFY_RETRY_MAX_RETRIES', '2'))
+SHOPIFY_RETRY_BACKOFF_BASE = float(os.getenv('SHOPIFY_RETRY_BACKOFF_BASE', '0.2'))
+SHOPIFY_RETRY_BACKOFF_MAX = float(os.getenv('SHOPIFY_RETRY_BACKOFF_MAX', '5'))
+RETRY_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+# Use the API version from environment or a sensible default (kept in step with app.py)
+SHOPIFY_API_VERSION = os.getenv('SHOPIFY_API_VERSION', '2025-04')
+# Admin API origin; "{shop}" is replaced by the shop domain. Override it to point the
+# client at a local stub, e.g. http://127.0.0.1:8765 for benchmarks/fake_shopify.py.
+SHOPIFY_API_BASE_URL = os.getenv('SHOPIFY_API_BASE_URL', 'https://{shop}')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Cache of search_products results keyed by (shop, query, page size, cursor, profile), so
+# re-running the same search (e.g. after an add-to-cart) skips the Admin API.
+PRODUCT_SEARCH_CACHE_TTL = float(os.getenv('PRODUCT_SEARCH_CACHE_TTL', '300'))
+product_search_cache = TTLCache(
+    "product_search",
+    ttl=PRODUCT_SEARCH_CACHE_TTL,
+    max_entries=int(os.getenv('PRODUCT_SEARCH_CACHE_MAX_ENTRIES', '500')),
+    max_bytes=int(os.getenv('PRODUCT_SEARCH_CACHE_MAX_BYTES', str(20 * 1024 * 1024))),
+    # Expired results are kept this much longer and served if the shop's API is failing.
+    stale_ttl=float(os.getenv('PRODUCT_SEARCH_CACHE_STALE_TTL', '3600')),
+)
+
+def get_session(shop_url: str) -> requests.Session:
+    """
+    Returns the shared keep-alive session for a shop, creating it on first use.
+    """
+    session = _sessions.get(shop_url)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(shop_url)
+        if session is None:
+            logger.info("Creating pooled HTTP session for %s (pool size: %s)", shop_url, SHOPIFY_POOL_SIZE)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SHOPIFY_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+            _sessions[shop_url] = session
+    return session
+
+def get_timeout() -> tuple:
+    """
+    Returns the (connect, read) timeout tuple used for Shopify API calls.
+    """
+    return (SHOPIFY_CONNECT_TIMEOUT, SHOPIFY_READ_TIMEOUT)
+
+def close_sessions():
+    """
+    Closes all pooled sessions, e.g. on worker shutdown.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+class ResponseTooLargeError(requests.exceptions.RequestException):
+    """
+    Raised when a Shopify response exceeds SHOPIFY_MAX_RESPONSE_BYTES.
+    """
+
+def read_body(response: requests.Response, max_bytes: int = None) -> bytes:
+    """
+    Reads a streamed response body, giving up as soon as it exceeds max_bytes
+    (default SHOPIFY_MAX_RESPONSE_BYTES).
+    """
+    max_bytes = max_bytes or SHOPIFY_MAX_RESPONSE_BYTES
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        response.close()
+        raise ResponseTooLargeError(f"Response of {content_length} bytes exceeds the {max_bytes} byte limit", response=response)
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            response.close()
+            raise ResponseTooLargeError(f"Response exceeds the {max_bytes} byte limit", response=response)
+        chunks.append(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+def read_error_body(response: requests.Response, max_bytes: int = None) -> str:
+    """
+    Reads at most max_bytes (default LOG_PAYLOAD_MAX_CHARS) of an error response's
+    body for logging; the rest is discarded when the response is closed.
+    """
+    max_bytes = max_bytes or log_utils.LOG_PAYLOAD_MAX_CHARS
+    try:
+        chunk = next(response.iter_content(max_bytes), b"")
+    except requests.exceptions.RequestException:
+        return ""
+    return chunk.decode(response.encoding or "utf-8", errors="replace")
+
+def is_transient_error(exc: Exception) -> bool:
+    """
+    True for failures worth retrying: connection errors, timeouts and 5xx responses.
+    """
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return exc.response is not None and exc.response.status_code in RETRY_STATUS_CODES
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                            requests.exceptions.ChunkedEncodingError))
+
+def is_retry_safe(query: queries.Query, exc: Exception) -> bool:
+    """
+    Queries can always be retried. Mutations have no idempotency key, so they are only
+    retried when the request provably never reached Shopify (connect timeout).
+    """
+    return query.operation_type != "mutation" or isinstance(exc, requests.exceptions.ConnectTimeout)
+
+def backoff_with_jitter(retry: int) -> float:
+    """
+    Full-jitter exponential backoff before retrying a transient failure.
+    """
+    return random.uniform(0, min(SHOPIFY_RETRY_BACKOFF_MAX, SHOPIFY_RETRY_BACKOFF_BASE * (2 ** retry)))
+
+def _record_failure(labels: dict, started: float, error_type: str):
+    metrics.SHOPIFY_ERRORS.inc(type=error_type, **labels)
+    metrics.SHOPIFY_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=f"{error_type}_error", **labels)
+
+def make_graphql_request(shop_url: str, access_token: str, query, variables: dict = None):
     """
     Makes a GraphQL request to the Shopify Admin API.
+    `query` is a queries.Query or a GraphQL document string.
     """
+    query = queries.as_query(query)
     # Be cautious about logging full queries or variables if they contain sensitive PII.
     # For debugging, you might log parts or indicate their presence.
     log_variables = bool(variables) # Log if variables are present, not their content directly for security
-    logger.info(f"Making GraphQL request to {shop_url}. Query: <{query[:50]}...>, Variables present: {log_variables}") # Added
+    logger.info("Making GraphQL request to %s. Operation: %s, Variables present: %s", shop_url, query.name, log_variables) # Added
 
     headers = {
         "X-Shopify-Access-Token": access_token, # Sensitive: Do not log the token itself
         "Content-Type": "application/json",
     }
-    # Use the API version from environment or a sensible default
-    api_version = os.getenv('SHOPIFY_API_VERSION', '2024-04') # Updated default to a recent stable version
-    graphql_url = f"https://{shop_url}/admin/api/{api_version}/graphql.json"
-    logger.debug(f"GraphQL URL: {graphql_url}") # Added
+    graphql_url = f"{SHOPIFY_API_BASE_URL.format(shop=shop_url)}/admin/api/{SHOPIFY_API_VERSION}/graphql.json"
+    logger.debug("GraphQL URL: %s", graphql_url) # Added
 
-    payload = {"query": query}
-    if variables:
-        payload["variables"] = variables
+    payload = query.payload(variables)
 
-    try:
-        response = requests.post(graphql_url, json=payload, headers=headers)
-        logger.debug(f"Shopify API response status: {response.status_code} for {shop_url}") # Added
-        response.raise_for_status()  # Raises an exception for HTTP errors
-        response_json = response.json()
-        if 'errors' in response_json:
-            logger.warning(f"GraphQL request to {shop_url} returned errors: {response_json['errors']}") # Added
-        return response_json
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error occurred while calling Shopify API for {shop_url}: {http_err} - Response: {response.text}", exc_info=True) # Added
-        raise # Re-raise the exception after logging
-    except requests.exceptions.RequestException as req_err:
-        logger.error(f"Request exception occurred while calling Shopify API for {shop_url}: {req_err}", exc_info=True) # Added
-        raise # Re-raise the exception after logging
-    except Exception as e:
-        logger.error(f"An unexpected error occurred in make_graphql_request for {shop_url}: {e}", exc_info=True) # Added
-        raise # Re-raise the exception
+    operation_name = query.name
+    labels = {"operation": operation_name or "anonymous", "shop": shop_url}
+    started = time.perf_counter()
+    bucket = rate_limiter.get_bucket(shop_url)
+    breaker = circuit_breaker.get_breaker(shop_url)
+    attempt = 0 # Throttle retries
+    retries = 0 # Transient error retries
+    while True:
+        try:
+            breaker.before_call()
+        except circuit_breaker.CircuitOpenError as open_err:
+            _record_failure(labels, started, "circuit_open")
+            logger.warning("Not calling %s on %s: %s", operation_name, shop_url, open_err)
+            raise
+        predicted_cost = rate_limiter.cost_tracker.predict(operation_name)
+        waited = bucket.acquire(predicted_cost)
+        if waited:
+            metrics.SHOPIFY_THROTTLE_WAIT_SECONDS.inc(waited, **labels)
+        throttle_status = None
+        retry_delay = None
+        response = None
+        try:
+            attempt_started = time.perf_counter()
+            response = get_session(shop_url).post(graphql_url, data=payload, headers=headers, timeout=get_timeout(), stream=True)
+            logger.debug("Shopify API response status: %s for %s", response.status_code, shop_url) # Added
+            if response.status_code == 429 and attempt < rate_limiter.SHOPIFY_THROTTLE_MAX_RETRIES:
+                breaker.record_success()
+                retry_after = float(response.headers.get("Retry-After", 0) or 0)
+                logger.warning("HTTP 429 from %s for %s (attempt %s)", shop_url, operation_name, attempt + 1)
+                metrics.SHOPIFY_THROTTLED.inc(**labels)
+            else:
+                response.raise_for_status()  # Raises an exception for HTTP errors
+                # Decode the body exactly once, with the fast JSON backend if available.
+                response_json = fast_json.loads(read_body(response))
+                breaker.record_success()
+                metrics.SHOPIFY_ROUNDTRIP_SECONDS.observe(time.perf_counter() - attempt_started, **labels)
+                cost_info = rate_limiter.get_cost_info(response_json)
+                throttle_status = cost_info.get("throttleStatus")
+                rate_limiter.cost_tracker.record(operation_name, cost_info.get("requestedQueryCost"), cost_info.get("actualQueryCost"))
+                if cost_info.get("actualQueryCost") is not None:
+                    metrics.SHOPIFY_QUERY_COST.observe(cost_info["actualQueryCost"], **labels)
+                if rate_limiter.is_throttled(response_json) and attempt < rate_limiter.SHOPIFY_THROTTLE_MAX_RETRIES:
+                    retry_after = 0.0
+                    logger.warning("GraphQL request %s to %s was THROTTLED (attempt %s)", operation_name, shop_url, attempt + 1)
+                    metrics.SHOPIFY_THROTTLED.inc(**labels)
+                else:
+                    outcome = "success"
+                    if 'errors' in response_json:
+                        logger.warning("GraphQL request to %s returned errors: %s", shop_url, log_utils.payload(response_json['errors'])) # Added
+                        metrics.SHOPIFY_ERRORS.inc(type="graphql", **labels)
+                        outcome = "graphql_error"
+                    metrics.SHOPIFY_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=outcome, **labels)
+                    return response_json
+        except requests.exceptions.RequestException as req_err:
+            transient = is_transient_error(req_err)
+            if transient:
+                breaker.record_failure()
+            else:
+                breaker.record_success() # Shopify answered; the request itself was bad
+            if (transient and retries < SHOPIFY_RETRY_MAX_RETRIES and is_retry_safe(query, req_err)
+                    and not breaker.is_degraded()):
+                retry_delay = backoff_with_jitter(retries)
+                logger.warning("Transient error calling %s on %s (%s); retry %s in %.2fs", operation_name, shop_url, req_err, retries + 1, retry_delay)
+                metrics.SHOPIFY_RETRIES.inc(**labels)
+            elif isinstance(req_err, requests.exceptions.HTTPError):
+                _record_failure(labels, started, "http")
+                logger.error("HTTP error occurred while calling Shopify API for %s: %s - Response: %s", shop_url, req_err, log_utils.truncate(read_error_body(response)), exc_info=True) # Added
+                raise # Re-raise the exception after logging
+            else:
+                _record_failure(labels, started, "request")
+                logger.error("Request exception occurred while calling Shopify API for %s: %s", shop_url, req_err, exc_info=True) # Added
+                raise # Re-raise the exception after logging
+        except Exception as e:
+            breaker.record_success() # Not an availability problem (e.g. an undecodable body)
+            _record_failure(labels, started, "unexpected")
+            logger.error("An unexpected error occurred in make_graphql_request for %s: %s", shop_url, e, exc_info=True) # Added
+            raise # Re-raise the exception
+        finally:
+            bucket.release(predicted_cost, throttle_status)
+            if response is not None:
+                # Streamed responses hold their pooled connection until read or closed;
+                # error responses that are retried or raised are never fully read.
+                response.close()
+        if retry_delay is not None:
+            time.sleep(retry_delay)
+            retries += 1
+            continue
+        # Throttled: back off (at least until the bucket has restored this call's cost) and retry.
+        delay = max(retry_after, rate_limiter.backoff_delay(attempt, bucket, predicted_cost))
+        logger.info("Retrying %s on %s in %.2fs", operation_name, shop_url, delay)
+        metrics.SHOPIFY_THROTTLE_WAIT_SECONDS.inc(delay, **labels)
+        time.sleep(delay)
+        attempt += 1
 
-def search_products(shop_url: str, access_token: str, search_query: str, num_products: int = 10, cursor: str = None):
+def search_products(shop_url: str, access_token: str, search_query: str, num_products: int = 10, cursor: str = None,
+                    profile: str = "full"):
     """
     Searches for products in the Shopify store using GraphQL, with pagination support.
+    `profile` ("minimal", "list" or "full", see queries.py) selects how many product
+    fields are fetched. Successful results are served from product_search_cache until
+    they expire or the shop's entries are invalidated; if the API call fails, an
+    expired entry is served instead of an empty result when one is still kept.
     """
-    logger.info(f"Searching products for shop: {{shop_url}} with query: '{{search_query}}', cursor: {{cursor}}")
-    # Added cursor to the GraphQL query variables and products query arguments
-    # Added hasPreviousPage, startCursor, endCursor to pageInfo
-    query = """
-    query searchProducts($searchQuery: String!, $numProducts: Int!, $cursor: String) {
-      products(first: $numProducts, query: $searchQuery, after: $cursor) {
-        edges {
-          node {
-            id
-            title
-            descriptionHtml
-            onlineStoreUrl
-            featuredImage {
-              url
-            }
-            variants(first: 5) {
-              edges {
-                node {
-                  id
-                  title
-                  price
-                  image {
-                    url
-                  }
-                }
-              }
-            }
-          }
-        }
-        pageInfo {
-          hasNextPage
-          hasPreviousPage
-          startCursor
-          endCursor
-        }
-      }
-    }
-    """
+    query = queries.SEARCH_PRODUCTS_QUERIES.get(profile)
+    if query is None:
+        raise ValueError(f"Unknown field-selection profile: {profile}")
+    cache_key = (shop_url, search_query, num_products, cursor, profile)
+    cached = product_search_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Product search cache hit for '%s' on %s", search_query, shop_url)
+        return cached
+    logger.info("Searching products for shop: %s with query: '%s', cursor: %s", shop_url, search_query, cursor)
     variables = {
         "searchQuery": search_query,
         "numProducts": num_products
@@ -98,170 +299,264 @@ def search_products(shop_url: str, access_token: str, search_query: str, num_pro
             products_data = response_data["data"]["products"]
             products = products_data["edges"]
             page_info = products_data["pageInfo"]
-            logger.info(f"Found {{len(products)}} products for query '{{search_query}}' on {{shop_url}}")
+            logger.info("Found %s products for query '%s' on %s", len(products), search_query, shop_url)
 
             # Return a dictionary containing both products and pageInfo
-            return {"products": products, "pageInfo": page_info}
+            result = {"products": products, "pageInfo": page_info}
+            product_search_cache.set(cache_key, result)
+            return result
         else:
-            logger.warning(f"No products found or unexpected response structure for query '{{search_query}}' on {{shop_url}}. Response: {{response_data}}")
+            logger.warning("No products found or unexpected response structure for query '%s' on %s. Response: %s", search_query, shop_url, log_utils.payload(response_data))
             # Return empty products list and pageInfo dictionary in case of no data or error
             return {"products": [], "pageInfo": {"hasNextPage": False, "hasPreviousPage": False, "startCursor": None, "endCursor": None}}
     except Exception as e:
-        logger.error(f"Error searching products on {{shop_url}} with query '{{search_query}}': {{e}}", exc_info=True)
+        logger.error("Error searching products on %s with query '%s': %s", shop_url, search_query, e, exc_info=True)
+        stale = product_search_cache.get(cache_key, allow_stale=True)
+        if stale is not None:
+            logger.warning("Serving stale product search results for '%s' on %s", search_query, shop_url)
+            return stale
         # Return empty products list and pageInfo dictionary in case of an exception
         return {"products": [], "pageInfo": {"hasNextPage": False, "hasPreviousPage": False, "startCursor": None, "endCursor": None}}
 
+def invalidate_product_search_cache(shop_url: str) -> int:
+    """
+    Drops all cached product searches for a shop, e.g. when a products/update
+    webhook arrives. Returns the number of entries removed.
+    """
+    return product_search_cache.invalidate_where(lambda key: key[0] == shop_url)
+
 def get_draft_order_details(shop_url: str, access_token: str, draft_order_gid: str):
     """
     Fetches details for a specific draft order using GraphQL.
     """
-    logger.info(f"Fetching details for draft order GID: {draft_order_gid} on shop: {shop_url}")
-    query = """
-    query getDraftOrder($id: ID!) {
-      draftOrder(id: $id) {
-        id
-        name
-        status # e.g., OPEN, INVOICE_SENT, COMPLETED
-        totalPriceSet {
-          presentmentMoney {
-            amount
-            currencyCode
-          }
-        }
-        lineItems(first: 10) {
-          edges {
-            node {
-              title
-              quantity
-              variantTitle
-              originalUnitPriceSet {
-                 presentmentMoney {
-                    amount
-                    currencyCode
-                }
-              }
-            }
-          }
-        }
-        shippingAddress {
-          firstName
-          lastName
-          address1
-          address2
-          city
-          zip
-          country
-          province
-          phone
-        }
-        email
-        # If the draft order is completed, this field will contain the actual order
-        order {
-          id
-          name
-          legacyResourceId # Useful for linking to Shopify admin
-          displayFinancialStatus
-          displayFulfillmentStatus
-        }
-        invoiceUrl # URL to the invoice if sent
-        completedAt
-      }
-    }
-    """
+    logger.info("Fetching details for draft order GID: %s on shop: %s", draft_order_gid, shop_url)
     variables = {"id": draft_order_gid}
     try:
-        response_data = make_graphql_request(shop_url, access_token, query, variables)
+        response_data = make_graphql_request(shop_url, access_token, queries.GET_DRAFT_ORDER_QUERY, variables)
         if response_data.get("data") and response_data["data"].get("draftOrder"):
             draft_order = response_data["data"]["draftOrder"]
-            logger.info(f"Successfully fetched draft order details for {draft_order_gid}")
+            logger.info("Successfully fetched draft order details for %s", draft_order_gid)
             return draft_order
         elif response_data.get("errors"):
-            logger.error(f"GraphQL errors fetching draft order {draft_order_gid}: {response_data['errors']}")
+            logger.error("GraphQL errors fetching draft order %s: %s", draft_order_gid, response_data['errors'])
             return None
         else:
-            logger.warning(f"No draft order data found or unexpected response for {draft_order_gid}. Response: {response_data}")
+            logger.warning("No draft order data found or unexpected response for %s. Response: %s", draft_order_gid, log_utils.payload(response_data))
             return None
     except Exception as e:
-        logger.error(f"Error fetching draft order {draft_order_gid}: {e}", exc_info=True)
+        logger.error("Error fetching draft order %s: %s", draft_order_gid, e, exc_info=True)
         return None
 
-def get_order_details(shop_url: str, access_token: str, order_gid: str):
+def get_order_details(shop_url: str, access_token: str, order_gid: str, profile: str = "full"):
     """
     Fetches details for a specific real order using GraphQL.
+    `profile` ("minimal", "list" or "full", see queries.py) selects how many order
+    fields are fetched.
     """
-    logger.info(f"Fetching details for order GID: {order_gid} on shop: {shop_url}")
-    query = """
-    query getOrder($id: ID!) {
-      order(id: $id) {
+    query = queries.GET_ORDER_QUERIES.get(profile)
+    if query is None:
+        raise ValueError(f"Unknown field-selection profile: {profile}")
+    logger.info("Fetching details for order GID: %s on shop: %s (profile: %s)", order_gid, shop_url, profile)
+    variables = {"id": order_gid}
+    try:
+        response_data = make_graphql_request(shop_url, access_token, query, variables)
+        if response_data.get("data") and response_data["data"].get("order"):
+            order_data = response_data["data"]["order"]
+            logger.info("Successfully fetched order details for %s", order_gid)
+            return order_data
+        elif response_data.get("errors"):
+            logger.error("GraphQL errors fetching order %s: %s", order_gid, response_data['errors'])
+            return None
+        else:
+            logger.warning("No order data found or unexpected response for %s. Response: %s", order_gid, log_utils.payload(response_data))
+            return None
+    except Exception as e:
+        logger.error("Error fetching order %s: %s", order_gid, e, exc_info=True)
+        return None
+
+# Page queries used by the streaming iterators below. Each takes $pageSize, $searchQuery
+# and $cursor and selects pageInfo.endCursor so the iterator can walk the connection.
+PRODUCTS_PAGE_QUERY = queries.register("""
+query productsPage($pageSize: Int!, $searchQuery: String, $cursor: String) {
+  products(first: $pageSize, query: $searchQuery, after: $cursor) {
+    edges {
+      node {
         id
-        name
-        legacyResourceId
-        app
-        email
-        createdAt
-        displayFinancialStatus
-        displayFulfillmentStatus 
-        totalPriceSet {
-          presentmentMoney {
-            amount
-            currencyCode
-          }
+        title
+        descriptionHtml
+        onlineStoreUrl
+        updatedAt
+        featuredImage {
+          url
         }
-        lineItems(first: 10) {
+        variants(first: 5) {
           edges {
             node {
+              id
               title
-              quantity
-              variantTitle
-              originalUnitPriceSet {
-                 presentmentMoney {
-                    amount
-                    currencyCode
-                }
+              sku
+              price
+              image {
+                url
               }
             }
           }
         }
-        shippingAddress {
-          firstName
-          lastName
+      }
+    }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+  }
+}
+""")
+
+CUSTOMERS_PAGE_QUERY = queries.register("""
+query customersPage($pageSize: Int!, $searchQuery: String, $cursor: String) {
+  customers(first: $pageSize, query: $searchQuery, after: $cursor) {
+    edges {
+      node {
+        id
+        firstName
+        lastName
+        updatedAt
+        email: defaultEmailAddress {
+          emailAddress
+        }
+        phone: defaultPhoneNumber {
+          phoneNumber
+        }
+        addresses(first: 5) {
           address1
           address2
           city
           zip
-          country
-          province
+          provinceCode
+          countryCodeV2
+          formatted
           phone
         }
-        note
-        fulfillments(first: 5) { # Returns a list of Fulfillment objects
-          id
-          status 
-          deliveredAt 
-          displayStatus 
-          trackingInfo { # Returns a list of FulfillmentTrackingInfo objects
-            url 
-            company
-            number
+      }
+    }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+  }
+}
+""")
+
+ORDERS_PAGE_QUERY = queries.register("""
+query ordersPage($pageSize: Int!, $searchQuery: String, $cursor: String) {
+  orders(first: $pageSize, query: $searchQuery, after: $cursor, sortKey: UPDATED_AT) {
+    edges {
+      node {
+        id
+        name
+        email
+        createdAt
+        updatedAt
+        cancelledAt
+        displayFinancialStatus
+        displayFulfillmentStatus
+        tags
+        customAttributes {
+          key
+          value
+        }
+        totalPriceSet {
+          shopMoney {
+            amount
+            currencyCode
+          }
+        }
+        totalDiscountsSet {
+          shopMoney {
+            amount
+            currencyCode
           }
         }
-        # Add any other order fields you need
+        fulfillments(first: 5) {
+          createdAt
+          deliveredAt
+          displayStatus
+        }
       }
     }
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+  }
+}
+""")
+
+# Shared by every iter_connection call in the process. Each iterator has at most one
+# page in flight (page N+1 is fetched while the caller processes page N), so this caps
+# how many streamed exports can prefetch at once; further prefetches queue for a thread.
+_prefetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SHOPIFY_PREFETCH_WORKERS', '4')), thread_name_prefix="shopify-prefetch")
+
+def _fetch_page(shop_url: str, access_token: str, query: queries.Query, connection: str, variables: dict) -> dict:
+    response_data = make_graphql_request(shop_url, access_token, query, variables)
+    page = (response_data.get("data") or {}).get(connection)
+    if page is None:
+        raise RuntimeError(f"Failed to fetch {connection} page from {shop_url}: {response_data.get('errors')}")
+    return page
+
+def iter_connection(shop_url: str, access_token: str, query: queries.Query, connection: str,
+                    search_query: str = None, page_size: int = 50, prefetch: bool = True):
     """
-    variables = {"id": order_gid}
+    Lazily yields every node of a paginated top-level connection (e.g. "products").
+
+    Only the current page (plus, with prefetch, the next one) is held in memory, so
+    callers can stream arbitrarily large result sets. The next page is requested in
+    the background as soon as the current page's endCursor is known.
+    """
+    def variables_for(cursor):
+        variables = {"pageSize": page_size, "searchQuery": search_query}
+        if cursor:
+            variables["cursor"] = cursor
+        return variables
+
+    pending = None
+    page = _fetch_page(shop_url, access_token, query, connection, variables_for(None))
+    pages = 1
     try:
-        response_data = make_graphql_request(shop_url, access_token, query, variables)
-        if response_data.get("data") and response_data["data"].get("order"):
-            order_data = response_data["data"]["order"]
-            logger.info(f"Successfully fetched order details for {order_gid}")
-            return order_data
-        elif response_data.get("errors"):
-            logger.error(f"GraphQL errors fetching order {order_gid}: {response_data['errors']}")
-            return None
-        else:
-            logger.warning(f"No order data found or unexpected response for {order_gid}. Response: {response_data}")
-            return None
-    except Exception as e:
-        logger.error(f"Error fetching order {order_gid}: {e}", exc_info=True)
-        return None
\ No newline at end of file
+        while True:
+            page_info = page["pageInfo"]
+            if page_info.get("hasNextPage") and prefetch:
+                pending = _prefetch_executor.submit(_fetch_page, shop_url, access_token, query, connection,
+                                                    variables_for(page_info["endCursor"]))
+            for edge in page["edges"]:
+                yield edge["node"]
+            if not page_info.get("hasNextPage"):
+                break
+            if pending is not None:
+                page, pending = pending.result(), None
+            else:
+                page = _fetch_page(shop_url, access_token, query, connection, variables_for(page_info["endCursor"]))
+            pages += 1
+    finally:
+        if pending is not None:
+            pending.cancel()
+        logger.info("Iterated %s page(s) of %s on %s", pages, connection, shop_url)
+
+def iter_products(shop_url: str, access_token: str, search_query: str = None, page_size: int = 50, prefetch: bool = True):
+    """
+    Streams product nodes matching an optional search query.
+    """
+    return iter_connection(shop_url, access_token, PRODUCTS_PAGE_QUERY, "products", search_query, page_size, prefetch)
+
+def iter_customers(shop_url: str, access_token: str, search_query: str = None, page_size: int = 50, prefetch: bool = True):
+    """
+    Streams customer nodes matching an optional search query.
+    """
+    return iter_connection(shop_url, access_token, CUSTOMERS_PAGE_QUERY, "customers", search_query, page_size, prefetch)
+
+def iter_orders(shop_url: str, access_token: str, search_query: str = None, page_size: int = 50, prefetch: bool = True):
+    """
+    Streams order nodes (oldest update first) matching an optional search query,
+    e.g. "updated_at:>'2024-01-01T00:00:00Z'".
+    """
+    return iter_connection(shop_url, access_token, ORDERS_PAGE_QUERY, "orders", search_query, page_size, prefetch)
@@ -0,0 +1,65 @@
+import logging
+import os
+
+from flask import stream_template
+from markupsafe import Markup
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Template fragment caching and streamed page rendering.
+#
+# Parts of a page that only change with their inputs (the country <select>, a product
+# card for a given product version) are rendered once and reused: wrap them in
+#   {% call cache_fragment("product-card", product.id, product.updatedAt) %}...{% endcall %}
+# The key must include everything the fragment's output depends on; a key containing
+# None (e.g. a product without updatedAt) is not cached.
+FRAGMENT_CACHE_ENABLED = os.getenv('FRAGMENT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+fragment_cache = TTLCache("template_fragments", ttl=float(os.getenv("FRAGMENT_CACHE_TTL", "3600")),
+                          max_entries=int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "5000")),
+                          max_bytes=int(os.getenv("FRAGMENT_CACHE_MAX_BYTES", str(20 * 1024 * 1024))))
+
+# Streamed pages are sent in chunks of about this many bytes, so the page head goes
+# out before the body is rendered without writing every template node separately.
+TEMPLATE_STREAM_CHUNK_SIZE = int(os.getenv("TEMPLATE_STREAM_CHUNK_SIZE", "8192"))
+
+def cache_fragment(*key, caller):
+    """
+    Jinja call-block helper: returns the cached rendering of the block for `key`,
+    rendering (and caching) it on a miss.
+    """
+    if not FRAGMENT_CACHE_ENABLED or any(part is None for part in key):
+        return caller()
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(caller())
+        fragment_cache.set(key, html)
+    return html
+
+def _coalesce(chunks, size: int):
+    buffered = []
+    buffered_bytes = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_bytes += len(chunk)
+        if buffered_bytes >= size:
+            yield "".join(buffered)
+            buffered = []
+            buffered_bytes = 0
+    if buffered:
+        yield "".join(buffered)
+
+def stream_page(template_name: str, **context):
+    """
+    Renders a template as a streamed response body (flask.stream_template keeps the
+    request context available while the body is generated). Use for large pages;
+    anything the template needs from the session must be read before returning.
+    """
+    return _coalesce(stream_template(template_name, **context), TEMPLATE_STREAM_CHUNK_SIZE)
+
+def init_app(app):
+    """
+    Makes cache_fragment available to the app's templates.
+    """
+    app.jinja_env.globals["cache_fragment"] = cache_fragment
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_orders # noqa: E402
+import circuit_breaker # noqa: E402
+import orders # noqa: E402
+
+ROW = {"ref": "r1", "email": "a@example.com", "firstName": "A", "lastName": "B", "address1": "1 Main St",
+       "city": "Town", "country": "US", "zip": "12345", "line_items": [{"variantId": "11", "quantity": 2}]}
+
+class FakeShopify:
+    """
+    Answers make_graphql_request by operation name; `fail` maps an operation name to
+    an exception (or error response) for its next call.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.fail = {}
+
+    def __call__(self, shop_url, access_token, query, variables=None):
+        self.calls.append(query.name)
+        failure = self.fail.pop(query.name, None)
+        if isinstance(failure, Exception):
+            raise failure
+        if failure is not None:
+            return failure
+        if query.name == "variantPrices":
+            return {"data": {"nodes": [{"id": gid, "price": "10.00"} for gid in variables["ids"]]}}
+        if query.name == "draftOrderCreate":
+            return {"data": {"draftOrderCreate": {"draftOrder": {"id": "gid://shopify/DraftOrder/1"}, "userErrors": []}}}
+        if query.name == "draftOrderComplete":
+            order = {"id": "gid://shopify/Order/7", "name": "#1007"}
+            return {"data": {"draftOrderComplete": {"draftOrder": {"id": variables["id"], "order": order}, "userErrors": []}}}
+        raise AssertionError(f"Unexpected operation {query.name}")
+
+class BulkImportResumeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.input_path = os.path.join(self.tmp.name, "orders.jsonl")
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(ROW) + "\n")
+        self.results_path = os.path.join(self.tmp.name, "results.jsonl")
+        self.shopify = FakeShopify()
+        for patcher in (mock.patch("shopify_client.make_graphql_request", self.shopify),
+                        mock.patch.object(orders, "SHOPIFY_CHECKOUT_MODE", "draft")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_import(self):
+        return bulk_orders.run_import("shop.myshopify.com", "token", self.input_path, self.results_path, concurrency=1)
+
+    def results(self):
+        with open(self.results_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_price_lookup_errors_are_retryable(self):
+        self.shopify.fail["variantPrices"] = {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}]}
+        self.assertEqual(self.run_import(), {"retryable": 1})
+        self.assertEqual(self.run_import(), {"created": 1})
+        self.assertEqual(self.results()[-1]["order_id"], "gid://shopify/Order/7")
+
+    def test_unknown_variant_is_invalid(self):
+        self.shopify.fail["variantPrices"] = {"data": {"nodes": [None]}}
+        self.assertEqual(self.run_import(), {"invalid": 1})
+        self.assertEqual(self.run_import(), {}) # Checkpointed as failed
+
+    def test_draft_is_completed_on_resume(self):
+        self.shopify.fail["draftOrderComplete"] = circuit_breaker.CircuitOpenError("open")
+        self.assertEqual(self.run_import(), {"retryable": 1})
+        self.assertEqual(self.run_import(), {"created": 1})
+        self.assertEqual(self.shopify.calls.count("draftOrderCreate"), 1)
+        self.assertEqual(self.shopify.calls.count("draftOrderComplete"), 2)
+
+    def test_done_rows_are_skipped(self):
+        self.assertEqual(self.run_import(), {"created": 1})
+        self.assertEqual(self.run_import(), {})
+        self.assertEqual(self.shopify.calls.count("draftOrderCreate"), 1)
+
+if __name__ == '__main__':
+    unittest.main()
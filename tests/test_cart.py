@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cart_store import InMemoryCartStore, SQLiteCartStore # noqa: E402
+
+class CartTotalsTests:
+    """
+    Running totals must always match the items in the cart, for every backend.
+    """
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def add(self, variant_id, price, quantity):
+        self.store.add_item("sid", {"variant_id": variant_id, "product_title": "Tee", "variant_title": "M",
+                                    "price": price, "quantity": quantity})
+
+    def assertTotalsMatchItems(self):
+        items = self.store.get_cart("sid").values()
+        expected = sum((Decimal(item["price"]) * item["quantity"] for item in items), Decimal("0"))
+        totals = self.store.get_totals("sid")
+        self.assertEqual(totals.subtotal, expected)
+        self.assertEqual(totals.item_count, sum(item["quantity"] for item in items))
+        return totals
+
+    def test_add_and_remove(self):
+        self.add("v1", "19.99", 2)
+        self.add("v2", "0.10", 3)
+        self.assertEqual(self.assertTotalsMatchItems().subtotal, Decimal("40.28"))
+        self.assertTrue(self.store.remove_item("sid", "v1"))
+        self.assertEqual(self.assertTotalsMatchItems().subtotal, Decimal("0.30"))
+        self.assertFalse(self.store.remove_item("sid", "v1"))
+
+    def test_re_add_at_a_different_price_reprices_the_line(self):
+        self.add("v1", "10.00", 1)
+        self.add("v1", "20.00", 1)
+        self.assertEqual(self.store.get_cart("sid")["v1"]["price"], "20.00")
+        totals = self.assertTotalsMatchItems()
+        self.assertEqual((totals.subtotal, totals.item_count), (Decimal("40.00"), 2))
+
+    def test_remove_after_re_add_empties_the_totals(self):
+        self.add("v1", "10.00", 1)
+        self.add("v1", "20.00", 1)
+        self.store.remove_item("sid", "v1")
+        totals = self.assertTotalsMatchItems()
+        self.assertEqual((totals.subtotal, totals.item_count, totals.discount), (Decimal("0"), 0, Decimal("0.00")))
+
+    def test_clear(self):
+        self.add("v1", "5.00", 1)
+        self.store.clear_cart("sid")
+        self.assertEqual(self.assertTotalsMatchItems().subtotal, Decimal("0"))
+
+class InMemoryCartTotalsTest(CartTotalsTests, unittest.TestCase):
+    def make_store(self):
+        return InMemoryCartStore()
+
+class SQLiteCartTotalsTest(CartTotalsTests, unittest.TestCase):
+    def make_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteCartStore(os.path.join(directory.name, "carts.sqlite3"))
+
+if __name__ == '__main__':
+    unittest.main()
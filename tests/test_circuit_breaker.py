@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circuit_breaker # noqa: E402
+from circuit_breaker import CircuitBreaker, CircuitOpenError # noqa: E402
+
+class FakeClock:
+    """
+    Stands in for the time module so the reset timeout can elapse instantly.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(circuit_breaker, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test.myshopify.com", failure_threshold=3, reset_timeout=30)
+
+    def trip(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertTrue(self.breaker.is_degraded())
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_rejects_calls_while_open(self):
+        self.trip()
+        self.clock.now += 29
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_half_open_allows_one_trial(self):
+        self.trip()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, circuit_breaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_trial_success_closes(self):
+        self.trip()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.assertFalse(self.breaker.is_degraded())
+        self.breaker.before_call()
+
+    def test_trial_failure_reopens(self):
+        self.trip()
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertEqual(self.breaker.opened_at, self.clock.now)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.clock.now += 30
+        self.breaker.before_call()
+
+    def test_breakers_are_per_shop(self):
+        breaker = circuit_breaker.get_breaker("a.myshopify.com")
+        self.assertIs(circuit_breaker.get_breaker("a.myshopify.com"), breaker)
+        self.assertIsNot(circuit_breaker.get_breaker("b.myshopify.com"), breaker)
+        self.assertFalse(circuit_breaker.is_degraded("unknown.myshopify.com"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CatalogIndex # noqa: E402
+
+def product(product_id, title, updated_at="2024-01-01T00:00:00Z"):
+    return {"id": product_id, "title": title, "updatedAt": updated_at}
+
+class ReplaceAllTests(unittest.TestCase):
+    """
+    Webhook changes must survive a reload that was running while they arrived.
+    """
+
+    def setUp(self):
+        self.index = CatalogIndex("shop.myshopify.com")
+
+    def titles(self):
+        return {node["id"]: node["title"] for node in self.index._products.values()}
+
+    def test_webhook_changes_during_load_are_replayed(self):
+        self.index.start_recording()
+        self.index.upsert_from_webhook(product("p2", "Beta (edited)"))
+        self.index.upsert_from_webhook(product("p3", "Gamma"))
+        self.index.remove_from_webhook("p1")
+        self.index.replace_all([product("p1", "Alpha"), product("p2", "Beta", "2024-02-01T00:00:00Z")])
+        self.assertEqual(self.titles(), {"p2": "Beta (edited)", "p3": "Gamma"})
+        self.assertEqual(self.index.high_water_mark, "2024-02-01T00:00:00Z")
+        self.assertEqual(self.index.search("alp"), [])
+
+    def test_deletes_before_load_are_not_restored(self):
+        self.index.remove_from_webhook("p1")
+        self.index.replace_all([product("p1", "Alpha"), product("p2", "Beta")])
+        self.assertEqual(self.titles(), {"p2": "Beta"})
+
+    def test_changes_after_load_are_not_recorded(self):
+        self.index.start_recording()
+        self.index.replace_all([product("p1", "Alpha")])
+        self.index.upsert_from_webhook(product("p2", "Beta"))
+        self.index.replace_all([product("p1", "Alpha")])
+        self.assertEqual(self.titles(), {"p1": "Alpha"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import queries # noqa: E402
+from queries import QueryError # noqa: E402
+
+class MinifyTests(unittest.TestCase):
+
+    def test_drops_comments_whitespace_and_commas(self):
+        document = """
+        query getThing($id: ID!, $first: Int) { # trailing comment
+          # a whole-line comment
+          node(id: $id) {
+            id,
+            ... on Product { title }
+          }
+        }
+        """
+        self.assertEqual(queries.minify(document),
+                         "query getThing($id:ID!$first:Int){node(id:$id){id...on Product{title}}}")
+
+    def test_keeps_strings_intact(self):
+        document = 'query q { products(query: "tag:a, # not a comment") { edges { node { id } } } }'
+        self.assertIn('"tag:a, # not a comment"', queries.minify(document))
+
+    def test_rejects_unknown_characters(self):
+        with self.assertRaises(QueryError):
+            queries.minify("query q { id % }")
+
+class ValidateTests(unittest.TestCase):
+
+    def test_returns_operation_type_and_name(self):
+        self.assertEqual(queries.validate("mutation doIt($id: ID!) { thing(id: $id) { id } }"), ("mutation", "doIt"))
+
+    def test_requires_one_named_operation(self):
+        for document in ("{ shop { name } }", "query a { x } query b { y }"):
+            with self.subTest(document=document), self.assertRaises(QueryError):
+                queries.validate(document)
+
+    def test_rejects_unbalanced_brackets(self):
+        for document in ("query q { shop { name }", "query q { shop(id: 1 { name } }", "query q { shop } }"):
+            with self.subTest(document=document), self.assertRaises(QueryError):
+                queries.validate(document)
+
+    def test_checks_fragments(self):
+        fragment = "fragment F on Shop { name }"
+        queries.validate("query q { shop { ...F } } " + fragment)
+        with self.assertRaisesRegex(QueryError, "Undefined fragments: F"):
+            queries.validate("query q { shop { ...F } }")
+        with self.assertRaisesRegex(QueryError, "Unused fragments: F"):
+            queries.validate("query q { shop { name } } " + fragment)
+        with self.assertRaisesRegex(QueryError, "defined twice"):
+            queries.validate("query q { shop { ...F } } " + fragment + " " + fragment)
+
+    def test_checks_variables(self):
+        with self.assertRaisesRegex(QueryError, "Undeclared variables: id"):
+            queries.validate("query q { node(id: $id) { id } }")
+
+class RegistryTests(unittest.TestCase):
+
+    def test_register_minifies_and_encodes_payload(self):
+        query = queries.register("query testRegistryPayload($id: ID!) {\n  node(id: $id) { id }\n}", cost=3)
+        self.assertEqual(query.name, "testRegistryPayload")
+        self.assertIs(queries.get("testRegistryPayload"), query)
+        self.assertEqual(json.loads(query.payload()), {"query": query.document})
+        self.assertEqual(json.loads(query.payload({"id": "gid://shopify/Shop/1"})),
+                         {"query": query.document, "variables": {"id": "gid://shopify/Shop/1"}})
+
+    def test_conflicting_registration_is_rejected(self):
+        queries.register("query testRegistryConflict { shop { name } }")
+        queries.register("query testRegistryConflict {\n shop { name }\n}") # Same document once minified
+        with self.assertRaises(QueryError):
+            queries.register("query testRegistryConflict { shop { id } }")
+
+    def test_as_query_compiles_ad_hoc_documents(self):
+        query = queries.as_query("query adhocShop { shop { name } }")
+        self.assertEqual((query.name, query.document), ("adhocShop", "query adhocShop{shop{name}}"))
+        self.assertIs(queries.as_query(query), query)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limiter # noqa: E402
+
+class FakeClock:
+    """
+    Stands in for the time module: sleep() advances monotonic() instead of blocking.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class LeakyBucketTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limiter, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = rate_limiter.LeakyBucket(maximum_available=100, restore_rate=10)
+
+    def test_acquire_within_budget_does_not_wait(self):
+        self.assertEqual(self.bucket.acquire(60), 0.0)
+        self.assertEqual(self.bucket.acquire(40), 0.0)
+        self.assertEqual(self.clock.slept, [])
+        self.assertEqual(self.bucket.currently_available, 0)
+
+    def test_acquire_waits_for_the_shortfall(self):
+        self.bucket.acquire(80)
+        self.assertEqual(self.bucket.acquire(50), 3.0) # 30 points short at 10 points/s
+        self.assertEqual(self.clock.slept, [3.0])
+
+    def test_cost_is_capped_at_bucket_size(self):
+        self.assertEqual(self.bucket.acquire(500), 0.0)
+        self.assertEqual(self.bucket.in_flight_cost, 100)
+
+    def test_refill_is_capped_at_maximum(self):
+        self.bucket.acquire(100)
+        self.clock.now += 4
+        self.assertEqual(self.bucket.time_until_available(100), 6.0)
+        self.clock.now += 60
+        self.assertEqual(self.bucket.time_until_available(100), 0.0)
+        self.assertEqual(self.bucket.currently_available, 100)
+
+    def test_release_syncs_with_throttle_status(self):
+        self.bucket.acquire(30)
+        self.bucket.acquire(20)
+        self.bucket.release(30, {"maximumAvailable": 2000, "currentlyAvailable": 1500, "restoreRate": 100})
+        self.assertEqual(self.bucket.maximum_available, 2000)
+        self.assertEqual(self.bucket.restore_rate, 100)
+        # The 20 points still in flight stay deducted from Shopify's figure.
+        self.assertEqual(self.bucket.currently_available, 1480)
+        self.bucket.release(20)
+        self.assertEqual(self.bucket.in_flight_cost, 0)
+
+    def test_backoff_waits_for_the_bucket(self):
+        self.bucket.acquire(100)
+        self.assertEqual(rate_limiter.backoff_delay(0, self.bucket, 50), 5.0)
+        self.assertEqual(rate_limiter.backoff_delay(0), rate_limiter.SHOPIFY_THROTTLE_BACKOFF_BASE)
+
+class CostTrackerTests(unittest.TestCase):
+
+    def test_observed_cost_replaces_estimate(self):
+        tracker = rate_limiter.CostTracker()
+        self.assertEqual(tracker.predict("getThing"), rate_limiter.DEFAULT_QUERY_COST)
+        tracker.estimate("getThing", 12)
+        self.assertEqual(tracker.predict("getThing"), 12)
+        tracker.record("getThing", requested_cost=30, actual_cost=7)
+        tracker.estimate("getThing", 12)
+        self.assertEqual(tracker.predict("getThing"), 30)
+        self.assertEqual(tracker.actual("getThing"), 7)
+
+    def test_throttled_responses(self):
+        throttled = {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}]}
+        self.assertTrue(rate_limiter.is_throttled(throttled))
+        self.assertFalse(rate_limiter.is_throttled({"errors": [{"message": "Bad"}]}))
+        self.assertFalse(rate_limiter.is_throttled({"data": {}}))
+
+if __name__ == '__main__':
+    unittest.main()
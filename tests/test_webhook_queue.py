@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_queue # noqa: E402
+from webhook_queue import WebhookQueue, WebhookWorker # noqa: E402
+
+class FakeClock:
+    """
+    Stands in for the time module: time() drives log retention, monotonic() retries.
+    """
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+class FakeDispatch:
+    """
+    Records dispatched events; topics in `failing` report a failed handler.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+
+    def __call__(self, topic, shop_url, payload):
+        self.calls.append((topic, shop_url, payload))
+        return ["handler"] if topic in self.failing else []
+
+class WebhookQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.clock = FakeClock()
+        self.dispatch = FakeDispatch()
+        for patcher in (mock.patch.object(webhook_queue, "time", self.clock),
+                        mock.patch.object(webhook_queue.webhooks, "dispatch", self.dispatch)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.queue = WebhookQueue(os.path.join(directory.name, "webhooks.sqlite3"), retention=600)
+
+    def enqueue(self, topic="products/update", webhook_id=None, **payload):
+        return self.queue.enqueue(topic, "test.myshopify.com", json.dumps(payload), webhook_id)
+
+    def test_enqueue_ignores_redelivered_webhooks(self):
+        self.assertTrue(self.enqueue(webhook_id="abc", id=1))
+        self.assertFalse(self.enqueue(webhook_id="abc", id=1))
+        self.assertTrue(self.enqueue(id=2))
+        self.assertTrue(self.enqueue(id=2)) # No webhook ID to dedupe on
+        self.assertEqual(self.queue.counts(), {"events": 3})
+
+    def test_every_worker_applies_every_event(self):
+        first, second = WebhookWorker(self.queue), WebhookWorker(self.queue)
+        self.enqueue(id=1)
+        self.enqueue(id=2)
+        self.assertEqual(first.process_pending(), 2)
+        self.assertEqual(second.process_pending(), 2)
+        self.assertEqual(first.process_pending(), 0)
+        self.assertEqual([payload["id"] for _, _, payload in self.dispatch.calls], [1, 2, 1, 2])
+
+    def test_worker_starts_at_end_of_log(self):
+        self.enqueue(id=1)
+        worker = WebhookWorker(self.queue)
+        self.enqueue(id=2)
+        worker.process_pending()
+        self.assertEqual([payload["id"] for _, _, payload in self.dispatch.calls], [2])
+
+    def test_failed_event_is_retried_with_backoff_then_dropped(self):
+        worker = WebhookWorker(self.queue, max_attempts=3)
+        self.dispatch.failing.add("products/delete")
+        self.enqueue("products/delete", id=1)
+        self.enqueue(id=2)
+        self.assertEqual(worker.process_pending(), 2) # The failure doesn't hold up event 2
+        self.assertEqual(worker.process_pending(), 0)
+        self.clock.now += 2
+        self.assertEqual(worker.process_pending(), 1)
+        self.clock.now += 3
+        self.assertEqual(worker.process_pending(), 0) # Second retry backs off 4s
+        self.clock.now += 1
+        self.assertEqual(worker.process_pending(), 1)
+        self.clock.now += 3600
+        self.assertEqual(worker.process_pending(), 0)
+        self.assertEqual([topic for topic, _, _ in self.dispatch.calls],
+                         ["products/delete", "products/update", "products/delete", "products/delete"])
+
+    def test_retry_succeeds(self):
+        worker = WebhookWorker(self.queue)
+        self.dispatch.failing.add("products/update")
+        self.enqueue(id=1)
+        worker.process_pending()
+        self.dispatch.failing.clear()
+        self.clock.now += 2
+        worker.process_pending()
+        self.clock.now += 3600
+        self.assertEqual(worker.process_pending(), 0)
+        self.assertEqual(len(self.dispatch.calls), 2)
+
+    def test_prune_deletes_expired_events_once_per_interval(self):
+        self.enqueue(id=1)
+        self.clock.now += 300
+        self.enqueue(id=2)
+        self.clock.now += 400
+        self.assertEqual(self.queue.prune(), 1)
+        self.clock.now += 400
+        self.assertEqual(self.queue.prune(), 0) # Throttled by PRUNE_INTERVAL
+        self.assertEqual(self.queue.counts(), {"events": 1})
+        self.clock.now += WebhookQueue.PRUNE_INTERVAL
+        self.assertEqual(self.queue.prune(), 1)
+        self.assertEqual(self.queue.counts(), {"events": 0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Where shop access tokens are kept. The SQLite backend lets every worker process
+# (e.g. several gunicorn workers behind a load balancer) share tokens obtained during
+# OAuth, and keeps them across restarts. The memory backend is only suitable for a
+# single development process.
+TOKEN_STORE_BACKEND = os.getenv('TOKEN_STORE_BACKEND', 'sqlite')
+TOKEN_STORE_PATH = os.getenv('TOKEN_STORE_PATH', 'shopify_tokens.sqlite3')
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '60'))
+
+class TokenStore:
+    """
+    Interface for access token storage, keyed by shop domain (shop.myshopify.com).
+    """
+
+    def get(self, shop_url: str):
+        raise NotImplementedError
+
+    def set(self, shop_url: str, access_token: str, scope: str = None):
+        raise NotImplementedError
+
+    def delete(self, shop_url: str):
+        raise NotImplementedError
+
+class InMemoryTokenStore(TokenStore):
+    """
+    Process-local token store (the previous active_shops dict behaviour).
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, shop_url: str):
+        return self._tokens.get(shop_url)
+
+    def set(self, shop_url: str, access_token: str, scope: str = None):
+        with self._lock:
+            self._tokens[shop_url] = access_token
+
+    def delete(self, shop_url: str):
+        with self._lock:
+            self._tokens.pop(shop_url, None)
+
+class SQLiteTokenStore(TokenStore):
+    """
+    SQLite-backed token store with an in-process read-through cache.
+
+    Reads are served from the cache for up to `cache_ttl` seconds, so the hot path
+    (every authenticated request) normally costs a dict lookup; a token rotated or
+    removed by another worker is picked up once the cached entry expires.
+    """
+
+    def __init__(self, path: str, cache_ttl: float = TOKEN_CACHE_TTL):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self._cache = {} # shop_url -> (expires_at, access_token)
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shop_tokens (
+                    shop_url TEXT PRIMARY KEY,
+                    access_token TEXT NOT NULL,
+                    scope TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        logger.info("Using SQLite token store at %s", path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, shop_url: str):
+        now = time.monotonic()
+        cached = self._cache.get(shop_url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        row = self._connect().execute(
+            "SELECT access_token FROM shop_tokens WHERE shop_url = ?", (shop_url,)
+        ).fetchone()
+        access_token = row[0] if row else None
+        with self._cache_lock:
+            if access_token is None:
+                self._cache.pop(shop_url, None)
+            else:
+                self._cache[shop_url] = (now + self.cache_ttl, access_token)
+        return access_token
+
+    def set(self, shop_url: str, access_token: str, scope: str = None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO shop_tokens (shop_url, access_token, scope, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(shop_url) DO UPDATE SET access_token = excluded.access_token, "
+                "scope = excluded.scope, updated_at = excluded.updated_at",
+                (shop_url, access_token, scope, time.time())
+            )
+        with self._cache_lock:
+            self._cache[shop_url] = (time.monotonic() + self.cache_ttl, access_token)
+
+    def delete(self, shop_url: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM shop_tokens WHERE shop_url = ?", (shop_url,))
+        with self._cache_lock:
+            self._cache.pop(shop_url, None)
+
+def create_token_store(backend: str = TOKEN_STORE_BACKEND, path: str = TOKEN_STORE_PATH) -> TokenStore:
+    """
+    Builds the configured token store backend ("sqlite" or "memory").
+    """
+    if backend == 'memory':
+        logger.warning("Using in-memory token store; tokens are lost on restart and not shared between workers.")
+        return InMemoryTokenStore()
+    if backend == 'sqlite':
+        return SQLiteTokenStore(path)
+    raise ValueError(f"Unknown TOKEN_STORE_BACKEND: {backend}")
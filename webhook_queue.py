@@ -0,0 +1,172 @@
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import webhooks
+
+logger = logging.getLogger(__name__)
+
+# Durable log between the /webhooks endpoint and the background workers that apply
+# webhook payloads to local caches. The endpoint only verifies and appends, so
+# Shopify gets its 200 within milliseconds. The SQLite file is shared by every worker
+# process, and the caches the handlers update are per process, so every process
+# applies every event: each one follows the log with its own cursor (starting at the
+# end of the log when it starts, since its caches are empty then). Events are kept
+# for WEBHOOK_LOG_RETENTION seconds.
+WEBHOOK_QUEUE_PATH = os.getenv('WEBHOOK_QUEUE_PATH', 'shopify_webhooks.sqlite3')
+# Each process applies events in log order with a single consumer thread; "false"
+# disables applying events in this process (it still appends them).
+WEBHOOK_WORKER_ENABLED = os.getenv('WEBHOOK_WORKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '5'))
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', '1'))
+WEBHOOK_LOG_RETENTION = float(os.getenv('WEBHOOK_LOG_RETENTION', '86400'))
+
+class WebhookQueue:
+    """
+    SQLite-backed append-only log of webhook events, read by every process.
+    """
+
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, path: str = WEBHOOK_QUEUE_PATH, retention: float = WEBHOOK_LOG_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        self._available = threading.Event()
+        self._last_pruned = 0.0
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                webhook_id TEXT UNIQUE,
+                topic TEXT NOT NULL,
+                shop_url TEXT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_webhook_log_created_at ON webhook_log (created_at)")
+        logger.info("Using webhook log at %s", path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, topic: str, shop_url: str, payload: str, webhook_id: str = None) -> bool:
+        """
+        Appends an event. Returns False if an event with the same X-Shopify-Webhook-Id
+        was already logged (Shopify retries deliveries it did not see acknowledged).
+        """
+        cursor = self._connect().execute(
+            "INSERT OR IGNORE INTO webhook_log (webhook_id, topic, shop_url, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (webhook_id, topic, shop_url, payload, time.time())
+        )
+        self._available.set()
+        return cursor.rowcount > 0
+
+    def latest_id(self) -> int:
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM webhook_log").fetchone()[0]
+
+    def read_after(self, event_id: int, limit: int = 100) -> list:
+        """
+        Returns up to `limit` events logged after `event_id`, oldest first, as
+        (id, topic, shop_url, payload) tuples.
+        """
+        return self._connect().execute(
+            "SELECT id, topic, shop_url, payload FROM webhook_log WHERE id > ? ORDER BY id LIMIT ?", (event_id, limit)
+        ).fetchall()
+
+    def prune(self) -> int:
+        """
+        Deletes events older than the retention period (at most once per PRUNE_INTERVAL).
+        """
+        now = time.time()
+        if now - self._last_pruned < self.PRUNE_INTERVAL:
+            return 0
+        self._last_pruned = now
+        cursor = self._connect().execute("DELETE FROM webhook_log WHERE created_at < ?", (now - self.retention,))
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        return {"events": self._connect().execute("SELECT COUNT(*) FROM webhook_log").fetchone()[0]}
+
+    def wait_for_events(self, timeout: float):
+        self._available.wait(timeout)
+        self._available.clear()
+
+class WebhookWorker:
+    """
+    Background thread that applies every logged event to this process's caches, in
+    log order. An event whose handlers fail is retried in this process with backoff
+    (without holding up later events) and dropped after max_attempts.
+    """
+
+    def __init__(self, queue: WebhookQueue, max_attempts: int = WEBHOOK_MAX_ATTEMPTS):
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.cursor = queue.latest_id() # Last event applied (or skipped) by this process
+        self._retries = [] # heap of (retry_at, event_id, attempts, topic, shop_url, payload)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="webhook-worker", daemon=True)
+        self._thread.start()
+        logger.info("Started webhook worker from event %s", self.cursor)
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self.queue._available.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def process_pending(self) -> int:
+        """
+        Applies the events logged since the cursor and any retries that are due.
+        Returns the number of events handled.
+        """
+        handled = 0
+        now = time.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, event_id, attempts, topic, shop_url, payload = heapq.heappop(self._retries)
+            self._apply(event_id, topic, shop_url, payload, attempts + 1)
+            handled += 1
+        for event_id, topic, shop_url, payload in self.queue.read_after(self.cursor):
+            self._apply(event_id, topic, shop_url, payload, 1)
+            self.cursor = event_id
+            handled += 1
+        return handled
+
+    def _apply(self, event_id: int, topic: str, shop_url: str, payload: str, attempts: int):
+        try:
+            failed = webhooks.dispatch(topic, shop_url, json.loads(payload))
+        except Exception as e:
+            failed = [str(e)]
+        if not failed:
+            return
+        if attempts >= self.max_attempts:
+            logger.error("Webhook event %s (%s) failed %s times; giving up: %s", event_id, topic, attempts, ', '.join(failed))
+            return
+        retry_at = time.monotonic() + min(300, 2 ** attempts)
+        heapq.heappush(self._retries, (retry_at, event_id, attempts, topic, shop_url, payload))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self.process_pending():
+                    self.queue.prune()
+                    self.queue.wait_for_events(WEBHOOK_POLL_INTERVAL)
+            except Exception as e:
+                logger.error("Webhook worker error: %s", e, exc_info=True)
+                time.sleep(WEBHOOK_POLL_INTERVAL)
@@ -0,0 +1,54 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Shopify signs webhook bodies with the app's client secret
+# (https://shopify.dev/docs/apps/build/webhooks/subscribe/https#step-5-verify-the-webhook).
+SHOPIFY_WEBHOOK_SECRET = os.getenv('SHOPIFY_WEBHOOK_SECRET') or os.getenv('SHOPIFY_CLIENT_SECRET')
+
+_handlers = {} # topic -> list of handler(shop_url, payload)
+
+def verify_hmac(body: bytes, hmac_header: str, secret: str = None) -> bool:
+    """
+    Checks the X-Shopify-Hmac-Sha256 header against the raw request body.
+    """
+    secret = secret or SHOPIFY_WEBHOOK_SECRET
+    if not secret or not hmac_header:
+        return False
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+    expected = base64.b64encode(digest).decode('utf-8')
+    return hmac.compare_digest(expected, hmac_header)
+
+def register(*topics):
+    """
+    Decorator registering a handler for one or more webhook topics (e.g. "orders/updated").
+    """
+    def decorator(handler):
+        for topic in topics:
+            _handlers.setdefault(topic, []).append(handler)
+        return handler
+    return decorator
+
+def is_registered(topic: str) -> bool:
+    return topic in _handlers
+
+def dispatch(topic: str, shop_url: str, payload: dict) -> list:
+    """
+    Runs every handler registered for a topic. Handler errors are logged and do not
+    stop the remaining handlers. Returns the names of the handlers that failed.
+    """
+    handlers = _handlers.get(topic, [])
+    if not handlers:
+        logger.warning("No handler registered for webhook topic %s from %s", topic, shop_url)
+    failed = []
+    for handler in handlers:
+        try:
+            handler(shop_url, payload)
+        except Exception as e:
+            logger.error("Webhook handler %s failed for %s from %s: %s", handler.__name__, topic, shop_url, e, exc_info=True)
+            failed.append(handler.__name__)
+    return failed